@@ -0,0 +1,72 @@
+from services.bulk_archive import ArchiveError, export_archive, import_archive, read_manifest, restore_data_files
+from services.sqlite_store import create_managers
+import json
+import os
+import sys
+
+USAGE = """用法:
+  python backup.py export <備份檔.zip> [資料夾]            備份所有客戶、案子、車工單價與報價歷史
+  python backup.py import <備份檔.zip> [資料夾] [--overwrite]  還原或合併到資料夾（預設 data）
+  python backup.py info <備份檔.zip>                       顯示備份內容
+
+匯入時資料夾中已有的客戶、案子、單價與報價預設保留，--overwrite 改以備份內容為準。"""
+
+def load_config(data_dir):
+    path = os.path.join(data_dir, "config.json")
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def show_progress(label):
+    def report(done, total):
+        print(f"\r{label} {done}/{total}", end="" if done < total else "\n", flush=True)
+    return report
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args) < 2 or args[0] not in ("export", "import", "info"):
+        print(USAGE)
+        sys.exit(1)
+    command, archive = args[0], args[1]
+    data_dir = args[2] if len(args) > 2 else "data"
+    try:
+        if command == "info":
+            manifest = read_manifest(archive)
+            print(f"建立於 {manifest['created_at']}：客戶 {manifest['customers']} 筆、案子 {manifest['projects']} 個、"
+                  f"車工單價 {manifest['sewing_prices']} 筆、報價紀錄 {len(manifest['histories'])} 份、"
+                  f"其他歷史檔 {len(manifest.get('extra_histories', []))} 份")
+            return
+
+        if command == "import":
+            # 先放回設定檔，還原到新資料夾時沿用原本的儲存方式
+            for name in restore_data_files(archive, data_dir):
+                print(f"已放回 {name}")
+        customer_mgr, sewing_mgr, history_mgr = create_managers(load_config(data_dir), data_dir)
+
+        if command == "export":
+            manifest = export_archive(archive, customer_mgr, sewing_mgr, history_mgr, data_dir,
+                                      progress=show_progress("備份報價紀錄"))
+            print(f"已備份 客戶 {manifest['customers']} 筆、案子 {manifest['projects']} 個、"
+                  f"車工單價 {manifest['sewing_prices']} 筆、報價紀錄 {len(manifest['histories'])} 份到 {archive}")
+            if manifest["extra_histories"]:
+                print(f"另外備份沒有對應到案子的歷史檔 {len(manifest['extra_histories'])} 份")
+            for project_id, errors in manifest["errors"].items():
+                for error in errors:
+                    print(f"案子 {project_id} 略過: {error}")
+        else:
+            stats, problems = import_archive(archive, customer_mgr, sewing_mgr, history_mgr,
+                                             overwrite="--overwrite" in sys.argv,
+                                             progress=show_progress("還原報價紀錄"))
+            print(f"新增 客戶 {stats['customers']} 筆、案子 {stats['projects']} 個、車工單價 {stats['sewing_prices']} 筆，"
+                  f"更新 {stats['updated'] + stats['sewing_prices_updated']} 筆；"
+                  f"寫入報價紀錄 {stats['histories']} 份，保留現有 {stats['histories_kept']} 份")
+            for project_id, error in problems:
+                print(f"案子 {project_id} 略過: {error}")
+        customer_mgr.close()
+    except ArchiveError as e:
+        print(e)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
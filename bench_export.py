@@ -0,0 +1,89 @@
+from services.excel_io import ExcelManager
+from services.money import Money
+from services.pricing import ItemGroup, SewingItem, SubItem
+from services.pricing_rules import PricingRules
+from openpyxl import Workbook
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+USAGE = """用法:
+  python bench_export.py [貨號數] [每個貨號的子項目數] [--memory]
+
+預設 10000 個貨號、沒有子項目，分別計時串流寫出與套用範本兩種匯出方式；
+--memory 另外量測兩種方式的記憶體峰值（tracemalloc，會讓計時變慢）。"""
+
+
+def make_quote(groups, sub_items):
+    """產生 groups 個貨號、每個貨號 sub_items 個子項目的報價資料（create_quote_from_template 的格式）"""
+    items = []
+    for i in range(groups):
+        pieces = 1 + i % 5
+        sewing = SewingItem("布料A", "單開", 150 + i % 100, 200, pieces, 350, Money.of(350) * pieces)
+        subs = [SubItem(f"配件{j}", quantity=2, unit_price=12.5, subtotal=25) for j in range(sub_items)]
+        items.append(ItemGroup(f"A{i:05d}", sewing, subs))
+    rules = PricingRules(tax_rate=0.05).compile()
+    return {
+        "company": {"company_name": "窗簾專家", "company_phone": "02-1234-5678", "company_address": "台北市"},
+        "customer": {"name": "測試客戶", "phone": "0912-345-678", "address": "新北市"},
+        "project": "效能測試",
+        "groups": items,
+        "totals": rules.totals(Money.sum(g.total for g in items)),
+        "tax_rate": rules.tax_rate,
+    }
+
+
+def make_template(path):
+    wb = Workbook()
+    wb.active.title = "報價單"
+    wb.active['A1'] = "報價單"
+    wb.save(path)
+
+
+def run(label, excel, template_path, output_path, quote_data, memory):
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    excel.create_quote_from_template(template_path, output_path, quote_data)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if memory else None
+    if memory:
+        tracemalloc.stop()
+    line = f"{label}: {elapsed:.2f} 秒，檔案 {os.path.getsize(output_path) / 1024:.0f} KB"
+    if peak is not None:
+        line += f"，記憶體峰值 {peak / 1024 / 1024:.1f} MB"
+    print(line)
+
+
+def main():
+    """比較大量明細時兩種 Excel 匯出方式的耗時
+
+    列數超過 ExcelManager.STREAMING_ROWS（2000）時匯出改以唯寫模式串流寫出，
+    此時不會載入客戶範本，輸出的是內建版面；「套用範本」一項暫時調高門檻強制走範本路徑，
+    用來對照兩者的差距。
+    """
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    try:
+        groups = int(args[0]) if args else 10000
+        sub_items = int(args[1]) if len(args) > 1 else 0
+    except ValueError:
+        print(USAGE)
+        sys.exit(1)
+    memory = "--memory" in sys.argv
+
+    quote_data = make_quote(groups, sub_items)
+    rows = groups * (1 + sub_items)
+    print(f"{groups} 個貨號、{rows} 列明細（STREAMING_ROWS = {ExcelManager.STREAMING_ROWS}）")
+    with tempfile.TemporaryDirectory() as tmp:
+        template_path = os.path.join(tmp, "template.xlsx")
+        make_template(template_path)
+        excel = ExcelManager({})
+        run("串流寫出", excel, template_path, os.path.join(tmp, "streaming.xlsx"), quote_data, memory)
+        excel.STREAMING_ROWS = rows
+        run("套用範本", excel, template_path, os.path.join(tmp, "template_out.xlsx"), quote_data, memory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# conftest.py
+# 放在專案根目錄，讓 pytest 把根目錄加入 sys.path，測試可直接 import services.*
@@ -0,0 +1,27 @@
+from services.history_binary import convert_history_dir
+import json
+import os
+import sys
+
+def main():
+    """把 data/ 的報價歷史轉成二進位（binary）或 JSON（json）格式，並更新設定的 history_format"""
+    to = sys.argv[1] if len(sys.argv) > 1 else "binary"
+    if to not in ("binary", "json"):
+        print("用法: python convert_history.py [binary|json]")
+        sys.exit(1)
+    converted, problems = convert_history_dir("data", to)
+    print(f"已轉換 {converted} 個案子的報價歷史")
+    for path, reason in problems:
+        print(f"{path}: {reason}")
+
+    config_path = "data/config.json"
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        config["history_format"] = to
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        print(f"已將 data/config.json 的 history_format 設為 {to}")
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,90 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
-from services.pricing import PricingEngine, ItemGroup, SubItem
+from services.pricing import PricingEngine, ItemGroup, SubItem, PriceNotFoundError
 from services.excel_io import ExcelManager
 from services.xlwings_io import XlwingsManager
-from services.customer_manager import CustomerManager
-from services.sewing_price_manager import SewingPriceManager
-from services.history_manager import HistoryManager
+from services.sqlite_store import create_managers
+from services.history_manager import HistoryConflictError
+from services import history_binary
+from services.save_worker import SaveWorker
+from services.price_catalog import PriceCatalog
+from services.pricing_rules import load_pricing_rules
+from services.money import Money
+from services.pricing_cache import PricingCache
+from services.scenarios import Scenario, ScenarioEngine
+from gui.widgets import AutoCompleteCombobox
 import uuid
 import os
+import itertools
+import time
 
 class CurtainPricingApp:
+    # 載入案子時每批加入畫面的貨號數；每批之間讓出事件迴圈，畫面不會停住
+    LOAD_BATCH = 200
+
     def __init__(self, root, config):
         self.root = root
         self.config = config
-        self.customer_mgr = CustomerManager("data/customers.json")
-        self.sewing_price_mgr = SewingPriceManager("data/sewing_prices.json")
-        self.history_mgr = HistoryManager("data")
-        self.pricing_engine = PricingEngine(config, self.sewing_price_mgr)
+        self.saver = SaveWorker(on_error=self._on_save_error)
+        self.customer_mgr, self.sewing_price_mgr, self.history_mgr = create_managers(config, "data", saver=self.saver)
+        self.price_catalog = PriceCatalog("data/price_catalog.jsonl")
+        self.price_catalog.publish(self.sewing_price_mgr.get_all())
+        # 計價規則只在啟動時編譯一次，計價時直接查表
+        pricing_rules = load_pricing_rules(config, "data").compile()
+        self.pricing_engine = PricingEngine(config, self.sewing_price_mgr, self.price_catalog, pricing_rules,
+                                            cache=PricingCache())
+        self.scenario_engine = ScenarioEngine(self.pricing_engine)
         self.excel_manager = ExcelManager(config)
         self.xlwings_manager = XlwingsManager(config)
-        self.quote_items = []
+        self.quote_items = self.pricing_engine.new_quote()
+        self._loading_quote = None
+        self._save_after_load = False
         self.current_customer = None
         self.setup_gui()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self._last_external_check = 0
+        self.root.bind('<FocusIn>', self.check_external_changes)
+
+    def check_external_changes(self, event=None):
+        """視窗取得焦點時檢查其他程式是否改過共用資料；沒有變更時只花幾次 stat"""
+        now = time.monotonic()
+        if now - self._last_external_check < 1.0:
+            return
+        self._last_external_check = now
+
+        if self.customer_mgr.refresh():
+            self.load_customer_names()
+            if self.current_customer:
+                customer = self.customer_mgr.get_by_id(self.current_customer['id'])
+                if customer is None:
+                    # 目前的客戶已被其他程式刪除
+                    self.current_customer = None
+                    self.quote_items = self.pricing_engine.new_quote()
+                    self.refresh_customer_list()
+                    self.refresh_quote_tree()
+                    self.update_totals()
+                else:
+                    self.current_customer = customer
+                    self.customer_info.config(text=f"客戶: {customer['name']} | {customer['phone']} | {customer['address']}")
+                    project_names = [p["name"] for p in self.customer_mgr.get_projects(customer["id"])]
+                    self.project_combo.config(values=project_names)
+                    if self.project_var.get() not in project_names:
+                        self.refresh_project_list()
+                        self.on_project_selected()
+
+        if self.sewing_price_mgr.refresh():
+            self.refresh_sewing_prices()
+
+        project = self.get_current_project()
+        if (project and self.history_mgr.is_stale(project['id'])
+                and not self.saver.is_pending(('history', project['id']))):
+            self.load_project_quote(project['id'])
+
+    def on_close(self):
+        """關閉視窗前把尚未寫出、尚未合併的資料寫回檔案"""
+        self.saver.stop()
+        self.customer_mgr.close()
+        self.root.destroy()
 
     def setup_gui(self):
         self.root.title("窗簾計價系統 v2.9")
@@ -80,9 +143,10 @@ class CurtainPricingApp:
         cust_frame.grid(row=0, column=0, sticky="w")
         ttk.Label(cust_frame, text="選擇客戶:").grid(row=0, column=0, sticky="w", padx=(0, 5))
         self.customer_var = tk.StringVar()
-        self.customer_combo = ttk.Combobox(cust_frame, textvariable=self.customer_var, values=[c['name'] for c in self.customer_mgr.get_all()], state="readonly", width=25)
+        self.customer_combo = AutoCompleteCombobox(cust_frame, search_func=self.search_customer_names, textvariable=self.customer_var, width=25)
         self.customer_combo.grid(row=0, column=1, sticky="w")
         self.customer_combo.bind('<<ComboboxSelected>>', self.on_customer_selected)
+        self.customer_combo.bind('<Return>', self.on_customer_selected)
         ttk.Button(cust_frame, text="管理客戶", command=self.open_customer_manager).grid(row=0, column=2, padx=(5, 0))
 
         project_frame = ttk.Frame(cf)
@@ -98,6 +162,28 @@ class CurtainPricingApp:
         self.customer_info = ttk.Label(cf, text="")
         self.customer_info.grid(row=1, column=0, columnspan=2, sticky="w", pady=(5, 0))
 
+        self._customer_load_token = 0
+        self.load_customer_names()
+
+    def load_customer_names(self, page_size=1000):
+        """分頁把客戶名稱填入下拉選單，每頁之間讓出事件迴圈，視窗可先顯示"""
+        self._customer_load_token += 1
+        token = self._customer_load_token
+        pages = self.customer_mgr.iter_name_pages(page_size)
+        names = []
+
+        def feed():
+            if token != self._customer_load_token:
+                return  # 已有較新的載入，放棄這一輪
+            page = next(pages, None)
+            if page is None:
+                return
+            names.extend(name for _, name in page)
+            self.customer_combo.set_values(names)
+            self.root.after(1, feed)
+
+        self.root.after_idle(feed)
+
     def open_customer_manager(self):
         win = tk.Toplevel(self.root)
         win.title("客戶資料管理")
@@ -110,11 +196,26 @@ class CurtainPricingApp:
         tree.heading("address", text="地址")
         tree.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
 
+        load_token = [0]
+
         def refresh_tree():
             for i in tree.get_children():
                 tree.delete(i)
-            for r in self.customer_mgr.get_all():
-                tree.insert("", "end", iid=r["id"], values=(r["name"], r["phone"], r["address"]))
+            load_token[0] += 1
+            token = load_token[0]
+            pages = self.customer_mgr.iter_pages(500)
+
+            def feed():
+                if token != load_token[0] or not tree.winfo_exists():
+                    return
+                page = next(pages, None)
+                if page is None:
+                    return
+                for r in page:
+                    tree.insert("", "end", iid=r["id"], values=(r["name"], r["phone"], r["address"]))
+                win.after(1, feed)
+
+            feed()
 
         refresh_tree()
 
@@ -157,7 +258,7 @@ class CurtainPricingApp:
                         if messagebox.askyesno("確認", "刪除客戶將會一併刪除該客戶的所有案子與報價紀錄，確定要刪除嗎？", parent=win):
                             projects = self.customer_mgr.get_projects(sel_id)
                             for proj in projects:
-                                self.history_mgr.delete_project_file(proj["id"])
+                                self.delete_project_history(proj["id"])
                             self.customer_mgr.delete(sel_id)
                 refresh_tree()
                 self.refresh_customer_list()
@@ -172,9 +273,17 @@ class CurtainPricingApp:
         form_frame.columnconfigure(1, weight=1)
         win.grab_set()
 
+    def search_customer_names(self, query, limit):
+        """供客戶下拉選單使用的搜尋，回傳不重複的客戶名稱"""
+        names = []
+        for cust in self.customer_mgr.search(query, limit):
+            if cust['name'] not in names:
+                names.append(cust['name'])
+        return names
+
     def refresh_customer_list(self):
-        customers = [c['name'] for c in self.customer_mgr.get_all()]
-        self.customer_combo.config(values=customers)
+        self.customer_combo.set_values([])
+        self.load_customer_names()
         self.customer_combo.set('')
         self.customer_info.config(text="")
         self.project_combo.config(values=[])
@@ -182,7 +291,7 @@ class CurtainPricingApp:
 
     def on_customer_selected(self, event=None):
         name = self.customer_var.get()
-        customer = next((c for c in self.customer_mgr.get_all() if c['name'] == name), None)
+        customer = self.customer_mgr.get_by_name(name)
         if not customer: return
 
         self.current_customer = customer
@@ -200,17 +309,114 @@ class CurtainPricingApp:
         if not self.current_customer: return
         project_name = self.project_var.get()
         if not project_name: 
-            self.quote_items = []
+            self.quote_items = self.pricing_engine.new_quote()
         else:
-            project = next((p for p in self.customer_mgr.get_projects(self.current_customer['id']) if p['name'] == project_name), None)
+            project = self.customer_mgr.get_project_by_name(self.current_customer['id'], project_name)
             if project:
-                self.quote_items = self.history_mgr.load_project_items(project['id'])
+                self.saver.flush(('history', project['id']))
+                self.load_project_quote(project['id'])
+                return
             else:
-                self.quote_items = []
+                self.quote_items = self.pricing_engine.new_quote()
         
         self.refresh_quote_tree()
         self.update_totals()
 
+    def load_project_quote(self, project_id):
+        """邊解析邊顯示案子的報價明細
+
+        每次只從歷史紀錄取出 LOAD_BATCH 個貨號加入畫面並更新總計，再排定下一批，
+        大檔案的前幾個貨號會先顯示出來。載入途中切換案子或換掉報價明細時停止載入；
+        無法讀取的紀錄在載入完成後一併提示。
+        """
+        quote = self.quote_items = self._loading_quote = self.pricing_engine.new_quote()
+        self._save_after_load = False
+        self.refresh_quote_tree()
+        self.update_totals()
+        errors = []
+        groups = self.history_mgr.iter_project_items(project_id, errors)
+
+        def step():
+            if self.quote_items is not quote:
+                groups.close()
+                return
+            try:
+                batch = list(itertools.islice(groups, self.LOAD_BATCH))
+            except OSError as e:
+                errors.append(e)
+                batch = []
+            for group in batch:
+                try:
+                    quote.add_group(group)
+                except ValueError as e:   # 重複的貨號
+                    errors.append(e)
+                    continue
+                self.insert_quote_group(group)
+            self.update_totals()
+            if len(batch) == self.LOAD_BATCH:
+                self.root.after(1, step)
+                return
+            self._loading_quote = None
+            if self._save_after_load:
+                self.save_current_project()
+            if errors:
+                details = "\n".join(str(e) for e in errors[:10])
+                more = f"\n…另有 {len(errors) - 10} 筆" if len(errors) > 10 else ""
+                messagebox.showwarning("注意", f"有 {len(errors)} 筆報價紀錄無法讀取，已略過：\n{details}{more}")
+
+        step()
+
+    def save_current_project(self, force=False):
+        """排定在背景保存目前案子的報價明細；連續操作只會寫一次檔
+
+        force=True 時即使案子已被其他程式修改也以目前畫面的內容寫入。
+        """
+        project = self.get_current_project()
+        if not project: return
+        if self._loading_quote is not None and self._loading_quote is self.quote_items:
+            # 還沒載入完，現在寫出會蓋掉尚未讀到的貨號；載入完成後再存
+            self._save_after_load = True
+            return
+        # 在 Tk 執行緒把目前內容序列化成不可變的位元組；背景執行緒由它還原出自己的 ItemGroup，
+        # 不會讀到畫面正在修改中的物件
+        project_id, snapshot = project['id'], history_binary.dumps(self.quote_items)
+        self.saver.schedule(('history', project_id),
+                            lambda: self.history_mgr.save_project_items(
+                                project_id, history_binary.loads(snapshot), force=force))
+
+    def _on_save_error(self, key, error):
+        """背景存檔失敗時呼叫（在存檔執行緒中）；報價衝突交回 Tk 執行緒詢問使用者"""
+        if not isinstance(error, HistoryConflictError):
+            SaveWorker._print_error(key, error)
+            return
+        try:
+            self.root.after(0, lambda: self.resolve_history_conflict(error.project_id))
+        except (tk.TclError, RuntimeError):
+            # 視窗已關閉（結束前的最後一次存檔）
+            SaveWorker._print_error(key, error)
+
+    def resolve_history_conflict(self, project_id):
+        """案子在載入後被其他程式修改：由使用者決定覆蓋或重新載入"""
+        project = self.get_current_project()
+        if not project or project['id'] != project_id:
+            messagebox.showwarning("注意", "先前案子的報價已被其他程式修改，剛才的變更沒有寫入。")
+            return
+        if messagebox.askyesno("報價衝突", "此案子的報價已被其他程式修改。\n\n"
+                               "是：以目前畫面的內容覆蓋\n否：放棄目前的變更，重新載入"):
+            self.save_current_project(force=True)
+        else:
+            self.load_project_quote(project_id)
+
+    def delete_project_history(self, project_id):
+        """刪除案子的報價紀錄，並取消尚未寫出的存檔以免檔案被重新建立"""
+        self.saver.cancel(('history', project_id))
+        self.history_mgr.delete_project_file(project_id)
+
+    def get_current_project(self):
+        """取得目前選擇的案子"""
+        if not self.current_customer: return None
+        return self.customer_mgr.get_project_by_name(self.current_customer['id'], self.project_var.get())
+
     def open_project_manager(self):
         if not self.current_customer:
             messagebox.showinfo("提示", "請先選擇一位客戶")
@@ -241,7 +447,7 @@ class CurtainPricingApp:
         def on_select(e):
             sel_id = tree.selection()
             if sel_id:
-                project = next((p for p in self.customer_mgr.get_projects(self.current_customer["id"]) if p["id"] == sel_id[0]), None)
+                _, project = self.customer_mgr.get_project(sel_id[0])
                 if project:
                     name_var.set(project['name'])
 
@@ -267,7 +473,7 @@ class CurtainPricingApp:
                     else:
                         if messagebox.askyesno("確認刪除", "確定要永久刪除這個案子與其所有報價紀錄嗎？", parent=win):
                             self.customer_mgr.delete_project(cust_id, proj_id)
-                            self.history_mgr.delete_project_file(proj_id)
+                            self.delete_project_history(proj_id)
                 refresh_project_tree()
                 self.refresh_project_list()
             except Exception as e:
@@ -362,6 +568,8 @@ class CurtainPricingApp:
         form_frame.columnconfigure(1, weight=1)
 
     def refresh_sewing_prices(self):
+        # 單價有變動時發布新版單價表，之後的報價會記錄新版本號
+        self.price_catalog.publish(self.sewing_price_mgr.get_all())
         fabrics = self.sewing_price_mgr.get_fabrics()
         self.fabric_combo.config(values=fabrics)
 
@@ -444,11 +652,19 @@ class CurtainPricingApp:
                 return
 
             sewing_item = self.pricing_engine.create_sewing_item(
-                fabric=fabric, type=sewing_type, width=0, height=0, pieces=float(pieces_str)
+                fabric=fabric, type=sewing_type,
+                width=float(self.input_vars["width"].get() or 0),
+                height=float(self.input_vars["height"].get() or 0),
+                pieces=float(pieces_str)
             )
             self.sewing_price_var.set(f"${sewing_item.unit_price:,.0f}")
             self.trial_price_var.set(f"${sewing_item.subtotal:,.0f}")
             self.add_btn.state(['!disabled'])
+        except PriceNotFoundError:
+            # 單價表沒有這個組合，不能當成 $0 報價
+            self.sewing_price_var.set(f"未設定單價（{fabric} / {sewing_type}）")
+            self.trial_price_var.set("N/A")
+            self.add_btn.state(['disabled'])
         except (ValueError, KeyError) as e:
             self.sewing_price_var.set("N/A")
             self.trial_price_var.set("N/A")
@@ -462,7 +678,7 @@ class CurtainPricingApp:
             item_number = self.input_vars['item_number'].get()
             if not item_number:
                 item_number = f"item-{uuid.uuid4().hex[:6]}"
-            if any(item.item_number == item_number for item in self.quote_items):
+            if item_number in self.quote_items:
                 messagebox.showerror("錯誤", "貨號重複!")
                 return
 
@@ -478,11 +694,8 @@ class CurtainPricingApp:
                 item_number=item_number,
                 sewing_item=sewing_item
             )
-            self.quote_items.append(new_item)
-            project_name = self.project_var.get()
-            project = next((p for p in self.customer_mgr.get_projects(self.current_customer['id']) if p['name'] == project_name), None)
-            if project:
-                self.history_mgr.save_project_items(project['id'], self.quote_items)
+            self.quote_items.add_group(new_item)
+            self.save_current_project()
             self.refresh_quote_tree()
             self.update_totals()
 
@@ -526,35 +739,39 @@ class CurtainPricingApp:
             self.quote_tree.delete(i)
 
         for item_group in self.quote_items:
-            main_id = item_group.item_number
-            self.quote_tree.insert('', 'end', iid=main_id, values=(
-                item_group.item_number,
-                f"總計: ${item_group.total:,.0f}",
-                "", "", "", ""
-            ), tags=('summary_row',))
-            self.quote_tree.item(main_id, open=True)
-
-            sewing_item = item_group.sewing_item
-            sewing_id = f"{main_id}-sewing"
-            self.quote_tree.insert(main_id, 'end', iid=sewing_id, values=(
+            self.insert_quote_group(item_group)
+
+    def insert_quote_group(self, item_group):
+        """在明細表最後加入一個貨號（含車工與子項目）"""
+        main_id = item_group.item_number
+        self.quote_tree.insert('', 'end', iid=main_id, values=(
+            item_group.item_number,
+            f"總計: ${item_group.total:,.0f}",
+            "", "", "", ""
+        ), tags=('summary_row',))
+        self.quote_tree.item(main_id, open=True)
+
+        sewing_item = item_group.sewing_item
+        sewing_id = f"{main_id}-sewing"
+        self.quote_tree.insert(main_id, 'end', iid=sewing_id, values=(
+            "",
+            f"車工 - {sewing_item.fabric} ({sewing_item.type})",
+            f"寬:{sewing_item.width} 高:{sewing_item.height}",
+            sewing_item.pieces,
+            f"${sewing_item.unit_price:,.0f}",
+            f"${sewing_item.subtotal:,.0f}"
+        ))
+
+        for sub_item in item_group.sub_items:
+            self.quote_tree.insert(main_id, 'end', iid=sub_item.id, values=(
+                "",
+                f"  - {sub_item.description}",
                 "",
-                f"車工 - {sewing_item.fabric} ({sewing_item.type})",
-                f"寬:{sewing_item.width} 高:{sewing_item.height}",
-                sewing_item.pieces,
-                f"${sewing_item.unit_price:,.0f}",
-                f"${sewing_item.subtotal:,.0f}"
+                sub_item.quantity,
+                f"${sub_item.unit_price:,.0f}",
+                f"${sub_item.subtotal:,.0f}"
             ))
 
-            for sub_item in item_group.sub_items:
-                self.quote_tree.insert(main_id, 'end', iid=sub_item.id, values=(
-                    "",
-                    f"  - {sub_item.description}",
-                    "",
-                    sub_item.quantity,
-                    f"${sub_item.unit_price:,.0f}",
-                    f"${sub_item.subtotal:,.0f}"
-                ))
-
     def add_sub_item(self):
         selected_ids = self.quote_tree.selection()
         if not selected_ids:
@@ -562,7 +779,7 @@ class CurtainPricingApp:
             return
         
         parent_id = self.quote_tree.parent(selected_ids[0]) or selected_ids[0]
-        main_item = next((item for item in self.quote_items if item.item_number == parent_id), None)
+        main_item = self.quote_items.get(parent_id)
         if not main_item: return
 
         win = tk.Toplevel(self.root)
@@ -584,18 +801,16 @@ class CurtainPricingApp:
                 qty = float(vars['qty'].get() or 1)
                 price = float(vars['price'].get() or 0)
                 
+                unit_price = Money.of(price)
                 sub_item = SubItem(
                     description=desc,
                     quantity=qty,
-                    unit_price=price,
-                    subtotal=qty * price
+                    unit_price=unit_price,
+                    subtotal=unit_price * qty
                 )
-                main_item.sub_items.append(sub_item)
+                main_item.add_sub_item(sub_item)
                 
-                project_name = self.project_var.get()
-                project = next((p for p in self.customer_mgr.get_projects(self.current_customer['id']) if p['name'] == project_name), None)
-                if project:
-                    self.history_mgr.save_project_items(project['id'], self.quote_items)
+                self.save_current_project()
                 
                 self.refresh_quote_tree()
                 self.update_totals()
@@ -617,21 +832,18 @@ class CurtainPricingApp:
             parent_iid = self.quote_tree.parent(iid)
             
             if not parent_iid:
-                self.quote_items = [group for group in self.quote_items if group.item_number != iid]
+                self.quote_items.remove_group(iid)
             else:
-                parent_group = next((group for group in self.quote_items if group.item_number == parent_iid), None)
+                parent_group = self.quote_items.get(parent_iid)
                 if not parent_group: continue
 
                 if iid == f"{parent_iid}-sewing":
                     messagebox.showwarning("注意", "不能直接刪除車工項目，請刪除整個貨號。", parent=self.root)
                     continue
 
-                parent_group.sub_items = [sub for sub in parent_group.sub_items if sub.id != iid]
+                parent_group.remove_sub_item(iid)
 
-        project_name = self.project_var.get()
-        project = next((p for p in self.customer_mgr.get_projects(self.current_customer['id']) if p['name'] == project_name), None)
-        if project:
-            self.history_mgr.save_project_items(project['id'], self.quote_items)
+        self.save_current_project()
         
         self.refresh_quote_tree()
         self.update_totals()
@@ -639,10 +851,7 @@ class CurtainPricingApp:
     def clear_quote(self):
         if messagebox.askyesno("確認", "確定要清空所有報價明細嗎？"):
             self.quote_items.clear()
-            project_name = self.project_var.get()
-            project = next((p for p in self.customer_mgr.get_projects(self.current_customer['id']) if p['name'] == project_name), None)
-            if project:
-                self.history_mgr.save_project_items(project['id'], self.quote_items)
+            self.save_current_project()
             self.refresh_quote_tree()
             self.update_totals()
 
@@ -653,10 +862,17 @@ class CurtainPricingApp:
         ttk.Label(tf, text="總計:", font=('Arial', 12, 'bold')).grid(row=0, column=0, sticky="w")
         self.total_var = tk.StringVar(value="$0")
         ttk.Label(tf, textvariable=self.total_var, font=('Arial', 12, 'bold'), foreground='red').grid(row=0, column=1, sticky="e")
+        self.total_detail_var = tk.StringVar(value="")
+        ttk.Label(tf, textvariable=self.total_detail_var).grid(row=1, column=0, columnspan=2, sticky="e")
 
     def update_totals(self):
-        total = sum(item.total for item in self.quote_items)
-        self.total_var.set(f"${total:,.0f}")
+        totals = self.pricing_engine.quote_totals(self.quote_items)
+        self.total_var.set(f"${totals.total:,.0f}")
+        detail = f"小計 ${totals.subtotal:,.0f}"
+        if totals.discount:
+            detail += f"　折扣 -${totals.discount:,.0f}"
+        detail += f"　稅額 ${totals.tax:,.0f}"
+        self.total_detail_var.set(detail)
 
     def create_action_buttons(self, parent):
         bf = ttk.Frame(parent)
@@ -665,9 +881,213 @@ class CurtainPricingApp:
         self.export_btn.pack(side="left", padx=5)
         self.open_btn = ttk.Button(bf, text="開啟Excel", command=self.open_excel)
         self.open_btn.pack(side="left", padx=5)
+        ttk.Button(bf, text="方案比較", command=self.open_scenario_compare).pack(side="left", padx=5)
+        ttk.Button(bf, text="版本紀錄", command=self.open_revision_history).pack(side="left", padx=5)
+
+    def open_scenario_compare(self):
+        """把目前報價的布料／形式換成其他選擇，即時比較各方案總計"""
+        if not len(self.quote_items):
+            messagebox.showinfo("提示", "目前沒有報價明細可以比較")
+            return
+        win = tk.Toplevel(self.root)
+        win.title("方案比較")
+        win.geometry("720x420")
+        win.columnconfigure(1, weight=1)
+        win.rowconfigure(0, weight=1)
+
+        left = ttk.Frame(win, padding=10)
+        left.grid(row=0, column=0, sticky="ns")
+        ttk.Label(left, text="替換布料（可複選）:").pack(anchor="w")
+        fabric_list = tk.Listbox(left, selectmode="extended", exportselection=False, height=12)
+        fabric_list.pack(fill="y", expand=True)
+        for fabric in self.sewing_price_mgr.get_fabrics():
+            fabric_list.insert("end", fabric)
+        type_var = tk.StringVar(value="")
+        ttk.Label(left, text="形式:").pack(anchor="w", pady=(5, 0))
+        for text, value in (("維持原形式", ""), ("一般簾", "一般簾"), ("蛇行簾", "蛇行簾")):
+            ttk.Radiobutton(left, text=text, variable=type_var, value=value).pack(anchor="w")
+
+        cols = ("name", "subtotal", "discount", "tax", "total", "delta", "errors")
+        tree = ttk.Treeview(win, columns=cols, show="headings")
+        for col, text in zip(cols, ("方案", "小計", "折扣", "稅額", "總計", "差額", "無法計價")):
+            tree.heading(col, text=text)
+            tree.column(col, width=80, anchor="w" if col == "name" else "e")
+        tree.grid(row=0, column=1, sticky="nsew", padx=(0, 10), pady=10)
+
+        scenarios = {}
+
+        def recompute(*args):
+            scenarios.clear()
+            type_ = type_var.get() or None
+            for i in fabric_list.curselection():
+                fabric = fabric_list.get(i)
+                name = f"{fabric} / {type_}" if type_ else fabric
+                scenarios[name] = Scenario(name, fabric=fabric, type=type_)
+            if not fabric_list.curselection() and type_:
+                scenarios[type_] = Scenario(type_, type=type_)
+            results = self.scenario_engine.evaluate(self.quote_items, list(scenarios.values()))
+            tree.delete(*tree.get_children())
+            for r in results:
+                t = r.totals
+                tree.insert("", "end", iid=r.name, values=(
+                    r.name, f"${t.subtotal:,.0f}", f"${t.discount:,.0f}", f"${t.tax:,.0f}",
+                    f"${t.total:,.0f}", f"{r.delta:+,.0f}", len(r.errors) or ""))
+
+        def apply_selected():
+            sel = tree.selection()
+            if not sel or sel[0] not in scenarios:
+                return
+            try:
+                groups = self.scenario_engine.apply(self.quote_items, scenarios[sel[0]])
+            except PriceNotFoundError as e:
+                messagebox.showerror("錯誤", str(e), parent=win)
+                return
+            if not messagebox.askyesno("確認", f"以「{sel[0]}」取代目前的報價明細？", parent=win):
+                return
+            self.quote_items = self.pricing_engine.new_quote(groups)
+            self.save_current_project()
+            self.refresh_quote_tree()
+            self.update_totals()
+            win.destroy()
+
+        fabric_list.bind("<<ListboxSelect>>", recompute)
+        type_var.trace_add("write", recompute)
+        ttk.Button(win, text="套用選中的方案", command=apply_selected).grid(row=1, column=1, sticky="e", padx=10, pady=(0, 10))
+        recompute()
+
+    @staticmethod
+    def format_quote_diff(diff):
+        """把 QuoteDiff 排成可讀的文字，供議價時對照"""
+        labels = {"fabric": "布料", "type": "形式", "width": "寬", "height": "高", "pieces": "幅數",
+                  "unit_price": "單價", "subtotal": "小計", "unit": "單位", "quantity": "數量"}
+        lines = [f"版本 {diff.from_revision} → {diff.to_revision}："
+                 f"${diff.total_before:,.0f} → ${diff.total_after:,.0f}（{diff.total_delta:+,.0f}）"]
+        if not diff:
+            lines.append("內容相同")
+        for number in diff.added:
+            lines.append(f"＋ 新增貨號 {number}")
+        for number in diff.removed:
+            lines.append(f"－ 刪除貨號 {number}")
+        for change in diff.changed:
+            lines.append(f"＊ 貨號 {change.item_number}：${change.total_before:,.0f} → "
+                         f"${change.total_after:,.0f}（{change.total_delta:+,.0f}）")
+            for name, (old, new) in change.sewing.items():
+                lines.append(f"    {labels.get(name, name)}: {old} → {new}")
+            for sub in change.sub_added:
+                lines.append(f"    ＋ {sub['description']} ${sub['subtotal']:,.0f}")
+            for sub in change.sub_removed:
+                lines.append(f"    － {sub['description']} ${sub['subtotal']:,.0f}")
+            for old, new in change.sub_changed:
+                lines.append(f"    ＊ {new['description']}: ${old['subtotal']:,.0f} → ${new['subtotal']:,.0f}")
+        if diff.reordered:
+            lines.append("貨號順序已調整")
+        return "\n".join(lines)
+
+    def open_revision_history(self):
+        """列出目前案子的報價版本；選一個版本與前一版比較，選兩個版本互相比較，也可以還原"""
+        project = self.get_current_project()
+        revisions = getattr(self.history_mgr, "revisions", None)
+        if not project or revisions is None:
+            messagebox.showinfo("提示", "請先選擇案子（版本紀錄需在設定中啟用）")
+            return
+        project_id = project['id']
+        self.saver.flush(('history', project_id))
+
+        win = tk.Toplevel(self.root)
+        win.title(f"版本紀錄 - {project['name']}")
+        win.geometry("760x480")
+        win.columnconfigure(0, weight=1)
+        win.rowconfigure(0, weight=1)
+        win.rowconfigure(1, weight=1)
+
+        cols = ("revision", "created_at", "count", "total", "note")
+        tree = ttk.Treeview(win, columns=cols, show="headings", selectmode="extended")
+        for col, text, width in zip(cols, ("版本", "時間", "貨號數", "總計", "備註"), (60, 160, 70, 100, 200)):
+            tree.heading(col, text=text)
+            tree.column(col, width=width, anchor="e" if col in ("count", "total") else "w")
+        tree.grid(row=0, column=0, sticky="nsew", padx=10, pady=(10, 5))
+        for info in reversed(revisions.revisions(project_id)):
+            tree.insert("", "end", iid=str(info.revision), values=(
+                info.revision, info.created_at.replace("T", " "), info.group_count,
+                f"${info.total:,.0f}", info.note))
+
+        text = tk.Text(win, height=10, wrap="word")
+        text.grid(row=1, column=0, sticky="nsew", padx=10)
+        for revision, reason in revisions.errors(project_id):
+            text.insert("end", f"略過版本 {revision}: {reason}\n")
+
+        def selected_revisions():
+            return sorted(int(iid) for iid in tree.selection())
+
+        def show_diff(event=None):
+            revs = selected_revisions()
+            if len(revs) == 1 and revs[0] > 1:
+                revs = [revs[0] - 1, revs[0]]
+            text.delete("1.0", "end")
+            if len(revs) == 2:
+                try:
+                    text.insert("end", self.format_quote_diff(revisions.diff(project_id, *revs)))
+                except KeyError as e:
+                    text.insert("end", f"無法比較: {e.args[0]}")
+            elif len(revs) > 2:
+                text.insert("end", "請選擇一或兩個版本")
+
+        def restore():
+            revs = selected_revisions()
+            if len(revs) != 1:
+                messagebox.showwarning("注意", "請選擇一個要還原的版本", parent=win)
+                return
+            if self.get_current_project() != project:
+                messagebox.showwarning("注意", "目前的案子已切換，請重新開啟版本紀錄", parent=win)
+                return
+            if not messagebox.askyesno("確認", f"以版本 {revs[0]} 取代目前的報價明細？", parent=win):
+                return
+            try:
+                groups = revisions.checkout(project_id, revs[0])
+            except KeyError as e:
+                messagebox.showerror("錯誤", f"無法還原: {e.args[0]}", parent=win)
+                return
+            self.quote_items = self.pricing_engine.new_quote(groups)
+            self.save_current_project()
+            self.refresh_quote_tree()
+            self.update_totals()
+            win.destroy()
+
+        tree.bind("<<TreeviewSelect>>", show_diff)
+        ttk.Button(win, text="還原選中的版本", command=restore).grid(row=2, column=0, sticky="e", padx=10, pady=10)
 
     def export_quote(self):
-        messagebox.showinfo("提示", "匯出功能待更新以支援子項目。")
+        """把目前案子的報價（貨號、車工與子項目、小計、折扣、稅額與總計）匯出成 Excel"""
+        project = self.get_current_project()
+        if not project:
+            messagebox.showerror("錯誤", "請先選擇客戶與案子")
+            return
+        if self._loading_quote is not None:
+            messagebox.showwarning("注意", "報價仍在載入中，請稍後再匯出")
+            return
+        if not len(self.quote_items):
+            messagebox.showwarning("注意", "目前的報價沒有任何貨號")
+            return
+        customer = self.current_customer
+        path = filedialog.asksaveasfilename(
+            title="匯出報價單", defaultextension=".xlsx", filetypes=[("Excel 活頁簿", "*.xlsx")],
+            initialfile=f"{customer['name']}_{project['name']}_報價單.xlsx")
+        if not path:
+            return
+        quote_data = {
+            'company': {k: self.config.get(k, '') for k in ('company_name', 'company_phone', 'company_address')},
+            'customer': {k: customer.get(k, '') for k in ('name', 'phone', 'address')},
+            'project': project['name'],
+            'groups': list(self.quote_items),
+            'totals': self.pricing_engine.quote_totals(self.quote_items),
+            'tax_rate': self.pricing_engine.rules.tax_rate,
+        }
+        try:
+            self.excel_manager.create_quote_from_template(customer.get('template_path', ''), path, quote_data)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("錯誤", f"匯出失敗: {e}")
+            return
+        messagebox.showinfo("完成", f"報價單已匯出至\n{path}")
 
     def open_excel(self):
         messagebox.showinfo("提示", "開啟Excel功能待更新以支援子項目。")
@@ -41,19 +41,32 @@ class CurrencyEntry(ttk.Entry):
 
 
 class AutoCompleteCombobox(ttk.Combobox):
-    """自動完成下拉選單"""
-    def __init__(self, parent, **kwargs):
+    """自動完成下拉選單
+
+    傳入 search_func(query, limit) 時改由外部索引提供候選值，
+    否則在 set_values 設定的清單中做子字串過濾。
+    """
+    NAVIGATION_KEYS = ('Up', 'Down', 'Left', 'Right', 'Return', 'Escape', 'Tab')
+
+    def __init__(self, parent, search_func=None, limit=50, **kwargs):
         super().__init__(parent, **kwargs)
+        self.search_func = search_func
+        self.limit = limit
+        self.original_values = []
         
         self.bind('<KeyRelease>', self.on_keyrelease)
         
     def on_keyrelease(self, event):
         """按鍵釋放事件"""
+        if event.keysym in self.NAVIGATION_KEYS:
+            return
         # 獲取輸入的文字
         typed = self.get()
         
         if typed == '':
             self['values'] = self.original_values
+        elif self.search_func:
+            self['values'] = self.search_func(typed, self.limit)
         else:
             # 過濾符合的選項
             filtered_values = []
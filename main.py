@@ -1,6 +1,7 @@
 import tkinter as tk
 from gui.view_main import CurtainPricingApp
 import json, os
+import multiprocessing
 
 def load_config():
     config_path = "data/config.json"
@@ -16,7 +17,8 @@ def load_config():
         "company_phone": "02-1234-5678",
         "company_address": "台北市中正區xx路xx號",
         "price_table_path": "data/price_table.xlsx",
-        "tax_rate": 0.05
+        "tax_rate": 0.05,
+        "customer_journal": False
     }
     os.makedirs("data", exist_ok=True)
     with open(config_path, 'w', encoding='utf-8') as f:
@@ -35,4 +37,6 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    # 打包成 exe 後，程序池的子程序會重新執行本程式，須先交給 multiprocessing 處理
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,35 @@
+from services.atomic_io import atomic_write_json
+from services.customer_manager import CustomerManager
+from services.history_store import HistoryStore, migrate_history_files
+from services.sqlite_store import SQLiteStorage
+import json
+import os
+import sys
+
+def main():
+    """把 data/history_*.json 集中匯入 data/history.db，並將設定的 history_storage 切換為 store
+
+    data/history.db 中已有的案子保留不動，加上 --force 時改以歷史檔內容覆蓋。
+    """
+    force = "--force" in sys.argv[1:]
+    customers = CustomerManager("data/customers.json").get_all()
+    storage = SQLiteStorage("data/history.db", schema="")
+    stats, skipped = migrate_history_files("data", HistoryStore(storage), customers, overwrite=force)
+    storage.close()
+    print(f"已匯入 {stats['projects']} 個案子、{stats['groups']} 個貨號"
+          f"（舊版格式 {stats['legacy']} 份，其中 {stats['orphans']} 份找不到對應的案子）")
+    if stats["kept"]:
+        print(f"保留 data/history.db 中已有的 {stats['kept']} 個案子（加上 --force 以歷史檔覆蓋）")
+    for path, reason in skipped:
+        print(f"略過 {path}: {reason}")
+
+    config_path = "data/config.json"
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        config["history_storage"] = "store"
+        atomic_write_json(config_path, config)
+        print("已將 data/config.json 的 history_storage 設為 store")
+
+if __name__ == "__main__":
+    main()
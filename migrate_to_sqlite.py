@@ -0,0 +1,25 @@
+from services.sqlite_store import migrate_json_to_sqlite
+import json
+import os
+
+def main():
+    """把 data/ 的 JSON 資料匯入 data/curtain.db，並將設定切換為 SQLite"""
+    stats, skipped = migrate_json_to_sqlite("data")
+    print(f"已匯入 客戶 {stats['customers']} 筆、案子 {stats['projects']} 筆、"
+          f"車工單價 {stats['sewing_prices']} 筆、報價紀錄 {stats['histories']} 份")
+    if stats["sewing_price_duplicates"]:
+        print(f"略過重複的車工單價 {stats['sewing_price_duplicates']} 筆（同布料與形式只保留第一筆）")
+    for path, reason in skipped:
+        print(f"略過 {path}: {reason}")
+
+    config_path = "data/config.json"
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        config["storage"] = "sqlite"
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        print("已將 data/config.json 的 storage 設為 sqlite")
+
+if __name__ == "__main__":
+    main()
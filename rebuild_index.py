@@ -0,0 +1,14 @@
+from services.history_index import HistoryIndex
+from services.sqlite_store import SQLiteStorage
+
+def main():
+    """清空 data/history_index.db 後由 data/ 的歷史檔重新建立報表用的彙總索引"""
+    storage = SQLiteStorage("data/history_index.db", schema="")
+    count, errors = HistoryIndex(storage, "data").rebuild()
+    storage.close()
+    print(f"已重新彙總 {count} 個歷史檔")
+    for path, reason in errors:
+        print(f"略過 {path}: {reason}")
+
+if __name__ == "__main__":
+    main()
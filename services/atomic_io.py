@@ -0,0 +1,111 @@
+# services/atomic_io.py
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+from contextlib import contextmanager
+
+
+def _current_umask():
+    # umask 只能以「設定再改回」的方式讀出；在模組載入時讀一次，避免之後與其他執行緒建檔互相干擾
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+_UMASK = _current_umask()
+
+
+def _file_mode(path):
+    """取代 path 時沿用的權限；新檔案與一般 open() 建立的檔案相同（0o666 扣掉 umask）"""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def _backup_path(path, n):
+    return f"{path}.bak{n}"
+
+
+def _rotate_backups(path, backups):
+    """path.bak1 → path.bak2 …，再把目前的檔案保留為 path.bak1
+
+    以硬連結保留舊檔，不複製內容；檔案系統不支援硬連結時才退回複製。
+    """
+    if backups <= 0 or not os.path.exists(path):
+        return
+    for n in range(backups - 1, 0, -1):
+        src = _backup_path(path, n)
+        if os.path.exists(src):
+            os.replace(src, _backup_path(path, n + 1))
+    dst = _backup_path(path, 1)
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(path, dst)
+    except OSError:
+        shutil.copy2(path, dst)
+
+
+def _fsync_dir(dir_name):
+    # Windows 無法開啟目錄做 fsync，忽略即可
+    if os.name != 'posix':
+        return
+    fd = os.open(dir_name or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_open(path, mode='w', encoding='utf-8', backups=0):
+    """以「暫存檔 → fsync → 改名」方式寫檔
+
+    寫入過程中斷時原檔維持不變；正常結束才以 os.replace 原子地取代原檔。
+    mkstemp 建立的暫存檔權限為 0600，改名前改成原檔的權限，共用資料夾的其他帳號才讀得到。
+    backups > 0 時保留最近幾個舊版本為 path.bak1、path.bak2 …
+    """
+    dir_name = os.path.dirname(path)
+    if dir_name:
+        os.makedirs(dir_name, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        if 'b' in mode:
+            f = os.fdopen(fd, mode)
+        else:
+            f = os.fdopen(fd, mode, encoding=encoding)
+        with f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, _file_mode(path))
+        _rotate_backups(path, backups)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_dir(dir_name)
+
+
+def atomic_write_json(path, data, backups=0, **dump_kwargs):
+    """原子地寫入 JSON；json.dump 逐段寫入暫存檔，不會在記憶體中先組出整份字串"""
+    dump_kwargs.setdefault('ensure_ascii', False)
+    dump_kwargs.setdefault('indent', 2)
+    with atomic_open(path, 'w', backups=backups) as f:
+        json.dump(data, f, **dump_kwargs)
+
+
+def load_json(path, default=None, backups=0):
+    """讀取 JSON；主檔損毀或不存在時依序嘗試 path.bak1 … 備份"""
+    for candidate in [path] + [_backup_path(path, n) for n in range(1, backups + 1)]:
+        try:
+            with open(candidate, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            continue
+    return default
@@ -0,0 +1,297 @@
+# services/bulk_archive.py
+
+import glob
+import gzip
+import io
+import json
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from services.atomic_io import atomic_open
+from services.history_binary import BINARY_EXTENSION, dumps, loads
+from services.history_loader import iter_history
+from services.history_manager import CustomEncoder
+from services.money import Money
+from services.quote_table import QuoteTable
+
+ARCHIVE_FORMAT = 1
+MANIFEST = "manifest.json"
+
+# 與資料一起備份的設定與單價表檔案；還原時只補上資料夾中沒有的檔案
+DATA_FILES = ("config.json", "curtain_types.json", "price_table.xlsx", "price_catalog.jsonl")
+
+# 沒有對應到案子的歷史檔在備份中的位置
+EXTRA_HISTORY_DIR = "files/history"
+
+# 案子少於此數時直接在本程序處理，省下啟動程序池的時間
+PARALLEL_MIN_JOBS = 16
+
+
+class ArchiveError(ValueError):
+    """備份檔無法讀取或格式不符"""
+
+
+# ── 子程序工作 ────────────────────────────────────────
+
+def _read_file(path, project_id):
+    """讀取一個歷史檔，回傳 (QuoteTable, 略過的紀錄)"""
+    if path.endswith(BINARY_EXTENSION):
+        with open(path, 'rb') as f:
+            return QuoteTable.from_bytes(f.read()), []
+    table, errors = QuoteTable(), []
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        for record in iter_history(f):
+            if record.key not in (None, project_id):
+                continue
+            if record.error is not None:
+                errors.append(str(record.error))
+            else:
+                table.append_group(record.group)
+    return table, errors
+
+
+def _pack_history(job):
+    """讀取並序列化一個案子的報價歷史，回傳 (案子 ID, gzip 壓縮的 JSON, 貨號數, 總計分, 錯誤)
+
+    job 為 (案子 ID, "file", 歷史檔路徑)、(案子 ID, "table", QuoteTable 二進位內容)
+    或沒有紀錄時的 (案子 ID, None, None)。
+    """
+    project_id, kind, source = job
+    if kind is None:
+        return project_id, None, 0, 0, []
+    try:
+        if kind == "file":
+            table, errors = _read_file(source, project_id)
+        else:
+            table, errors = QuoteTable.from_bytes(source), []
+    except (OSError, ValueError) as e:
+        return project_id, None, 0, 0, [str(e)]
+    text = json.dumps(table.to_records(), cls=CustomEncoder, ensure_ascii=False, separators=(',', ':'))
+    return project_id, gzip.compress(text.encode("utf-8"), 6), len(table), table.total().cents, errors
+
+
+def _unpack_history(job):
+    """解壓並驗證備份中的一個案子，回傳 (案子 ID, QuoteTable 二進位內容, 錯誤)
+
+    紀錄經過與載入歷史檔相同的檢查與舊版升級；以二進位內容傳回主程序，
+    比傳回 ItemGroup 物件小且快。
+    """
+    project_id, data = job
+    try:
+        text = gzip.decompress(data).decode("utf-8")
+    except (OSError, EOFError, UnicodeDecodeError) as e:
+        return project_id, None, [f"無法解壓縮: {e}"]
+    table, errors = QuoteTable(), []
+    for record in iter_history(io.StringIO(text)):
+        if record.error is not None:
+            errors.append(str(record.error))
+        else:
+            table.append_group(record.group)
+    return project_id, table.to_bytes(), errors
+
+
+def _imap(func, jobs, count, processes=None):
+    """依序產生 func(job) 的結果
+
+    工作夠多時分給子程序平行處理，同時送出的工作最多為子程序數的四倍，
+    工作內容與結果不會全部堆在記憶體中。
+    """
+    if processes == 1 or count < PARALLEL_MIN_JOBS:
+        for job in jobs:
+            yield func(job)
+        return
+    window = (processes or os.cpu_count() or 1) * 4
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.submit(func, job))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# ── 匯出 ──────────────────────────────────────────────
+
+def _history_jobs(history_mgr, project_ids, included):
+    """產生各案子的工作；讀取的歷史檔路徑加進 included"""
+    history_path = getattr(history_mgr, "history_path", None)
+    for project_id in project_ids:
+        if history_path is not None:
+            # 每個案子一個檔案：子程序直接讀檔
+            path = history_path(project_id)
+            if path:
+                included.add(os.path.abspath(path))
+            yield (project_id, "file", path) if path else (project_id, None, None)
+            continue
+        groups = history_mgr.load_project_items(project_id)
+        yield (project_id, "table", dumps(groups)) if groups else (project_id, None, None)
+
+
+def _extra_histories(data_dir, included):
+    """data_dir 中沒有被當作案子紀錄備份的歷史檔"""
+    paths = glob.glob(os.path.join(data_dir, "history_*.json"))
+    paths += glob.glob(os.path.join(data_dir, f"history_*{BINARY_EXTENSION}"))
+    return sorted(p for p in paths if os.path.abspath(p) not in included)
+
+
+def export_archive(archive_path, customer_mgr, sewing_mgr, history_mgr, data_dir=None,
+                   processes=None, progress=None):
+    """把所有客戶、案子、車工單價與各案子的報價歷史寫成單一備份檔（zip），回傳 manifest
+
+    各案子的歷史由子程序讀取、驗證並序列化成 gzip 壓縮的 JSON，主程序依序寫入備份檔，
+    寫完後才取代 archive_path。提供 data_dir 時一併備份 DATA_FILES，
+    以及沒有對應到任何案子的歷史檔（舊版以客戶為鍵的檔案、已刪除案子留下的檔案等），
+    後者原樣存入並列在 manifest 的 extra_histories。
+    progress(已完成, 全部) 在每個案子處理完後呼叫。
+    """
+    customers = customer_mgr.get_all()
+    sewing_prices = sewing_mgr.get_all()
+    project_ids = [p["id"] for cust in customers for p in cust.get("projects", [])]
+    manifest = {
+        "format": ARCHIVE_FORMAT,
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "customers": len(customers),
+        "projects": len(project_ids),
+        "sewing_prices": len(sewing_prices),
+        "histories": {},
+        "files": [],
+        "extra_histories": [],
+        "errors": {},
+    }
+    included = set()
+    with atomic_open(archive_path, 'wb') as f, zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as zf:
+        jobs = _history_jobs(history_mgr, project_ids, included)
+        for done, (project_id, data, count, cents, errors) in enumerate(
+                _imap(_pack_history, jobs, len(project_ids), processes), 1):
+            if errors:
+                manifest["errors"][project_id] = errors
+            if data is not None:
+                entry = f"history/{project_id}.json.gz"
+                # 子程序已壓縮過，直接存入
+                zf.writestr(entry, data, compress_type=zipfile.ZIP_STORED)
+                manifest["histories"][project_id] = {"entry": entry, "groups": count,
+                                                     "total": float(Money(cents))}
+            if progress:
+                progress(done, len(project_ids))
+        zf.writestr("customers.json", json.dumps(customers, ensure_ascii=False))
+        zf.writestr("sewing_prices.json", json.dumps(sewing_prices, ensure_ascii=False))
+        for name in DATA_FILES if data_dir else ():
+            path = os.path.join(data_dir, name)
+            if os.path.exists(path):
+                zf.write(path, f"files/{name}")
+                manifest["files"].append(name)
+        for path in _extra_histories(data_dir, included) if data_dir else ():
+            name = os.path.basename(path)
+            zf.write(path, f"{EXTRA_HISTORY_DIR}/{name}")
+            manifest["extra_histories"].append(name)
+        zf.writestr(MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2))
+    return manifest
+
+
+# ── 匯入 ──────────────────────────────────────────────
+
+def _open_archive(archive_path):
+    try:
+        zf = zipfile.ZipFile(archive_path)
+    except (OSError, zipfile.BadZipFile) as e:
+        raise ArchiveError(f"無法開啟備份檔 {archive_path}: {e}") from e
+    try:
+        manifest = json.loads(zf.read(MANIFEST))
+    except (KeyError, ValueError) as e:
+        zf.close()
+        raise ArchiveError(f"備份檔缺少或損毀 {MANIFEST}: {e}") from e
+    if manifest.get("format") != ARCHIVE_FORMAT:
+        zf.close()
+        raise ArchiveError(f"不支援的備份格式版本: {manifest.get('format')}")
+    return zf, manifest
+
+
+def read_manifest(archive_path):
+    """只讀取備份檔的 manifest（建立時間、筆數與各案子的貨號數與總計）"""
+    zf, manifest = _open_archive(archive_path)
+    zf.close()
+    return manifest
+
+
+def _safe_history_name(name):
+    return (name == os.path.basename(name) and name.startswith("history_")
+            and name.endswith((".json", BINARY_EXTENSION)))
+
+
+def restore_data_files(archive_path, data_dir):
+    """把備份中的設定與單價表檔案，以及沒有對應到案子的歷史檔放回 data_dir
+
+    已存在的檔案不覆蓋。回傳放回的檔名。
+    """
+    zf, manifest = _open_archive(archive_path)
+    restored = []
+    with zf:
+        entries = [(name, f"files/{name}") for name in manifest.get("files", []) if name in DATA_FILES]
+        entries += [(name, f"{EXTRA_HISTORY_DIR}/{name}") for name in manifest.get("extra_histories", [])
+                    if _safe_history_name(name)]
+        for name, entry in entries:
+            path = os.path.join(data_dir, name)
+            if os.path.exists(path):
+                continue
+            with atomic_open(path, 'wb') as f:
+                f.write(zf.read(entry))
+            restored.append(name)
+    return restored
+
+
+def _restore_prices(sewing_mgr, records, overwrite):
+    existing = {(r["fabric"], r["type"]): r for r in sewing_mgr.get_all()}
+    added = updated = 0
+    for rec in records:
+        current = existing.get((rec["fabric"], rec["type"]))
+        if current is None:
+            sewing_mgr.add(rec["fabric"], rec["type"], rec["unit_price"])
+            added += 1
+        elif overwrite and float(current["unit_price"]) != float(rec["unit_price"]):
+            sewing_mgr.update(current["id"], unit_price=float(rec["unit_price"]))
+            updated += 1
+    return added, updated
+
+
+def _has_history(history_mgr, project_id):
+    history_path = getattr(history_mgr, "history_path", None)
+    if history_path is not None:
+        return history_path(project_id) is not None
+    return history_mgr.has_project(project_id)
+
+
+def import_archive(archive_path, customer_mgr, sewing_mgr, history_mgr, overwrite=False,
+                   processes=None, progress=None):
+    """把備份檔還原或合併到目前的資料，回傳 (統計, [(案子 ID, 錯誤)])
+
+    客戶與案子沿用備份中的 ID；已存在的客戶、案子、車工單價與報價歷史預設保留現有內容，
+    只補上缺少的部分，overwrite 時改以備份內容為準。還原到空的資料夾即為完整還原。
+    報價歷史由子程序解壓縮並驗證，主程序經 history_mgr 寫入，彙總索引與版本紀錄照常更新。
+    progress(已完成, 全部) 在每個案子處理完後呼叫。
+    """
+    zf, manifest = _open_archive(archive_path)
+    with zf:
+        customers = json.loads(zf.read("customers.json"))
+        sewing_prices = json.loads(zf.read("sewing_prices.json"))
+        stats = customer_mgr.restore_customers(customers, overwrite)
+        stats["sewing_prices"], stats["sewing_prices_updated"] = _restore_prices(
+            sewing_mgr, sewing_prices, overwrite)
+
+        histories = manifest["histories"]
+        todo = [pid for pid in histories if overwrite or not _has_history(history_mgr, pid)]
+        stats["histories"] = 0
+        stats["histories_kept"] = len(histories) - len(todo)
+        problems = []
+        jobs = ((pid, zf.read(histories[pid]["entry"])) for pid in todo)
+        for done, (project_id, data, errors) in enumerate(
+                _imap(_unpack_history, jobs, len(todo), processes), 1):
+            problems.extend((project_id, e) for e in errors)
+            if data is not None:
+                history_mgr.save_project_items(project_id, loads(data))
+                stats["histories"] += 1
+            if progress:
+                progress(done, len(todo))
+    return stats, problems
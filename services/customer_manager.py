@@ -2,33 +2,356 @@
 
 import json
 import os
+import threading
 import uuid
+from services.search_index import CustomerSearchIndex
+from services.atomic_io import atomic_open, atomic_write_json, load_json
+from services.file_lock import FileLock, file_stamp
 
 class CustomerManager:
-    """管理客戶資料，支援客戶與案子的 CRUD 操作"""
+    """管理客戶資料，支援客戶與案子的 CRUD 操作
+
+    journal=True 時，每次異動只在 <data_path>.journal 追加一行紀錄，
+    累積 compact_threshold 筆後由背景執行緒合併回 customers.json。
+    非日誌模式下若提供 saver (SaveWorker)，整檔保存交由背景合併寫出。
+
+    多個程式共用同一份檔案時，寫入都在 <data_path>.lock 檔案鎖內進行，
+    並以檔案的 inode／修改時間／大小判斷其他程式是否改過資料：
+    日誌模式只重播別人新追加的日誌尾段，否則重新載入後再套用自己尚未存檔的異動。
+
+    客戶存成以 id 為鍵、保持加入順序的 dict，並維護名稱、案子 id 與各客戶案名的索引；
+    新增、修改、刪除客戶或案子只更新受影響的索引項目。
+    """
     
-    def __init__(self, data_path="data/customers.json"):
+    # customers.json 保留的舊版本數量（customers.json.bak1 …）
+    BACKUPS = 2
+
+    def __init__(self, data_path="data/customers.json", journal=False, compact_threshold=500, saver=None):
         self.data_path = data_path
+        self.saver = saver
+        self.journal = journal
+        self.compact_threshold = compact_threshold
+        self.journal_path = data_path + ".journal"
+        # 壓縮期間正在合併的舊日誌；若程式中途結束，下次載入時會一併重播
+        self.compacting_path = data_path + ".journal.compacting"
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(data_path + ".lock")
+        # 同一時間只允許一個程式壓縮日誌
+        self._compact_lock = FileLock(data_path + ".compact.lock", timeout=0)
+        self._compact_thread = None
+        self._journal_count = 0
+        self._stamp = None
+        self._journal_stamp = None
+        self._journal_offset = 0
+        self._unsaved = []
         os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
-        if not os.path.exists(self.data_path):
-            with open(self.data_path, 'w', encoding='utf-8') as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
-        self.customers = self.load()
+        with self._file_lock:
+            if not os.path.exists(self.data_path):
+                atomic_write_json(self.data_path, [])
+            self.load()
     
     def load(self):
-        """從 JSON 檔案載入客戶資料"""
-        try:
-            with open(self.data_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data if isinstance(data, list) else []
-        except:
-            return []
+        """從 JSON 檔案載入客戶資料，重播未合併的日誌，並重建索引；回傳客戶清單
+
+        主檔損毀時改用最近的備份，不會默默變成空清單。
+        """
+        with self._file_lock:
+            # 先取檔案戳記再讀：讀取途中若被替換，下次檢查會再重新載入一次
+            self._stamp = file_stamp(self.data_path)
+            data = load_json(self.data_path, default=[], backups=self.BACKUPS)
+            data = {cust["id"]: cust for cust in data} if isinstance(data, list) else {}
+            self.customers = data
+            self._rebuild_index(data.values())
+            self._journal_count = 0
+            records, _ = self._read_journal(self.compacting_path)
+            journal_records, self._journal_offset = self._read_journal(self.journal_path)
+            self._journal_stamp = file_stamp(self.journal_path)
+            for record in records + journal_records:
+                self._apply(data, record)
+                self._journal_count += 1
+        return self.get_all()
     
     def save(self):
         """將客戶資料保存到 JSON 檔案"""
-        with open(self.data_path, 'w', encoding='utf-8') as f:
-            json.dump(self.customers, f, ensure_ascii=False, indent=2)
+        self._wait_compaction()
+        if self.journal:
+            # 與 compact() 相同順序：先壓縮鎖、再資料鎖
+            self._compact_lock.acquire(timeout=self._file_lock.timeout)
+        try:
+            with self._lock, self._file_lock:
+                self._sync_external()
+                atomic_write_json(self.data_path, self.get_all(), backups=self.BACKUPS)
+                # 快照已包含所有異動，日誌可以清空
+                for path in (self.compacting_path, self.journal_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._stamp = file_stamp(self.data_path)
+                self._journal_stamp = None
+                self._journal_offset = 0
+                self._journal_count = 0
+                self._unsaved.clear()
+        finally:
+            if self.journal:
+                self._compact_lock.release()
+
+    # --- 多程式同步 ---
+
+    def _changed_on_disk(self):
+        if file_stamp(self.data_path) != self._stamp:
+            return True
+        return self.journal and file_stamp(self.journal_path) != self._journal_stamp
+
+    def _sync_external(self):
+        """若其他程式改過檔案，把變更讀進來；呼叫端需持有檔案鎖。回傳是否有變更"""
+        if not self._changed_on_disk():
+            return False
+        journal_stamp = file_stamp(self.journal_path)
+        if (self.journal and file_stamp(self.data_path) == self._stamp
+                and journal_stamp and self._journal_stamp
+                and journal_stamp[0] == self._journal_stamp[0]
+                and journal_stamp[2] >= self._journal_offset):
+            # 只有日誌變長：重播新增的尾段即可
+            records, self._journal_offset = self._read_journal(self.journal_path, self._journal_offset)
+            self._journal_stamp = file_stamp(self.journal_path)
+            for record in records:
+                self._apply(self.customers, record)
+                self._journal_count += 1
+            return True
+        self.load()
+        # 尚未寫出的自己的異動重新套用在最新資料上
+        for record in self._unsaved:
+            self._apply(self.customers, record)
+        return True
+
+    def refresh(self):
+        """其他程式改過檔案時重新載入；沒有變更時只花一次 stat。回傳是否有變更"""
+        if not self._changed_on_disk():
+            return False
+        with self._lock, self._file_lock:
+            return self._sync_external()
+
+    # --- 日誌 ---
+
+    def _commit(self, record):
+        """持久化一筆異動：日誌模式追加紀錄，否則整檔保存"""
+        if not self.journal:
+            self._unsaved.append(record)
+            if self.saver:
+                self.saver.schedule(self.data_path, self.save)
+            else:
+                self.save()
+            return
+        with self._lock, self._file_lock:
+            line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                self._journal_offset = f.tell()
+            self._journal_stamp = file_stamp(self.journal_path)
+            self._journal_count += 1
+            if self._journal_count >= self.compact_threshold:
+                self._start_compaction()
+
+    def _read_journal(self, path, offset=0):
+        """從 offset 起逐行讀取日誌，回傳 (紀錄, 讀到的位置)
+
+        當機留下的不完整尾行會被截掉，避免之後的追加接在殘行後面；呼叫端需持有檔案鎖。
+        """
+        if not os.path.exists(path):
+            return [], 0
+        with open(path, 'rb+') as f:
+            f.seek(offset)
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                f.truncate(offset + end)
+        records = []
+        for line in data[:end].decode('utf-8', errors='replace').splitlines():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return records, offset + end
+
+    def _apply(self, customers, record):
+        """重播一筆日誌紀錄；每種操作皆為冪等，重複重播不影響結果
+
+        customers 為 {id: 客戶} 的 dict，只更新受影響的索引項目。
+        """
+        op = record.get("op")
+        if op == "add":
+            cust = record["customer"]
+            if cust["id"] not in self._by_id:
+                customers[cust["id"]] = cust
+                if self._list is not None:
+                    self._list.append(cust)
+                self._index_customer(cust)
+        elif op == "update":
+            cust = self._by_id.get(record["id"])
+            if cust:
+                self._unindex_name(cust)
+                cust.update(record["fields"])
+                self._by_name.setdefault(cust["name"], []).append(cust)
+                if self._search is not None:
+                    self._search.add(cust)
+        elif op == "delete":
+            cust = self._by_id.get(record["id"])
+            if cust:
+                self._unindex_customer(cust)
+                del customers[cust["id"]]
+                self._list = None
+        elif op == "add_project":
+            cust = self._by_id.get(record["cust_id"])
+            project = record["project"]
+            if cust and project["id"] not in self._projects:
+                cust.setdefault("projects", []).append(project)
+                self._index_project(cust, project)
+        elif op == "update_project":
+            cust, project = self._projects.get(record["project_id"], (None, None))
+            if project:
+                self._unindex_project_name(cust, project)
+                project["name"] = record["name"]
+                self._index_project_name(cust, project)
+        elif op == "delete_project":
+            cust, project = self._projects.get(record["project_id"], (None, None))
+            if project and cust["id"] == record["cust_id"]:
+                # 只掃描這位客戶自己的案子清單
+                cust["projects"] = [p for p in cust["projects"] if p is not project]
+                del self._projects[project["id"]]
+                self._unindex_project_name(cust, project)
+
+    def _start_compaction(self):
+        if self._compact_thread and self._compact_thread.is_alive():
+            return
+        self._compact_thread = threading.Thread(target=self.compact, daemon=True)
+        self._compact_thread.start()
+
+    def compact(self):
+        """把日誌合併進 customers.json 快照
+
+        先把目前日誌改名為 .compacting，之後的異動寫入新日誌；
+        快照寫完後才刪除 .compacting。任何一步中斷，重新載入時的重播皆能還原。
+        寫快照時不持有資料檔案鎖，其他程式與主執行緒仍可繼續追加日誌。
+        """
+        try:
+            self._compact_lock.acquire()
+        except TimeoutError:
+            return  # 其他程式正在壓縮
+        try:
+            with self._lock, self._file_lock:
+                self._sync_external()
+                if os.path.exists(self.compacting_path):
+                    # 上次壓縮未完成，舊紀錄併入目前日誌之前
+                    with open(self.compacting_path, 'a', encoding='utf-8') as dst:
+                        if os.path.exists(self.journal_path):
+                            with open(self.journal_path, 'r', encoding='utf-8') as src:
+                                dst.write(src.read())
+                            os.remove(self.journal_path)
+                elif os.path.exists(self.journal_path):
+                    os.replace(self.journal_path, self.compacting_path)
+                else:
+                    return
+                self._journal_stamp = None
+                self._journal_offset = 0
+                self._journal_count = 0
+                # 鎖內只複製資料；序列化與寫檔在鎖外進行，不擋住新的異動
+                snapshot = self._snapshot()
+            text = json.dumps(snapshot, ensure_ascii=False, indent=2)
+            with atomic_open(self.data_path, backups=self.BACKUPS) as f:
+                f.write(text)
+            with self._lock, self._file_lock:
+                self._stamp = file_stamp(self.data_path)
+                if os.path.exists(self.compacting_path):
+                    os.remove(self.compacting_path)
+        finally:
+            self._compact_lock.release()
+
+    def _snapshot(self):
+        """複製客戶與案子 dict；異動只會替換欄位值，淺層複製即可與之後的修改隔離"""
+        snapshot = []
+        for cust in self.get_all():
+            copied = dict(cust)
+            if "projects" in cust:
+                copied["projects"] = [dict(p) for p in cust["projects"]]
+            snapshot.append(copied)
+        return snapshot
+
+    def _wait_compaction(self):
+        thread = self._compact_thread
+        if thread and thread is not threading.current_thread():
+            thread.join()
+
+    def close(self):
+        """寫出待存資料、等待背景壓縮結束，並把剩餘日誌合併回快照"""
+        if self.saver:
+            self.saver.flush(self.data_path)
+        self._wait_compaction()
+        if self.journal:
+            self.compact()
+
+    # --- 索引維護 ---
+
+    def _rebuild_index(self, customers):
+        """重建 id / 名稱 / 案子索引"""
+        self._by_id = {}
+        self._by_name = {}
+        self._projects = {}
+        # 客戶 id -> {案名: [案子]}；同名案子依加入索引的順序，查詢時取第一個
+        self._project_names = {}
+        # get_all() 回傳的清單；新增時直接追加，刪除客戶後才重建
+        self._list = None
+        # 搜尋索引在第一次 search() 時才建立，避免拖慢啟動
+        self._search = None
+        for cust in customers:
+            self._index_customer(cust)
+
+    def _index_customer(self, cust):
+        self._by_id[cust["id"]] = cust
+        self._by_name.setdefault(cust["name"], []).append(cust)
+        if self._search is not None:
+            self._search.add(cust)
+        for project in cust.get("projects", []):
+            self._index_project(cust, project)
+
+    def _unindex_customer(self, cust):
+        self._by_id.pop(cust["id"], None)
+        if self._search is not None:
+            self._search.remove(cust["id"])
+        self._unindex_name(cust)
+        for project in cust.get("projects", []):
+            self._projects.pop(project["id"], None)
+        self._project_names.pop(cust["id"], None)
+
+    def _unindex_name(self, cust):
+        same_name = self._by_name.get(cust["name"], [])
+        same_name[:] = [c for c in same_name if c is not cust]
+        if not same_name:
+            self._by_name.pop(cust["name"], None)
+
+    def _index_project(self, cust, project):
+        self._projects[project["id"]] = (cust, project)
+        self._index_project_name(cust, project)
+
+    def _index_project_name(self, cust, project):
+        self._project_names.setdefault(cust["id"], {}).setdefault(project["name"], []).append(project)
+
+    def _unindex_project_name(self, cust, project):
+        names = self._project_names.get(cust["id"], {})
+        same_name = names.get(project["name"], [])
+        same_name[:] = [p for p in same_name if p is not project]
+        if not same_name:
+            names.pop(project["name"], None)
+
+    # --- 客戶 ---
     
+    def _mutate(self, record):
+        """先同步其他程式的變更，再套用一筆異動並持久化"""
+        with self._lock, self._file_lock:
+            self._sync_external()
+            self._apply(self.customers, record)
+            self._commit(record)
+
     def add(self, name, phone, address, template_path):
         """新增客戶"""
         cust = {
@@ -39,76 +362,131 @@ class CustomerManager:
             "template_path": template_path,
             "projects": []  # 初始化空案子列表
         }
-        self.customers.append(cust)
-        self.save()
+        self._mutate({"op": "add", "customer": cust})
         return cust
     
+    def restore_customers(self, customers, overwrite=False):
+        """由備份加入客戶與案子，沿用原本的 ID，全部套用後只存檔一次
+
+        已有同 ID 的客戶時只補上缺少的案子；overwrite 時另以備份內容更新客戶資料與案名。
+        案子 ID 已屬於其他客戶時略過。回傳 {"customers", "projects", "updated"} 的筆數。
+        """
+        stats = {"customers": 0, "projects": 0, "updated": 0}
+        with self._lock, self._file_lock:
+            self._sync_external()
+            records = []
+
+            def apply(record, kind):
+                self._apply(self.customers, record)
+                records.append(record)
+                stats[kind] += 1
+
+            for cust in customers:
+                fields = {k: cust.get(k, "") for k in ("name", "phone", "address", "template_path")}
+                existing = self._by_id.get(cust["id"])
+                if existing is None:
+                    apply({"op": "add", "customer": dict(fields, id=cust["id"], projects=[])}, "customers")
+                elif overwrite and any(existing.get(k, "") != v for k, v in fields.items()):
+                    apply({"op": "update", "id": cust["id"], "fields": fields}, "updated")
+                for project in cust.get("projects", []):
+                    owner, current = self._projects.get(project["id"], (None, None))
+                    if current is None:
+                        apply({"op": "add_project", "cust_id": cust["id"],
+                               "project": {"id": project["id"], "name": project["name"]}}, "projects")
+                    elif overwrite and owner["id"] == cust["id"] and current["name"] != project["name"]:
+                        apply({"op": "update_project", "project_id": project["id"], "name": project["name"]},
+                              "updated")
+            # 尚未寫出前若其他程式改過檔案，save() 重新載入後會再套用這些異動
+            self._unsaved.extend(records)
+        if records:
+            # 整批寫成一份快照，不逐筆追加日誌。save() 會等待背景壓縮並先取壓縮鎖、再取資料鎖，
+            # 必須在放開資料鎖之後呼叫
+            self.save()
+        return stats
+
     def update(self, cust_id, **kwargs):
         """更新客戶資訊"""
-        for cust in self.customers:
-            if cust["id"] == cust_id:
-                cust.update(kwargs)
-                self.save()
-                return cust
-        return None
+        if cust_id not in self._by_id:
+            return None
+        self._mutate({"op": "update", "id": cust_id, "fields": kwargs})
+        # 同步時可能讀到其他程式已刪除這位客戶
+        return self._by_id.get(cust_id)
     
     def delete(self, cust_id):
         """刪除客戶"""
-        self.customers = [c for c in self.customers if c["id"] != cust_id]
-        self.save()
+        if cust_id not in self._by_id:
+            return
+        self._mutate({"op": "delete", "id": cust_id})
     
     def get_all(self):
-        """取得所有客戶"""
-        return self.customers
+        """取得所有客戶（依加入順序）"""
+        if self._list is None:
+            self._list = list(self.customers.values())
+        return self._list
+
+    def count(self):
+        """客戶總數"""
+        return len(self.customers)
+
+    def iter_name_pages(self, page_size=1000):
+        """分頁取得 (id, 名稱)，供下拉選單逐頁載入"""
+        customers = self.get_all()
+        for start in range(0, len(customers), page_size):
+            yield [(c["id"], c["name"]) for c in customers[start:start + page_size]]
+
+    def iter_pages(self, page_size=1000):
+        """分頁取得客戶資料"""
+        customers = self.get_all()
+        for start in range(0, len(customers), page_size):
+            yield customers[start:start + page_size]
     
     def get_by_id(self, cust_id):
         """根據 ID 取得客戶"""
-        for cust in self.customers:
-            if cust["id"] == cust_id:
-                return cust
-        return None
+        return self._by_id.get(cust_id)
+
+    def get_by_name(self, name):
+        """根據名稱取得客戶；同名時回傳第一位"""
+        same_name = self._by_name.get(name)
+        return same_name[0] if same_name else None
+
+    def get_all_by_name(self, name):
+        """根據名稱取得所有同名客戶"""
+        return list(self._by_name.get(name, []))
+
+    def search(self, query, limit=20):
+        """依名稱、電話或地址的部分字串搜尋客戶"""
+        with self._lock:
+            if self._search is None:
+                self._search = CustomerSearchIndex(self.get_all())
+            return [self._by_id[cust_id] for cust_id in self._search.search(query, limit)]
     
+    # --- 案子 ---
+
     def add_project(self, cust_id, project_name):
         """為客戶新增案子"""
-        cust = self.get_by_id(cust_id)
-        if not cust:
+        if cust_id not in self._by_id:
             return None
         
         project = {
             "id": str(uuid.uuid4()),
             "name": project_name
         }
-        
-        # 確保 projects 列表存在
-        if "projects" not in cust:
-            cust["projects"] = []
-        
-        cust["projects"].append(project)
-        self.save()
+        self._mutate({"op": "add_project", "cust_id": cust_id, "project": project})
         return project
     
     def update_project(self, cust_id, project_id, new_name):
         """更新客戶案子名稱"""
-        cust = self.get_by_id(cust_id)
-        if not cust:
+        cust, project = self._projects.get(project_id, (None, None))
+        if not project or cust["id"] != cust_id:
             return None
-        
-        for project in cust["projects"]:
-            if project["id"] == project_id:
-                project["name"] = new_name
-                self.save()
-                return project
-        return None
+        self._mutate({"op": "update_project", "project_id": project_id, "name": new_name})
+        return self._projects.get(project_id, (None, None))[1]
     
     def delete_project(self, cust_id, project_id):
         """刪除客戶的案子"""
-        cust = self.get_by_id(cust_id)
-        if not cust:
+        if cust_id not in self._by_id:
             return False
-        
-        # 過濾掉要刪除的案子
-        cust["projects"] = [p for p in cust["projects"] if p["id"] != project_id]
-        self.save()
+        self._mutate({"op": "delete_project", "cust_id": cust_id, "project_id": project_id})
         return True
     
     def get_projects(self, cust_id):
@@ -117,3 +495,12 @@ class CustomerManager:
         if not cust:
             return []
         return cust.get("projects", [])
+
+    def get_project(self, project_id):
+        """根據案子 ID 取得 (客戶, 案子)；找不到時回傳 (None, None)"""
+        return self._projects.get(project_id, (None, None))
+
+    def get_project_by_name(self, cust_id, project_name):
+        """根據客戶 ID 與案名取得案子；同名時回傳第一個"""
+        same_name = self._project_names.get(cust_id, {}).get(project_name)
+        return same_name[0] if same_name else None
@@ -3,13 +3,65 @@
 import os
 import zipfile
 from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment
 from openpyxl.utils.exceptions import InvalidFileException
 from datetime import datetime
+from services.money import Money
+
+
+# 報價單明細的起始列與欄位
+QUOTE_START_ROW = 7
+QUOTE_HEADERS = ('項目', '數量', '單位', '單價', '小計')
+
+
+def _cell_value(value):
+    """Money 以 Decimal 寫入儲存格，保留精確到分的金額"""
+    return value.to_decimal() if isinstance(value, Money) else value
+
+
+def _number(value):
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+def _quote_rows(quote_data):
+    """報價明細逐列產生 (項目, 數量, 單位, 單價, 小計)"""
+    if 'groups' not in quote_data:
+        for item in quote_data['items']:
+            values = (item['item'], item['quantity'], item['unit'],
+                      _cell_value(item['unit_price']), _cell_value(item['subtotal']))
+            yield values + (item['date'],) if 'date' in item else values
+        return
+    for group in quote_data['groups']:
+        s = group.sewing_item
+        quantity = s.quantity if s.quantity is not None else s.pieces
+        yield (f"{group.item_number} {s.fabric} {s.type} {_number(s.width)}x{_number(s.height)}",
+               _number(quantity), s.unit, _cell_value(s.unit_price), _cell_value(s.subtotal))
+        for sub in group.sub_items:
+            yield (f"　{sub.description}", _number(sub.quantity), None,
+                   _cell_value(sub.unit_price), _cell_value(sub.subtotal))
+
+
+def _total_rows(quote_data):
+    """明細之後的 (標籤, 金額)；有 totals (QuoteTotals) 時列出小計、折扣、稅額與總計"""
+    totals = quote_data.get('totals')
+    if totals is None:
+        return [("小計", quote_data['subtotal']), ("總計", quote_data['total'])]
+    rows = [("小計", totals.subtotal)]
+    if totals.discount:
+        rows.append(("折扣", -totals.discount))
+    rate = quote_data.get('tax_rate')
+    rows.append((f"稅額（{rate:.0%}）" if rate else "稅額", totals.tax))
+    rows.append(("總計", totals.total))
+    return rows
+
 
 class ExcelManager:
     """Excel 檔案管理器"""
 
+    # 明細超過此列數時改以唯寫模式串流寫出，不套用客戶範本（效能比較見 bench_export.py）
+    STREAMING_ROWS = 2000
+
     def __init__(self, config):
         # 接收並保存設定，以便後續擴充使用
         self.config = config
@@ -40,57 +92,102 @@ class ExcelManager:
 
         wb.save(filename)
 
+    def load_price_table(self, filename: str) -> list:
+        """讀取價格表，回傳計價規則清單（fabric, type, unit_price, unit, min_quantity）"""
+        columns = {'窗簾類型': 'type', '材質': 'fabric', '單價': 'unit_price', '單位': 'unit', '最低數量': 'min_quantity'}
+        wb = load_workbook(filename, read_only=True, data_only=True)
+        try:
+            rows = wb.active.iter_rows(values_only=True)
+            header = next(rows, ())
+            fields = [columns.get(str(h).strip()) if h is not None else None for h in header]
+            rules = []
+            for row in rows:
+                rule = {f: v for f, v in zip(fields, row) if f and v is not None}
+                if rule.get('fabric') is None or rule.get('type') is None:
+                    continue
+                rule['fabric'] = str(rule['fabric'])
+                rule['type'] = str(rule['type'])
+                rules.append(rule)
+            return rules
+        finally:
+            wb.close()
+
     def create_quote_from_template(self, template_path: str, output_path: str, quote_data: dict):
         """
-        以客戶專屬範本產生報價單；若範本不存在或非合法 .xlsx，
-        自動用內建範本取代再產生報價。
+        以客戶專屬範本產生報價單；若範本不存在或非合法 .xlsx，改用內建版面。
+
+        quote_data 的 groups（ItemGroup 清單）每個貨號寫一列車工、其下每個子項目一列；
+        沒有 groups 時沿用舊版的 items 平面清單。總計、折扣與稅額接在最後一列明細之後，
+        不再固定在某一格。明細超過 STREAMING_ROWS 列時以 openpyxl 唯寫模式逐列串流寫出，
+        記憶體用量不隨列數增加。唯寫模式無法載入既有活頁簿，因此超過 STREAMING_ROWS 列的報價
+        會忽略客戶範本（格式、標誌與範本中的其他內容都不會出現），一律輸出內建版面。
         """
-        # 1. 範本檢查：存在、.xlsx 副檔名、且為 zip archive
-        use_path = template_path
-        if (not os.path.exists(template_path)
-           or not template_path.lower().endswith('.xlsx')
-           or not zipfile.is_zipfile(template_path)):
-            # 產生內建範本
-            default_tpl = os.path.join(os.path.dirname(output_path), 'default_quote_template.xlsx')
-            self.create_price_template(default_tpl)
-            use_path = default_tpl
-
-        # 2. 嘗試載入範本
-        try:
-            wb = load_workbook(use_path)
-        except InvalidFileException:
-            wb = Workbook()
-        ws = wb.active
+        if 'groups' in quote_data:
+            row_count = sum(1 + len(group.sub_items) for group in quote_data['groups'])
+        else:
+            row_count = len(quote_data['items'])
+        rows = _quote_rows(quote_data)
+
+        out_dir = os.path.dirname(output_path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+        template_ok = (template_path and os.path.exists(template_path)
+                       and template_path.lower().endswith('.xlsx') and zipfile.is_zipfile(template_path))
+        if template_ok and row_count <= self.STREAMING_ROWS:
+            try:
+                wb = load_workbook(template_path)
+            except InvalidFileException:
+                wb = None
+            if wb is not None:
+                self._fill_template(wb.active, quote_data, rows)
+                wb.save(output_path)
+                return
+        self._write_streaming(output_path, quote_data, rows)
 
-        # 3. 寫入本公司資訊
+    def _fill_template(self, ws, quote_data, rows):
+        # 本公司資訊與客戶資訊
         ws['B2'] = quote_data['company']['company_name']
         ws['B3'] = quote_data['company']['company_phone']
         ws['B4'] = quote_data['company']['company_address']
-
-        # 4. 寫入客戶資訊
         ws['D2'] = quote_data['customer']['name']
         ws['D3'] = quote_data['customer']['phone']
         ws['D4'] = quote_data['customer']['address']
 
-        # 5. 寫入明細（起始列 7），並正確帶入 unit
-        start_row = 7
-        for idx, item in enumerate(quote_data['items'], start=start_row):
-            ws.cell(row=idx, column=1, value=item['item'])
-            ws.cell(row=idx, column=2, value=item['quantity'])
-            ws.cell(row=idx, column=3, value=item['unit'])
-            ws.cell(row=idx, column=4, value=item['unit_price'])
-            ws.cell(row=idx, column=5, value=item['subtotal'])
-            # 如果有日期欄（第6欄），也可：
-            if 'date' in item:
-                ws.cell(row=idx, column=6, value=item['date'])
-
-        # 6. 寫入總計（假設在 E20–E22）
-        ws['E20'] = quote_data['subtotal']
-        ws['E21'] = quote_data['total']
-
-        # 7. 確保輸出目錄存在
-        out_dir = os.path.dirname(output_path)
-        if out_dir:
-            os.makedirs(out_dir, exist_ok=True)
+        # 明細由第 7 列起，總計接在明細之後空一列
+        row = QUOTE_START_ROW
+        for row, values in enumerate(rows, start=QUOTE_START_ROW):
+            for col, value in enumerate(values, start=1):
+                ws.cell(row=row, column=col, value=value)
+        row += 2
+        for label, value in _total_rows(quote_data):
+            ws.cell(row=row, column=4, value=label)
+            ws.cell(row=row, column=5, value=_cell_value(value))
+            row += 1
+
+    def _write_streaming(self, output_path, quote_data, rows):
+        """以唯寫模式建立與範本相同位置的版面：公司 B2–B4、客戶 D2–D4、明細由第 7 列起"""
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("報價單")
+        for col, width in zip("ABCDE", (40, 10, 8, 14, 16)):
+            ws.column_dimensions[col].width = width
+        company, customer = quote_data['company'], quote_data['customer']
+
+        def bold(value):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.font = Font(bold=True)
+            return cell
 
+        ws.append([bold("報價單"), quote_data.get('project', ''), None, "日期",
+                   quote_data.get('date') or datetime.now().strftime("%Y-%m-%d")])
+        ws.append(["公司", company['company_name'], "客戶", customer['name']])
+        ws.append(["電話", company['company_phone'], "電話", customer['phone']])
+        ws.append(["地址", company['company_address'], "地址", customer['address']])
+        ws.append([])
+        ws.append([bold(h) for h in QUOTE_HEADERS])
+        for values in rows:
+            ws.append(values)
+        ws.append([])
+        for label, value in _total_rows(quote_data):
+            ws.append([None, None, None, bold(label), _cell_value(value)])
         wb.save(output_path)
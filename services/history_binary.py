@@ -0,0 +1,147 @@
+# services/history_binary.py
+
+import glob
+import os
+from typing import Iterable, List
+from services.pricing import ItemGroup
+from services.quote_table import QuoteTable
+from services.atomic_io import atomic_open, atomic_write_json
+from services.file_lock import file_stamp
+from services.history_manager import HistoryManager, CustomEncoder
+from services.history_loader import RecordError, load_history
+
+BINARY_EXTENSION = ".cqh"
+
+
+def dumps(groups: Iterable[ItemGroup]) -> bytes:
+    """貨號群組 -> 二進位內容；直接讀取 dataclass 屬性放進欄位陣列，不經過 asdict"""
+    return QuoteTable.from_groups(groups).to_bytes()
+
+
+def loads(data) -> List[ItemGroup]:
+    return QuoteTable.from_bytes(data).to_groups()
+
+
+def write_binary(path, groups: Iterable[ItemGroup]):
+    data = dumps(groups)
+    with atomic_open(path, 'wb') as f:
+        f.write(data)
+
+
+def read_binary(path) -> List[ItemGroup]:
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def export_json(binary_path, json_path):
+    """把二進位檔匯出成與 HistoryManager 相同格式的 JSON，匯入回來內容完全相同"""
+    with open(binary_path, 'rb') as f:
+        table = QuoteTable.from_bytes(f.read())
+    atomic_write_json(json_path, table.to_records(), cls=CustomEncoder)
+
+
+def import_json(json_path, binary_path) -> List[RecordError]:
+    """JSON 歷史檔（含舊版格式）轉成二進位檔，回傳無法讀取而略過的紀錄"""
+    errors = []
+    write_binary(binary_path, load_history(json_path, errors))
+    return errors
+
+
+def convert_history_dir(data_dir, to="binary"):
+    """把資料夾內所有案子的報價歷史轉成 to 指定的格式（"binary" 或 "json"），並移除原檔
+
+    舊版 {案子鍵: 貨號清單} 的檔案不是單一案子的紀錄，保持原樣不轉換。
+    回傳 (轉換的檔案數, [(檔案, 略過的紀錄或錯誤)])。
+    """
+    if to == "binary":
+        sources, target_ext = glob.glob(os.path.join(data_dir, "history_*.json")), BINARY_EXTENSION
+    elif to == "json":
+        sources, target_ext = glob.glob(os.path.join(data_dir, f"history_*{BINARY_EXTENSION}")), ".json"
+    else:
+        raise ValueError(f"不支援的歷史格式: {to}")
+    converted, problems = 0, []
+    manager = HistoryManager(data_dir)
+    with manager._file_lock:
+        for path in sorted(sources):
+            target = os.path.splitext(path)[0] + target_ext
+            try:
+                if to == "binary":
+                    if _is_keyed(path):
+                        continue
+                    errors = import_json(path, target)
+                    problems.extend((path, str(e)) for e in errors)
+                else:
+                    export_json(path, target)
+            except (OSError, ValueError) as e:
+                problems.append((path, str(e)))
+                continue
+            os.remove(path)
+            converted += 1
+    return converted, problems
+
+
+def _is_keyed(path):
+    # 舊版多案子格式以 { 開頭
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        return f.read(64).lstrip().startswith("{")
+
+
+class BinaryHistoryManager(HistoryManager):
+    """以二進位格式保存報價歷史：data/history_<project_id>.cqh，介面與 HistoryManager 相同
+
+    內容為 QuoteTable 的字串表與欄位陣列，布料、形式只存一次，金額存整數分，
+    讀寫都是整段陣列複製，比 JSON 小且快。
+    尚未轉換的案子仍讀取原本的 JSON 檔，下次存檔時改寫為二進位並移除 JSON 檔。
+    """
+
+    def _get_path_for_project(self, project_id):
+        return os.path.join(self.base_dir, f"history_{project_id}{BINARY_EXTENSION}")
+
+    def _json_path(self, project_id):
+        return super()._get_path_for_project(project_id)
+
+    def history_path(self, project_id):
+        """二進位檔，尚未轉換時為原本的 JSON 檔"""
+        for path in (self._get_path_for_project(project_id), self._json_path(project_id)):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def iter_project_items(self, project_id, errors=None):
+        path = self._get_path_for_project(project_id)
+        self._stamps[project_id] = file_stamp(path)
+        if not os.path.exists(path):
+            yield from self._iter_json(self._json_path(project_id), project_id, errors)
+            return
+        try:
+            groups = read_binary(path)
+        except (OSError, ValueError) as e:
+            if errors is not None:
+                errors.append(RecordError(0, f"無法讀取二進位檔: {e}"))
+            return
+        yield from groups
+
+    def save_project_items(self, project_id, records, force=False):
+        path = self._get_path_for_project(project_id)
+        with self._file_lock:
+            self._check_conflict(project_id, path, force)
+            write_binary(path, records)
+            self._stamps[project_id] = file_stamp(path)
+            legacy = self._json_path(project_id)
+            if os.path.exists(legacy):
+                os.remove(legacy)
+            if self.index is not None:
+                self.index.update(project_id, records, path)
+        if self.revisions is not None:
+            self.revisions.commit(project_id, records)
+
+    def delete_project_file(self, project_id):
+        """刪除案子的報價紀錄，包含尚未轉換的 JSON 檔"""
+        super().delete_project_file(project_id)
+        legacy = self._json_path(project_id)
+        with self._file_lock:
+            if os.path.exists(legacy):
+                try:
+                    os.remove(legacy)
+                except OSError as e:
+                    print(f"Error deleting file {legacy}: {e}")
@@ -0,0 +1,288 @@
+# services/history_index.py
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from services.money import Money
+from services.file_lock import file_stamp
+from services.history_loader import iter_history
+from services.history_binary import BINARY_EXTENSION, read_binary
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS index_projects (
+    project_id TEXT PRIMARY KEY,
+    group_count INTEGER NOT NULL,
+    sub_count INTEGER NOT NULL,
+    total_cents INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    stamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_index_projects_updated ON index_projects(updated_at);
+
+CREATE TABLE IF NOT EXISTS index_fabrics (
+    project_id TEXT NOT NULL REFERENCES index_projects(project_id) ON DELETE CASCADE,
+    fabric TEXT NOT NULL,
+    type TEXT NOT NULL,
+    groups INTEGER NOT NULL,
+    pieces REAL NOT NULL,
+    cents INTEGER NOT NULL,
+    PRIMARY KEY (project_id, fabric, type)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_index_fabrics_key ON index_fabrics(fabric, type);
+
+-- 不是單一案子紀錄的歷史檔（舊版以客戶為檔名、內含多個案子的格式），記下戳記以免每次都重新讀取
+CREATE TABLE IF NOT EXISTS index_ignored (
+    project_id TEXT PRIMARY KEY,
+    stamp TEXT NOT NULL
+);
+"""
+
+
+def summarize_groups(groups):
+    """貨號群組 -> 索引用的彙總：貨號數、子項目數、總計（分）與各 (布料, 形式) 的用量"""
+    group_count = sub_count = total = 0
+    fabrics = {}
+    for group in groups:
+        s = group.sewing_item
+        group_count += 1
+        sub_count += len(group.sub_items)
+        total += group.total.cents
+        usage = fabrics.setdefault((s.fabric, s.type), [0, 0.0, 0])
+        usage[0] += 1
+        usage[1] += float(s.pieces)
+        usage[2] += s.subtotal.cents
+    return {
+        "group_count": group_count,
+        "sub_count": sub_count,
+        "total_cents": total,
+        "fabrics": [(f, t, n, pieces, cents) for (f, t), (n, pieces, cents) in fabrics.items()],
+    }
+
+
+def _read_groups(path, project_id):
+    """與 HistoryManager／BinaryHistoryManager 載入時看到的內容相同（略過無法讀取的紀錄）
+
+    舊版 {案子鍵: 貨號清單} 的檔案中沒有此案子的紀錄時，表示它不是這個案子的檔案，回傳 None。
+    """
+    if path.endswith(BINARY_EXTENSION):
+        return read_binary(path)
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        keyed = f.read(64).lstrip().startswith("{")
+        f.seek(0)
+        groups = [record.group for record in iter_history(f)
+                  if record.group is not None and record.key in (None, project_id)]
+    return None if keyed and not groups else groups
+
+
+def _summarize_file(args):
+    """在子程序中讀取一個歷史檔並彙總；回傳 (案子 ID, 檔案戳記, 彙總、錯誤訊息或 None)
+
+    None 表示該檔不是單一案子的紀錄，不列入索引。
+    """
+    project_id, path = args
+    stamp = file_stamp(path)
+    try:
+        groups = _read_groups(path, project_id)
+        return project_id, stamp, None if groups is None else summarize_groups(groups)
+    except (OSError, ValueError) as e:
+        return project_id, stamp, str(e)
+
+
+def _stamp_text(stamp):
+    return ",".join(map(str, stamp)) if stamp else ""
+
+
+def _updated_at(stamp):
+    return datetime.fromtimestamp(stamp[1] / 1e9).isoformat(timespec="seconds")
+
+
+def _month_range(month):
+    """'YYYY-MM' -> (該月第一天, 下個月第一天)，供 since／until 使用"""
+    year, mon = map(int, month.split("-"))
+    nxt = f"{year + 1:04d}-01" if mon == 12 else f"{year:04d}-{mon + 1:02d}"
+    return f"{year:04d}-{mon:02d}-01", f"{nxt}-01"
+
+
+class HistoryIndex:
+    """每個案子一個檔案時的報價彙總索引，存於 data/history_index.db
+
+    每個案子記錄貨號數、子項目數、總計、最後修改時間與各 (布料, 形式) 的用量，
+    並記下建立索引時歷史檔的檔案戳記。HistoryManager 存檔或刪除時即時更新該案子；
+    其他程式或舊版程式改過的檔案由 sync() 比對戳記找出，只重新彙總有變動的檔案，
+    檔案多時以多個程序平行讀取。報表查詢只讀索引，不開任何歷史檔。
+    """
+
+    # 需要重新彙總的檔案少於此數時直接在本程序處理，省下啟動程序池的時間
+    PARALLEL_MIN_FILES = 16
+
+    def __init__(self, storage, data_dir="data"):
+        self.storage = storage
+        self.data_dir = data_dir
+        with storage.transaction() as conn:
+            conn.executescript(INDEX_SCHEMA)
+
+    # ── 維護 ──────────────────────────────────────────────
+
+    def _write(self, conn, project_id, stamp, summary):
+        conn.execute("DELETE FROM index_fabrics WHERE project_id = ?", (project_id,))
+        conn.execute(
+            "INSERT OR REPLACE INTO index_projects (project_id, group_count, sub_count, total_cents, updated_at, stamp) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (project_id, summary["group_count"], summary["sub_count"], summary["total_cents"],
+             _updated_at(stamp), _stamp_text(stamp)))
+        conn.executemany(
+            "INSERT INTO index_fabrics (project_id, fabric, type, groups, pieces, cents) VALUES (?, ?, ?, ?, ?, ?)",
+            [(project_id,) + tuple(usage) for usage in summary["fabrics"]])
+
+    def update(self, project_id, groups, path):
+        """存檔後更新單一案子；path 為剛寫好的歷史檔"""
+        stamp = file_stamp(path)
+        if stamp is None:
+            return
+        summary = summarize_groups(groups)
+        with self.storage.transaction() as conn:
+            self._write(conn, project_id, stamp, summary)
+
+    @staticmethod
+    def _delete(conn, project_id):
+        conn.execute("DELETE FROM index_fabrics WHERE project_id = ?", (project_id,))
+        conn.execute("DELETE FROM index_projects WHERE project_id = ?", (project_id,))
+
+    def remove(self, project_id):
+        with self.storage.transaction() as conn:
+            self._delete(conn, project_id)
+
+    def _history_files(self):
+        """{案子 ID: 歷史檔}；同一案子兩種格式都有時以二進位檔為準"""
+        files = {}
+        for ext in (".json", BINARY_EXTENSION):
+            for path in glob.glob(os.path.join(self.data_dir, f"history_*{ext}")):
+                files[os.path.basename(path)[len("history_"):-len(ext)]] = path
+        return files
+
+    def sync(self, processes=None):
+        """讓索引與歷史檔一致：重新彙總戳記不同或新出現的檔案，移除已不存在的案子
+
+        processes 為子程序數，預設為 CPU 數；回傳 (重新彙總的檔案數, [(檔案, 錯誤)])。
+        可在背景執行緒執行，與存檔時的 update()/remove() 同時進行。
+        """
+        files = self._history_files()
+        indexed = {row["project_id"]: row["stamp"]
+                   for row in self.storage.query("SELECT project_id, stamp FROM index_projects")}
+        ignored = {row["project_id"]: row["stamp"]
+                   for row in self.storage.query("SELECT project_id, stamp FROM index_ignored")}
+        jobs = [(pid, path) for pid, path in files.items()
+                if _stamp_text(file_stamp(path)) not in (indexed.get(pid), ignored.get(pid))]
+        gone = [pid for pid in indexed if pid not in files]
+
+        if len(jobs) >= self.PARALLEL_MIN_FILES and processes != 1:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                results = list(pool.map(_summarize_file, jobs, chunksize=max(1, len(jobs) // 64)))
+        else:
+            results = [_summarize_file(job) for job in jobs]
+
+        errors = []
+        with self.storage.transaction() as conn:
+            for project_id, stamp, summary in results:
+                if stamp is None or file_stamp(files[project_id]) != stamp:
+                    # 彙總途中被刪除或重新存檔：存檔時已由 update()/remove() 更新，不以舊結果覆蓋
+                    continue
+                if isinstance(summary, str):
+                    errors.append((files[project_id], summary))
+                    continue
+                if summary is None:
+                    self._delete(conn, project_id)
+                    conn.execute("INSERT OR REPLACE INTO index_ignored (project_id, stamp) VALUES (?, ?)",
+                                 (project_id, _stamp_text(stamp)))
+                    continue
+                conn.execute("DELETE FROM index_ignored WHERE project_id = ?", (project_id,))
+                self._write(conn, project_id, stamp, summary)
+            for project_id in gone:
+                self._delete(conn, project_id)
+            conn.executemany("DELETE FROM index_ignored WHERE project_id = ?",
+                             [(pid,) for pid in ignored if pid not in files])
+        return len(results), errors
+
+    def rebuild(self, processes=None):
+        """清空索引後由歷史檔全部重建"""
+        with self.storage.transaction() as conn:
+            conn.execute("DELETE FROM index_fabrics")
+            conn.execute("DELETE FROM index_projects")
+            conn.execute("DELETE FROM index_ignored")
+        return self.sync(processes)
+
+    # ── 報表 ──────────────────────────────────────────────
+
+    @staticmethod
+    def _period(since, until, column="updated_at"):
+        clauses, params = [], []
+        if since:
+            clauses.append(f"{column} >= ?")
+            params.append(str(since))
+        if until:
+            clauses.append(f"{column} < ?")
+            params.append(str(until))
+        return clauses, params
+
+    @staticmethod
+    def _summary(row):
+        return {"project_id": row["project_id"], "group_count": row["group_count"], "sub_count": row["sub_count"],
+                "total": Money(row["total_cents"]), "updated_at": row["updated_at"]}
+
+    def project_summary(self, project_id):
+        """單一案子的彙總；沒有紀錄時回傳 None"""
+        row = self.storage.query_one("SELECT * FROM index_projects WHERE project_id = ?", (project_id,))
+        return self._summary(row) if row else None
+
+    def projects(self, since=None, until=None):
+        """期間內（依最後修改時間，until 不含）有修改的案子彙總，最近修改的在前"""
+        clauses, params = self._period(since, until)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.storage.query(f"SELECT * FROM index_projects{where} ORDER BY updated_at DESC", params)
+        return [self._summary(row) for row in rows]
+
+    def totals_by_customer(self, customers, since=None, until=None):
+        """各客戶的報價總額；customers 為 customer_mgr.get_all() 的客戶清單（含 projects）
+
+        回傳 [{"customer_id", "name", "projects", "total"}]，金額高的在前，沒有報價的客戶不列出。
+        """
+        owner = {p["id"]: cust for cust in customers for p in cust.get("projects", [])}
+        clauses, params = self._period(since, until)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        totals = {}
+        for row in self.storage.query(f"SELECT project_id, total_cents FROM index_projects{where}", params):
+            cust = owner.get(row["project_id"])
+            if cust is None:
+                continue
+            entry = totals.setdefault(cust["id"], {"customer_id": cust["id"], "name": cust.get("name", ""),
+                                                   "projects": 0, "total": Money()})
+            entry["projects"] += 1
+            entry["total"] += Money(row["total_cents"])
+        return sorted(totals.values(), key=lambda e: e["total"], reverse=True)
+
+    def totals_for_month(self, customers, month):
+        """某月（'YYYY-MM'）各客戶的報價總額"""
+        return self.totals_by_customer(customers, *_month_range(month))
+
+    def fabric_usage(self, since=None, until=None, limit=None):
+        """各 (布料, 形式) 的使用次數、幅數、車工金額與用到的案子數，用得最多的在前"""
+        clauses, params = self._period(since, until, "p.updated_at")
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        sql = ("SELECT f.fabric, f.type, SUM(f.groups) AS groups, SUM(f.pieces) AS pieces, "
+               "SUM(f.cents) AS cents, COUNT(*) AS projects FROM index_fabrics f "
+               f"JOIN index_projects p ON p.project_id = f.project_id{where} "
+               "GROUP BY f.fabric, f.type ORDER BY groups DESC, cents DESC")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [{"fabric": r["fabric"], "type": r["type"], "groups": r["groups"], "pieces": r["pieces"],
+                 "subtotal": Money(r["cents"]), "projects": r["projects"]}
+                for r in self.storage.query(sql, params)]
+
+    def monthly_totals(self):
+        """各月份（依最後修改時間）的案子數與報價總額，[("YYYY-MM", 案子數, 總額)]"""
+        rows = self.storage.query(
+            "SELECT substr(updated_at, 1, 7) AS month, COUNT(*) AS projects, SUM(total_cents) AS cents "
+            "FROM index_projects GROUP BY month ORDER BY month")
+        return [(r["month"], r["projects"], Money(r["cents"])) for r in rows]
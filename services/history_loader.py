@@ -0,0 +1,288 @@
+# services/history_loader.py
+
+import json
+import re
+import uuid
+from dataclasses import dataclass
+from typing import Any, Iterator, List, Optional
+from services.pricing import ItemGroup, SewingItem, SubItem
+
+# 跳過字串內容、只留下括號，用來找出損毀紀錄的結尾
+# 找值的結尾用：完整的字串、缺少結尾引號的字串開頭、括號與逗號
+_BRACKET_RE = re.compile(r'"(?:[^"\\]|\\.)*"|"|[\[\]{},]', re.S)
+_WS = " \t\r\n"
+
+
+class HistoryRecordError(ValueError):
+    """單一報價紀錄無法解讀或不符合格式"""
+
+
+@dataclass
+class RecordError:
+    """載入時略過的紀錄；key 為舊版多案子格式的鍵，index 為該清單中的第幾筆"""
+    index: int
+    message: str
+    key: Optional[str] = None
+
+    def __str__(self):
+        where = f"{self.key} 第 {self.index + 1} 筆" if self.key is not None else f"第 {self.index + 1} 筆"
+        return f"{where}: {self.message}"
+
+
+@dataclass
+class LoadedRecord:
+    """串流讀出的一筆紀錄：group 與 error 只會有一個"""
+    index: int
+    key: Optional[str] = None
+    group: Optional[ItemGroup] = None
+    error: Optional[RecordError] = None
+    upgraded: bool = False
+
+
+# ── 格式檢查與舊版升級 ─────────────────────────────────
+
+def _number(data, name, where, default=None, optional=False):
+    value = data.get(name, default)
+    if value is None and optional:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise HistoryRecordError(f"{where}的 {name} 不是數字: {value!r}")
+    return value
+
+
+def _text(data, name, where, default=None):
+    value = data.get(name, default)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    if not isinstance(value, str):
+        raise HistoryRecordError(f"{where}缺少 {name}" if value is None else f"{where}的 {name} 不是文字: {value!r}")
+    return value
+
+
+def upgrade_record(data: Any):
+    """檢查一筆貨號紀錄並升級成目前的格式，回傳 (ItemGroup, 是否經過升級)
+
+    舊版曾用 method 表示形式、sewing_price 表示單價；更早的版本沒有 sewing_item，
+    車工欄位直接放在貨號那一層；子項目可能沒有 id。格式不符時丟出 HistoryRecordError。
+    """
+    if not isinstance(data, dict):
+        raise HistoryRecordError("紀錄不是物件")
+    item_number = _text(data, "item_number", "貨號")
+    upgraded = False
+    sewing = data.get("sewing_item")
+    if sewing is None:
+        sewing, upgraded = data, True
+    elif not isinstance(sewing, dict):
+        raise HistoryRecordError("sewing_item 不是物件")
+    if "type" not in sewing and "method" in sewing:
+        sewing, upgraded = dict(sewing, type=sewing["method"]), True
+    if "unit_price" not in sewing and "sewing_price" in sewing:
+        sewing, upgraded = dict(sewing, unit_price=sewing["sewing_price"]), True
+
+    where = f"貨號 {item_number} 車工"
+    unit = sewing.get("unit")
+    catalog_version = sewing.get("catalog_version")
+    if catalog_version is not None and (isinstance(catalog_version, bool) or not isinstance(catalog_version, int)):
+        raise HistoryRecordError(f"{where}的 catalog_version 不是整數: {catalog_version!r}")
+    sewing_item = SewingItem(
+        fabric=_text(sewing, "fabric", where),
+        type=_text(sewing, "type", where),
+        width=_number(sewing, "width", where),
+        height=_number(sewing, "height", where),
+        pieces=_number(sewing, "pieces", where),
+        unit_price=_number(sewing, "unit_price", where),
+        subtotal=_number(sewing, "subtotal", where),
+        catalog_version=catalog_version,
+        unit=_text(sewing, "unit", where) if unit is not None else "幅",
+        quantity=_number(sewing, "quantity", where, optional=True),
+    )
+
+    subs = data.get("sub_items") or []
+    if not isinstance(subs, list):
+        raise HistoryRecordError(f"貨號 {item_number} 的 sub_items 不是清單")
+    sub_items = []
+    for sub in subs:
+        if not isinstance(sub, dict):
+            raise HistoryRecordError(f"貨號 {item_number} 的子項目不是物件")
+        where = f"貨號 {item_number} 子項目"
+        sub_id = sub.get("id")
+        if sub_id is None:
+            sub_id, upgraded = f"sub-{uuid.uuid4().hex[:6]}", True
+        sub_items.append(SubItem(
+            description=_text(sub, "description", where, ""),
+            id=str(sub_id),
+            quantity=_number(sub, "quantity", where, 1),
+            unit_price=_number(sub, "unit_price", where, 0),
+            subtotal=_number(sub, "subtotal", where, 0),
+        ))
+    return ItemGroup(item_number=item_number, sewing_item=sewing_item, sub_items=sub_items), upgraded
+
+
+# ── 串流解析 ──────────────────────────────────────────
+
+class _Reader:
+    """分段讀取 JSON 文字，一次只解析一個值，已解析的部分隨即丟棄"""
+
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        if self.pos:
+            self.buf, self.pos = self.buf[self.pos:], 0
+        self.buf += chunk
+        return True
+
+    def peek(self):
+        """下一個非空白字元，到檔尾時回傳空字串"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars):
+        ch = self.peek()
+        if not ch or ch not in chars:
+            raise HistoryRecordError(f"檔案格式錯誤：預期 {' 或 '.join(chars)}，讀到 {ch or '檔尾'}")
+        self.pos += 1
+        return ch
+
+    def value(self):
+        """解析下一個值；內容不完整時先補讀再試，確定損毀時跳過它並丟出 HistoryRecordError
+
+        只有這個值的結尾還沒讀進來時才補讀；結尾已在緩衝區內仍解析失敗就是損毀，
+        立刻跳過，不會為了一筆壞紀錄讀到檔尾。
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                end = None if e.msg.startswith("Unterminated string") else self._value_end()
+                if end is None:
+                    if self._fill():
+                        continue
+                    self.pos = len(self.buf)
+                    raise HistoryRecordError(f"檔案不完整，最後一筆被截斷: {e.msg}")
+                self.pos = end
+                raise HistoryRecordError(f"JSON 格式錯誤: {e.msg}")
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue   # 數字可能被切在區段邊界
+            self.pos = end
+            return value
+
+    def _value_end(self):
+        """以括號配對找出目前這個值在緩衝區中的結尾；結尾還沒讀進來時回傳 None"""
+        depth = 0
+        for match in _BRACKET_RE.finditer(self.buf, self.pos):
+            token = match.group()
+            if token == '"':
+                return None   # 字串被區段切斷
+            if token in "[{":
+                depth += 1
+            elif token in "]}":
+                if depth == 0:
+                    return match.start()   # 不是物件或清單的值，結束於外層的括號
+                depth -= 1
+                if depth == 0:
+                    return match.end()
+            elif token == "," and depth == 0:
+                return match.start()
+        return None
+
+
+def _iter_items(reader, key):
+    """逐一解析清單中的值，reader 位於 [ 之後"""
+    index = 0
+    if reader.peek() == "]":
+        reader.pos += 1
+        return
+    while True:
+        try:
+            yield index, reader.value(), None
+        except HistoryRecordError as e:
+            yield index, None, RecordError(index, str(e), key)
+            if not reader.peek():
+                return
+        index += 1
+        if not reader.peek():
+            raise HistoryRecordError("檔案不完整")
+        if reader.expect(",]") == "]":
+            return
+
+
+def iter_history(f, chunk_size=64 * 1024) -> Iterator[LoadedRecord]:
+    """邊讀邊解析報價歷史，每解析完一筆貨號就產生一筆 LoadedRecord
+
+    檔案內容為貨號清單，或舊版的 {案子鍵: 貨號清單}（此時 key 為該鍵）。
+    單筆紀錄損毀或格式不符只會產生帶 error 的紀錄，後面的紀錄照常讀取；
+    整個檔案結構錯誤或被截斷時以一筆 error 紀錄結束。
+    """
+    reader = _Reader(f, chunk_size)
+    key = None
+    index = -1
+    try:
+        start = reader.peek()
+        if not start:
+            return
+        reader.expect("[{")
+        if start == "[":
+            sections = [None]
+        else:
+            sections = None
+        while True:
+            if sections is None:
+                # 舊版格式：逐一讀出鍵，再讀該鍵底下的清單
+                if reader.peek() == "}":
+                    return
+                key = reader.value()
+                if not isinstance(key, str):
+                    raise HistoryRecordError("檔案格式錯誤：鍵不是文字")
+                reader.expect(":")
+                if reader.peek() != "[":
+                    reader.value()
+                    yield LoadedRecord(0, key, error=RecordError(0, "內容不是清單", key))
+                    if reader.expect(",}") == "}":
+                        return
+                    continue
+                reader.expect("[")
+            for index, data, error in _iter_items(reader, key):
+                if error is None:
+                    try:
+                        group, upgraded = upgrade_record(data)
+                    except HistoryRecordError as e:
+                        error = RecordError(index, str(e), key)
+                if error is not None:
+                    yield LoadedRecord(index, key, error=error)
+                else:
+                    yield LoadedRecord(index, key, group=group, upgraded=upgraded)
+            if sections is not None or not reader.peek() or reader.expect(",}") == "}":
+                return
+    except HistoryRecordError as e:
+        yield LoadedRecord(index + 1, key, error=RecordError(index + 1, str(e), key))
+
+
+def load_history(path, errors: Optional[List[RecordError]] = None, key=None) -> List[ItemGroup]:
+    """讀入整個檔案的貨號群組；無法讀取的紀錄加進 errors。key 不為 None 時只取舊版格式中該鍵的紀錄"""
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        groups = []
+        for record in iter_history(f):
+            if key is not None and record.key != key:
+                continue
+            if record.error is not None:
+                if errors is not None:
+                    errors.append(record.error)
+            else:
+                groups.append(record.group)
+        return groups
@@ -1,63 +1,116 @@
 import json, os
 from dataclasses import is_dataclass, asdict
-from services.pricing import ItemGroup, SewingItem, SubItem
+from services.money import Money
+from services.atomic_io import atomic_write_json
+from services.file_lock import FileLock, file_stamp
+from services.history_loader import iter_history
 
 class CustomEncoder(json.JSONEncoder):
     def default(self, o):
         if is_dataclass(o):
             return asdict(o)
+        if isinstance(o, Money):
+            # 以元為單位的數字寫出，舊版程式與既有檔案格式都能讀
+            return float(o)
         return super().default(o)
 
+class HistoryConflictError(RuntimeError):
+    """存檔時發現案子在載入後已被其他程式修改，直接寫入會蓋掉對方的變更"""
+
+    def __init__(self, project_id):
+        super().__init__(f"案子 {project_id} 的報價已被其他程式修改")
+        self.project_id = project_id
+
 class HistoryManager:
-    """管理每個案子的報價歷史，存為 data/history_<project_id>.json"""
-    def __init__(self, base_dir="data"):
+    """管理每個案子的報價歷史，存為 data/history_<project_id>.json
+
+    寫入與刪除在 history.lock 檔案鎖內進行；載入時記下檔案戳記，
+    is_stale() 只需一次 stat 就能判斷其他程式是否改過這個案子。
+    載入以 iter_history 邊讀邊解析，舊版格式當場升級；無法讀取的紀錄記在 load_errors。
+    提供 revisions (QuoteRevisions) 時，每次存檔另外記錄一個報價版本；
+    提供 index (HistoryIndex) 時，存檔與刪除同步更新該案子的彙總。
+    存檔時在檔案鎖內比對載入時的戳記，檔案已被其他程式改過時丟出 HistoryConflictError，
+    不會默默蓋掉對方的變更；確定要以目前內容為準時傳入 force=True。
+    """
+    def __init__(self, base_dir="data", revisions=None, index=None):
         self.base_dir = base_dir
+        self.revisions = revisions
+        self.index = index
         os.makedirs(self.base_dir, exist_ok=True)
+        self._file_lock = FileLock(os.path.join(self.base_dir, "history.lock"))
+        self._stamps = {}
+        self.load_errors = {}
 
     def _get_path_for_project(self, project_id):
         return os.path.join(self.base_dir, f"history_{project_id}.json")
 
-    def load_project_items(self, project_id):
+    def history_path(self, project_id):
+        """目前存放此案子紀錄的檔案；沒有紀錄時回傳 None。供其他程序直接讀檔（如整批備份）"""
+        path = self._get_path_for_project(project_id)
+        return path if os.path.exists(path) else None
+
+    def iter_project_items(self, project_id, errors=None):
+        """逐一產生案子的貨號群組，解析完一筆就交出一筆，供畫面邊載入邊顯示
+
+        損毀或格式不符的紀錄略過並加進 errors，不影響其他紀錄；
+        檔案為舊版 {案子鍵: 貨號清單} 格式時只取鍵為此案子 ID 的紀錄。
+        """
         path = self._get_path_for_project(project_id)
+        self._stamps[project_id] = file_stamp(path)
+        yield from self._iter_json(path, project_id, errors)
+
+    def _iter_json(self, path, project_id, errors):
         if not os.path.exists(path):
-            return []
-        with open(path, 'r', encoding='utf-8') as f:
-            try:
-                project_data = json.load(f)
-            except json.JSONDecodeError:
-                return []
-        
-        loaded_groups = []
-        for group_data in project_data:
-            sewing_data = group_data.get('sewing_item')
-            if not sewing_data: continue
-            
-            sewing_item = SewingItem(**sewing_data)
-            
-            sub_items = []
-            for sub_data in group_data.get('sub_items', []):
-                # Handle old data that might not have an id
-                if 'id' not in sub_data:
-                    sub_data['id'] = f"sub-{uuid.uuid4().hex[:6]}"
-                sub_items.append(SubItem(**sub_data))
-
-            loaded_groups.append(ItemGroup(
-                item_number=group_data['item_number'],
-                sewing_item=sewing_item,
-                sub_items=sub_items
-            ))
-        return loaded_groups
-
-    def save_project_items(self, project_id, records):
+            return
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            for record in iter_history(f):
+                if record.key is not None and record.key != project_id:
+                    continue
+                if record.error is not None:
+                    if errors is not None:
+                        errors.append(record.error)
+                else:
+                    yield record.group
+
+    def load_project_items(self, project_id):
+        errors = []
+        groups = list(self.iter_project_items(project_id, errors))
+        self.load_errors[project_id] = errors
+        return groups
+
+    def _check_conflict(self, project_id, path, force):
+        """呼叫端需持有檔案鎖；載入（或上次存檔）後檔案被其他程式改過時丟出 HistoryConflictError"""
+        if not force and project_id in self._stamps and file_stamp(path) != self._stamps[project_id]:
+            raise HistoryConflictError(project_id)
+
+    def save_project_items(self, project_id, records, force=False):
         path = self._get_path_for_project(project_id)
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(records, f, ensure_ascii=False, indent=2, cls=CustomEncoder)
+        with self._file_lock:
+            self._check_conflict(project_id, path, force)
+            atomic_write_json(path, records, cls=CustomEncoder)
+            self._stamps[project_id] = file_stamp(path)
+            if self.index is not None:
+                self.index.update(project_id, records, path)
+        if self.revisions is not None:
+            self.revisions.commit(project_id, records)
+
+    def is_stale(self, project_id):
+        """載入後檔案是否被其他程式修改或刪除"""
+        if project_id not in self._stamps:
+            return False
+        return file_stamp(self._get_path_for_project(project_id)) != self._stamps[project_id]
 
     def delete_project_file(self, project_id):
         """根據案子 ID 刪除對應的歷史紀錄檔案"""
         path = self._get_path_for_project(project_id)
-        if os.path.exists(path):
-            try:
-                os.remove(path)
-            except OSError as e:
-                print(f"Error deleting file {path}: {e}")
+        with self._file_lock:
+            self._stamps.pop(project_id, None)
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Error deleting file {path}: {e}")
+        if self.index is not None:
+            self.index.remove(project_id)
+        if self.revisions is not None:
+            self.revisions.delete(project_id)
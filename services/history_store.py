@@ -0,0 +1,315 @@
+# services/history_store.py
+
+import glob
+import json
+import os
+from dataclasses import asdict
+from datetime import datetime
+from services.pricing import ItemGroup, SewingItem, SubItem
+from services.money import Money
+from services.history_manager import CustomEncoder, HistoryConflictError
+from services.history_loader import HistoryRecordError, iter_history, upgrade_record
+from services.history_binary import BINARY_EXTENSION, read_binary
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history_projects (
+    project_id TEXT PRIMARY KEY,
+    group_count INTEGER NOT NULL,
+    sub_count INTEGER NOT NULL,
+    sewing_cents INTEGER NOT NULL,
+    sub_cents INTEGER NOT NULL,
+    revision INTEGER NOT NULL DEFAULT 1,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_projects_updated ON history_projects(updated_at);
+
+CREATE TABLE IF NOT EXISTS history_items (
+    project_id TEXT NOT NULL REFERENCES history_projects(project_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    item_number TEXT NOT NULL,
+    fabric TEXT NOT NULL,
+    type TEXT NOT NULL,
+    pieces REAL NOT NULL,
+    sewing_cents INTEGER NOT NULL,
+    sub_cents INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (project_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_history_items_fabric ON history_items(fabric, type);
+CREATE INDEX IF NOT EXISTS idx_history_items_number ON history_items(item_number);
+"""
+
+
+def _group_row(project_id, position, group):
+    s = group.sewing_item
+    sub_cents = sum(sub.subtotal.cents for sub in group.sub_items)
+    data = json.dumps(asdict(group), ensure_ascii=False, separators=(",", ":"), cls=CustomEncoder)
+    return (project_id, position, group.item_number, s.fabric, s.type, float(s.pieces),
+            s.subtotal.cents, sub_cents, data)
+
+
+def _group_from_json(text):
+    group_data = json.loads(text)
+    return ItemGroup(
+        item_number=group_data['item_number'],
+        sewing_item=SewingItem(**group_data['sewing_item']),
+        sub_items=[SubItem(**sub) for sub in group_data.get('sub_items', [])]
+    )
+
+
+def _in_clause(column, values):
+    """project_ids 限定條件；values 為 None 時不限定"""
+    if values is None:
+        return "", ()
+    values = list(values)
+    return f" WHERE {column} IN ({', '.join('?' * len(values))})", values
+
+
+class HistoryStore:
+    """所有案子的報價歷史集中存在同一個 SQLite 資料庫，介面與 HistoryManager 相同
+
+    每個貨號一列（history_items），布料、形式、幅數與金額另存成有索引的欄位；
+    每個案子在 history_projects 保留一列彙總（貨號數、金額、最後修改時間、修改次數）。
+    讀寫單一案子只碰該案子的列，列出案子與跨案子統計也只查彙總欄位，不解析其他案子的明細。
+    提供 revisions (QuoteRevisions) 時，每次存檔另外記錄一個報價版本。
+    存檔時比對載入時的修改次數，與 HistoryManager 一樣在衝突時丟出 HistoryConflictError。
+    """
+
+    def __init__(self, storage, revisions=None):
+        self.storage = storage
+        self.revisions = revisions
+        self._revisions = {}
+        with storage.transaction() as conn:
+            conn.executescript(HISTORY_SCHEMA)
+        self._import_history_groups()
+
+    def _import_history_groups(self):
+        """舊版 SQLite 後端的 history_groups 表（每列一個 JSON）轉入新表後刪除"""
+        exists = self.storage.query_one(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_groups'")
+        if not exists:
+            return
+        projects = {}
+        for row in self.storage.query("SELECT project_id, data FROM history_groups ORDER BY project_id, position"):
+            try:
+                group, _ = upgrade_record(json.loads(row["data"]))
+            except (json.JSONDecodeError, HistoryRecordError) as e:
+                print(f"Error importing history of project {row['project_id']}: {e}")
+                continue
+            projects.setdefault(row["project_id"], []).append(group)
+        with self.storage.transaction() as conn:
+            for project_id, groups in projects.items():
+                if not conn.execute("SELECT 1 FROM history_projects WHERE project_id = ?", (project_id,)).fetchone():
+                    self._write(conn, project_id, groups)
+            conn.execute("DROP TABLE history_groups")
+
+    # ── HistoryManager 介面 ───────────────────────────────
+
+    def _revision(self, project_id):
+        row = self.storage.query_one("SELECT revision FROM history_projects WHERE project_id = ?", (project_id,))
+        return row["revision"] if row else None
+
+    def load_project_items(self, project_id):
+        with self.storage.transaction() as conn:
+            row = conn.execute("SELECT revision FROM history_projects WHERE project_id = ?",
+                               (project_id,)).fetchone()
+            rows = conn.execute("SELECT data FROM history_items WHERE project_id = ? ORDER BY position",
+                                (project_id,)).fetchall()
+        self._revisions[project_id] = (self.storage.data_version(), row["revision"] if row else None)
+        return [_group_from_json(r["data"]) for r in rows]
+
+    def iter_project_items(self, project_id, errors=None):
+        """與 HistoryManager.iter_project_items 相同的介面；資料庫中的紀錄寫入前已驗證過"""
+        yield from self.load_project_items(project_id)
+
+    def _write(self, conn, project_id, records):
+        groups = list(records)
+        rows = [_group_row(project_id, pos, group) for pos, group in enumerate(groups)]
+        conn.execute("DELETE FROM history_items WHERE project_id = ?", (project_id,))
+        conn.execute(
+            "INSERT INTO history_projects (project_id, group_count, sub_count, sewing_cents, sub_cents, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(project_id) DO UPDATE SET group_count = excluded.group_count, "
+            "sub_count = excluded.sub_count, sewing_cents = excluded.sewing_cents, "
+            "sub_cents = excluded.sub_cents, updated_at = excluded.updated_at, revision = revision + 1",
+            (project_id, len(groups), sum(len(g.sub_items) for g in groups),
+             sum(r[6] for r in rows), sum(r[7] for r in rows), datetime.now().isoformat(timespec="seconds")))
+        conn.executemany("INSERT INTO history_items (project_id, position, item_number, fabric, type, pieces, "
+                         "sewing_cents, sub_cents, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return conn.execute("SELECT revision FROM history_projects WHERE project_id = ?",
+                            (project_id,)).fetchone()[0]
+
+    def save_project_items(self, project_id, records, force=False):
+        """寫入案子；載入後已被其他程式修改時丟出 HistoryConflictError（force=True 時照樣寫入）"""
+        with self.storage.transaction() as conn:
+            revision = self._write(conn, project_id, records)
+            # 寫入後修改次數應比載入時多 1；不是的話中間有別人寫過，丟出例外讓交易回滾
+            if not force and project_id in self._revisions:
+                loaded = self._revisions[project_id][1] or 0
+                if revision != loaded + 1:
+                    raise HistoryConflictError(project_id)
+        self._revisions[project_id] = (self.storage.data_version(), revision)
+        if self.revisions is not None:
+            self.revisions.commit(project_id, records)
+
+    def save_many(self, projects):
+        """在同一個交易中寫入多個案子；projects 為 {案子 ID: 貨號群組清單}"""
+        with self.storage.transaction() as conn:
+            for project_id, records in projects.items():
+                self._write(conn, project_id, records)
+
+    def is_stale(self, project_id):
+        """載入後其他程式是否修改或刪除了這個案子
+
+        先比對資料庫的 data_version，沒有任何外部寫入時不必查詢；
+        有外部寫入時再比對該案子的修改次數，其他案子的異動不算。
+        """
+        if project_id not in self._revisions:
+            return False
+        version, revision = self._revisions[project_id]
+        current = self.storage.data_version()
+        if current == version:
+            return False
+        if self._revision(project_id) != revision:
+            return True
+        self._revisions[project_id] = (current, revision)
+        return False
+
+    def delete_project_file(self, project_id):
+        """刪除案子的報價紀錄"""
+        with self.storage.transaction() as conn:
+            conn.execute("DELETE FROM history_items WHERE project_id = ?", (project_id,))
+            conn.execute("DELETE FROM history_projects WHERE project_id = ?", (project_id,))
+        self._revisions.pop(project_id, None)
+        if self.revisions is not None:
+            self.revisions.delete(project_id)
+
+    # ── 查詢與統計 ────────────────────────────────────────
+
+    @staticmethod
+    def _summary(row):
+        return {
+            "project_id": row["project_id"],
+            "group_count": row["group_count"],
+            "sub_count": row["sub_count"],
+            "total": Money(row["sewing_cents"] + row["sub_cents"]),
+            "updated_at": row["updated_at"],
+        }
+
+    def has_project(self, project_id):
+        return self._revision(project_id) is not None
+
+    def project_summary(self, project_id):
+        """單一案子的彙總；沒有紀錄時回傳 None"""
+        row = self.storage.query_one("SELECT * FROM history_projects WHERE project_id = ?", (project_id,))
+        return self._summary(row) if row else None
+
+    def list_projects(self, limit=None):
+        """有報價紀錄的案子彙總，最近修改的在前"""
+        sql = "SELECT * FROM history_projects ORDER BY updated_at DESC, project_id"
+        params = ()
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = (limit,)
+        return [self._summary(row) for row in self.storage.query(sql, params)]
+
+    def grand_total(self, project_ids=None):
+        """多個案子（預設全部）的金額合計"""
+        where, params = _in_clause("project_id", project_ids)
+        row = self.storage.query_one(
+            f"SELECT COALESCE(SUM(sewing_cents + sub_cents), 0) FROM history_projects{where}", params)
+        return Money(row[0])
+
+    def totals_by_fabric(self, project_ids=None):
+        """依 (布料, 形式) 統計貨號數、幅數、車工小計與出現在幾個案子"""
+        where, params = _in_clause("project_id", project_ids)
+        rows = self.storage.query(
+            "SELECT fabric, type, COUNT(*) AS groups, SUM(pieces) AS pieces, SUM(sewing_cents) AS cents, "
+            f"COUNT(DISTINCT project_id) AS projects FROM history_items{where} "
+            "GROUP BY fabric, type ORDER BY cents DESC", params)
+        return [{"fabric": r["fabric"], "type": r["type"], "groups": r["groups"], "pieces": r["pieces"],
+                 "subtotal": Money(r["cents"]), "projects": r["projects"]} for r in rows]
+
+    def projects_using(self, fabric, type=None):
+        """用到某布料（與形式）的案子 ID"""
+        sql = "SELECT DISTINCT project_id FROM history_items WHERE fabric = ?"
+        params = [fabric]
+        if type is not None:
+            sql += " AND type = ?"
+            params.append(type)
+        return [row["project_id"] for row in self.storage.query(sql, params)]
+
+    def find_item_number(self, item_number):
+        """貨號出現在哪些案子，回傳 [(案子 ID, 第幾個貨號)]"""
+        rows = self.storage.query(
+            "SELECT project_id, position FROM history_items WHERE item_number = ? ORDER BY project_id, position",
+            (item_number,))
+        return [(row["project_id"], row["position"]) for row in rows]
+
+
+def _project_names(customers):
+    """{客戶 ID: {案名: 案子 ID}}，用來解讀舊版以案名為鍵的紀錄"""
+    return {cust["id"]: {p["name"]: p["id"] for p in cust.get("projects", [])} for cust in customers}
+
+
+def migrate_history_files(data_dir, store, customers=(), overwrite=False):
+    """把 data_dir 下的 history_<id>.json 與 .cqh 全部匯入 HistoryStore；回傳 (統計, 略過清單)
+
+    檔案內容為清單時即為該案子的貨號群組。舊版的檔案是 {鍵: 貨號群組清單}，
+    檔名為客戶 ID，鍵可能是案子 ID、該客戶的案名或 default_project：
+    能對應到案子的併入該案子，對應不到的以「檔名 ID/鍵」保留。
+    同一案子同時有獨立檔案與舊版紀錄時以獨立檔案為準。原始檔案不會刪除；
+    單筆無法讀取的紀錄列入略過清單，同一檔案的其他紀錄照常匯入。
+    store 中已有的案子預設保留（原始檔案可能比資料庫中的紀錄舊），overwrite 時改以檔案內容取代。
+    """
+    names = _project_names(customers)
+    project_ids = {pid for projects in names.values() for pid in projects.values()}
+    standalone, legacy, skipped = {}, {}, []
+    for path in sorted(glob.glob(os.path.join(data_dir, "history_*.json"))):
+        file_id = os.path.basename(path)[len("history_"):-len(".json")]
+        keyed = False
+        try:
+            with open(path, 'r', encoding='utf-8-sig') as f:
+                for record in iter_history(f):
+                    keyed = keyed or record.key is not None
+                    if record.key is None:
+                        target = standalone.setdefault(file_id, [])
+                    else:
+                        target = legacy.setdefault((path, file_id, record.key), [])
+                    if record.error is not None:
+                        skipped.append((path, str(record.error)))
+                    else:
+                        target.append(record.group)
+        except (OSError, UnicodeDecodeError) as e:
+            skipped.append((path, str(e)))
+            continue
+        if not keyed:
+            standalone.setdefault(file_id, [])   # 空清單也是一個（沒有貨號的）案子
+    for path in sorted(glob.glob(os.path.join(data_dir, f"history_*{BINARY_EXTENSION}"))):
+        file_id = os.path.basename(path)[len("history_"):-len(BINARY_EXTENSION)]
+        try:
+            standalone[file_id] = read_binary(path)   # 二進位檔比同名的 JSON 檔新
+        except (OSError, ValueError) as e:
+            skipped.append((path, str(e)))
+
+    stats = {"projects": 0, "groups": 0, "legacy": 0, "orphans": 0, "kept": 0}
+    projects = dict(standalone)
+    for (path, file_id, key), groups in legacy.items():
+        project_id = key if key in project_ids else names.get(file_id, {}).get(key)
+        orphan = project_id is None
+        project_id = project_id or f"{file_id}/{key}"
+        if project_id in projects:
+            skipped.append((f"{path}[{key}]", f"案子 {project_id} 已有紀錄，以該紀錄為準"))
+            continue
+        projects[project_id] = groups
+        stats["legacy"] += 1
+        stats["orphans"] += orphan
+    if not overwrite:
+        for project_id in [pid for pid in projects if store.has_project(pid)]:
+            del projects[project_id]
+            stats["kept"] += 1
+    stats["groups"] = sum(len(groups) for groups in projects.values())
+
+    store.save_many(projects)
+    stats["projects"] = len(projects)
+    return stats, skipped
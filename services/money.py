@@ -0,0 +1,163 @@
+# services/money.py
+
+import re
+from decimal import Decimal, ROUND_HALF_UP
+from functools import total_ordering
+
+# 乘以非整數倍率時先把倍率限制在 6 位小數，避免 3.1 * 4.2 = 13.020000000000001 這類二進位誤差影響進位
+_FACTOR_SCALE = 10 ** 6
+_FORMAT_RE = re.compile(r"\.(\d+)[fF%]\Z")
+
+
+def to_cents(value) -> int:
+    """金額（元）換算為整數分，四捨五入"""
+    if type(value) is int:
+        return value * 100
+    if isinstance(value, Money):
+        return value.cents
+    return int((Decimal(str(value)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def mul_cents(cents: int, factor) -> int:
+    """整數分乘上數量或比例，結果四捨五入到分
+
+    倍率先換成 10^6 倍的整數，整個計算都是整數運算，不會有浮點誤差也不必經過 Decimal。
+    """
+    if type(factor) is int:
+        return cents * factor
+    product = cents * round(factor * _FACTOR_SCALE)
+    if product >= 0:
+        return (product + _FACTOR_SCALE // 2) // _FACTOR_SCALE
+    return -((-product + _FACTOR_SCALE // 2) // _FACTOR_SCALE)
+
+
+def round_cents(cents: int, unit: int = 100) -> int:
+    """四捨五入到 unit 分（預設為整數元），與手算相同：.5 一律進位（負數往遠離 0 的方向）"""
+    q, r = divmod(abs(cents), unit)
+    if r * 2 >= unit:
+        q += 1
+    return q * unit if cents >= 0 else -q * unit
+
+
+@total_ordering
+class Money:
+    """以整數「分」保存的金額
+
+    加減都是整數運算，不會累積浮點誤差；乘上數量或比例時四捨五入到分，
+    round() 以 .5 進位取整數元，和紙本計算一致（內建 round 是四捨六入五成雙）。
+    可與 int/float/Decimal 比較，一律以精確值比較（同 Decimal），相等的值雜湊也相同；
+    float 的二進位值不精確（0.1 實為 0.1000000000000000055…），需要以分為準時先用 Money.of 換算。
+    format(money, ',.0f') 也會以四捨五入顯示。
+    """
+
+    __slots__ = ("cents",)
+
+    def __init__(self, cents: int = 0):
+        self.cents = cents
+
+    @classmethod
+    def of(cls, value) -> "Money":
+        """由元（int、float、str、Decimal）或 Money 建立"""
+        if isinstance(value, Money):
+            return value
+        return cls(to_cents(value))
+
+    @staticmethod
+    def sum(values) -> "Money":
+        """加總多個 Money，只做整數加法"""
+        return Money(sum([v.cents for v in values]))
+
+    def round(self, unit: int = 100) -> "Money":
+        return Money(round_cents(self.cents, unit))
+
+    def to_decimal(self) -> Decimal:
+        return Decimal(self.cents).scaleb(-2)
+
+    def __float__(self):
+        return self.cents / 100
+
+    def __int__(self):
+        return int(self.to_decimal())
+
+    def __bool__(self):
+        return self.cents != 0
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __abs__(self):
+        return Money(abs(self.cents))
+
+    def __add__(self, other):
+        if isinstance(other, Money):
+            return Money(self.cents + other.cents)
+        if isinstance(other, (int, float, Decimal)):
+            return Money(self.cents + to_cents(other))
+        return NotImplemented
+
+    __radd__ = __add__   # 讓 sum(...) 的起始值 0 可以直接相加
+
+    def __sub__(self, other):
+        if isinstance(other, Money):
+            return Money(self.cents - other.cents)
+        if isinstance(other, (int, float, Decimal)):
+            return Money(self.cents - to_cents(other))
+        return NotImplemented
+
+    def __rsub__(self, other):
+        if isinstance(other, (int, float, Decimal)):
+            return Money(to_cents(other) - self.cents)
+        return NotImplemented
+
+    def __mul__(self, factor):
+        if isinstance(factor, Money):
+            return NotImplemented
+        if isinstance(factor, Decimal):
+            return Money(int((self.cents * factor).quantize(Decimal(1), rounding=ROUND_HALF_UP)))
+        if isinstance(factor, (int, float)):
+            return Money(mul_cents(self.cents, factor))
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    @staticmethod
+    def _comparable(other):
+        # 與 Decimal 相同，和 float 比較時以 float 的精確值比較（不四捨五入，等值關係才有遞移性）
+        if isinstance(other, Money):
+            return other.to_decimal()
+        if isinstance(other, (int, float, Decimal)):
+            return Decimal(other)
+        return None
+
+    def __eq__(self, other):
+        if isinstance(other, Money):
+            return self.cents == other.cents
+        value = self._comparable(other)
+        return NotImplemented if value is None else self.to_decimal() == value
+
+    def __lt__(self, other):
+        if isinstance(other, Money):
+            return self.cents < other.cents
+        value = self._comparable(other)
+        return NotImplemented if value is None else self.to_decimal() < value
+
+    def __hash__(self):
+        # 比較與雜湊都用精確值，與等值的 int/float/Decimal 雜湊相同
+        return hash(self.to_decimal())
+
+    def __format__(self, spec):
+        value = self.to_decimal()
+        match = _FORMAT_RE.search(spec)
+        if match:
+            digits = int(match.group(1)) + (2 if spec.endswith('%') else 0)
+            value = value.quantize(Decimal(1).scaleb(-digits), rounding=ROUND_HALF_UP)
+        return format(value, spec)
+
+    def __str__(self):
+        return str(self.to_decimal())
+
+    def __repr__(self):
+        return f"Money('{self.to_decimal()}')"
+
+    def __reduce__(self):
+        return (Money, (self.cents,))
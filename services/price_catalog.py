@@ -0,0 +1,163 @@
+# services/price_catalog.py
+
+import bisect
+import json
+import os
+import threading
+from datetime import date, datetime
+from services.file_lock import FileLock, file_stamp
+
+
+class CatalogSnapshot:
+    """某一版車工單價表的唯讀檢視
+
+    不複製任何單價：查價時到各 (布料, 形式) 的異動歷史中找出不晚於此版本的最後一筆。
+    每個鍵的異動通常只有幾筆，查價幾乎是常數時間。
+    介面與 SewingPriceManager.get_price 相同，可直接交給 PricingEngine 使用。
+    """
+
+    def __init__(self, catalog, version):
+        self.catalog = catalog
+        self.version = version
+
+    def get_price(self, fabric, type):
+        """此版本的單價；沒有設定時回傳 None"""
+        history = self.catalog._history.get((fabric, type))
+        if not history:
+            return None
+        i = bisect.bisect_right(history[0], self.version) - 1
+        return history[1][i] if i >= 0 else None
+
+    def items(self):
+        """列出此版本全部的 ((布料, 形式), 單價)"""
+        for key in self.catalog._history:
+            price = self.get_price(*key)
+            if price is not None:
+                yield key, price
+
+    def __repr__(self):
+        return f"CatalogSnapshot(version={self.version})"
+
+
+class PriceCatalog:
+    """有版本與生效日期的車工單價表，存為 data/price_catalog.jsonl
+
+    每一行是一個版本，只記錄與前一版的差異（新增或改價、移除），
+    已發布的版本不會再被修改。quote 中的 SewingItem.catalog_version 記錄報價時使用的版本，
+    之後可用 snapshot(version) 或 snapshot_at(日期) 對舊報價重新計價。
+    """
+
+    def __init__(self, data_path="data/price_catalog.jsonl"):
+        self.data_path = data_path
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(data_path + ".lock")
+        dir_name = os.path.dirname(data_path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        self.load()
+
+    def load(self):
+        """讀取全部版本並建立每個鍵的異動歷史"""
+        with self._lock, self._file_lock:
+            self.versions = []     # 依版本號排序的版本資訊（不含差異內容）
+            self._history = {}     # (布料, 形式) -> ([版本號...], [單價或 None...])
+            self._latest = {}      # 最新版本的完整單價，用來計算下一版的差異
+            self._stamp = file_stamp(self.data_path)
+            if not os.path.exists(self.data_path):
+                return
+            with open(self.data_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # 寫到一半的版本不算數
+                    self._add_version(json.loads(line))
+
+    def refresh(self):
+        """其他程式發布過新版本時重新讀取；回傳是否有變更"""
+        if file_stamp(self.data_path) == self._stamp:
+            return False
+        self.load()
+        return True
+
+    def _add_version(self, entry):
+        version = entry["version"]
+        for fabric, type, price in entry.get("set", []):
+            self._record(version, (fabric, type), float(price))
+        for fabric, type in entry.get("remove", []):
+            self._record(version, (fabric, type), None)
+        self.versions.append({k: entry[k] for k in ("version", "effective_date", "created_at", "note") if k in entry})
+
+    def _record(self, version, key, price):
+        versions, prices = self._history.setdefault(key, ([], []))
+        versions.append(version)
+        prices.append(price)
+        if price is None:
+            self._latest.pop(key, None)
+        else:
+            self._latest[key] = price
+
+    @property
+    def current_version(self):
+        """最新版本號；尚未發布任何版本時為 None"""
+        return self.versions[-1]["version"] if self.versions else None
+
+    def publish(self, records, effective_date=None, note=""):
+        """以目前的單價清單發布新版本；與最新版相同時不建立版本，回傳目前版本號
+
+        records 為 SewingPriceManager.get_all() 格式的紀錄清單，
+        effective_date 為 'YYYY-MM-DD'，預設為今天。
+        """
+        prices = {}
+        for r in records:
+            prices.setdefault((r["fabric"], r["type"]), float(r["unit_price"]))
+        with self._lock, self._file_lock:
+            self.refresh()
+            changed = [[f, t, p] for (f, t), p in prices.items() if self._latest.get((f, t)) != p]
+            removed = [[f, t] for (f, t) in self._latest if (f, t) not in prices]
+            if not changed and not removed:
+                return self.current_version
+            entry = {
+                "version": (self.current_version or 0) + 1,
+                "effective_date": effective_date or date.today().isoformat(),
+                "created_at": datetime.now().isoformat(timespec='seconds'),
+                "note": note,
+                "set": changed,
+                "remove": removed,
+            }
+            self._drop_partial_line()
+            with open(self.data_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._add_version(entry)
+            self._stamp = file_stamp(self.data_path)
+            return entry["version"]
+
+    def _drop_partial_line(self):
+        """截掉當機留下的不完整尾行，新版本才不會接在殘行後面；呼叫端需持有檔案鎖"""
+        if not os.path.exists(self.data_path):
+            return
+        with open(self.data_path, 'rb+') as f:
+            end = pos = f.seek(0, os.SEEK_END)
+            while pos > 0:
+                start = max(0, pos - 4096)
+                f.seek(start)
+                i = f.read(pos - start).rfind(b"\n")
+                if i >= 0:
+                    pos = start + i + 1
+                    break
+                pos = start
+            if pos < end:
+                f.truncate(pos)
+
+    def snapshot(self, version=None):
+        """指定版本（預設最新版）的唯讀檢視"""
+        if version is None:
+            version = self.current_version or 0
+        return CatalogSnapshot(self, version)
+
+    def snapshot_at(self, when):
+        """在某日期（'YYYY-MM-DD' 或 date）生效中的版本：生效日不晚於該日的版本中最新發布者"""
+        if isinstance(when, date):
+            when = when.isoformat()
+        effective = [v["version"] for v in self.versions if v["effective_date"] <= when]
+        return CatalogSnapshot(self, effective[-1] if effective else 0)
@@ -1,59 +1,446 @@
-from dataclasses import dataclass, field
-from typing import List, Any, Dict
+from dataclasses import dataclass, field, replace
+from typing import List, Any, Dict, Optional, Sequence, ClassVar
+import sys
 import uuid
 from services.sewing_price_manager import SewingPriceManager
+from services.pricing_rules import PricingRules, QuoteTotals
+from services.money import Money, to_cents, mul_cents, round_cents
 
-@dataclass
+try:
+    import numpy as np
+except ImportError:  # numpy 為選用套件，沒有安裝時以純 Python 計算
+    np = None
+
+# 明細項目數量可能上萬，Python 3.10 起改用 __slots__ 省去每個物件的 __dict__
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+class PriceNotFoundError(ValueError):
+    """車工單價表中沒有這個布料與形式的組合"""
+
+    def __init__(self, fabric: str, type: str):
+        super().__init__(f"找不到布料 '{fabric}' 搭配形式 '{type}' 的車工單價")
+        self.fabric = fabric
+        self.type = type
+
+@dataclass(**_SLOTS)
 class SewingItem:
-    """車工項目"""
+    """車工項目；金額欄位為 Money，傳入 int/float 會自動換算"""
     fabric: str
     type: str
     width: float
     height: float
     pieces: float
-    unit_price: float
-    subtotal: float
+    unit_price: Money
+    subtotal: Money
+    catalog_version: Optional[int] = None  # 計價時使用的單價表版本
+    unit: str = "幅"                        # 計價單位（幅／尺／才…）
+    quantity: Optional[float] = None         # 依單位換算並套用最低數量後的計價數量
 
-@dataclass
+    def __post_init__(self):
+        self.unit_price = Money.of(self.unit_price)
+        self.subtotal = Money.of(self.subtotal)
+
+@dataclass(**_SLOTS)
 class SubItem:
-    """附加項目或備註"""
+    """附加項目或備註；金額欄位為 Money，傳入 int/float 會自動換算"""
     description: str
     id: str = field(default_factory=lambda: f"sub-{uuid.uuid4().hex[:6]}")
     quantity: float = 1
-    unit_price: float = 0
-    subtotal: float = 0
+    unit_price: Money = 0
+    subtotal: Money = 0
+
+    def __post_init__(self):
+        self.unit_price = Money.of(self.unit_price)
+        self.subtotal = Money.of(self.subtotal)
+
+def _check_total(what, cached, expected):
+    if cached != expected:
+        raise AssertionError(f"{what} 累計值 {cached} 與重新計算的 {expected} 不符")
+
 
 @dataclass
 class ItemGroup:
-    """代表一個貨號的群組"""
+    """代表一個貨號的群組
+
+    合計金額以累計值保存：透過 add_sub_item／remove_sub_item／update_sub_item
+    或重新指定 sewing_item 時只以差額更新，不必重加全部子項目。
+    直接修改 sub_items 清單或項目內容後須呼叫 invalidate() 重新計算。
+    CHECK_INVARIANTS 為 True 時每次讀取合計都會與重新計算的結果比對（測試用）。
+    """
     item_number: str
     sewing_item: SewingItem
     sub_items: List[SubItem] = field(default_factory=list)
 
+    CHECK_INVARIANTS: ClassVar[bool] = False
+
+    def __post_init__(self):
+        self._listener = None   # 所屬 Quote 的通知函式，參數為合計的差額
+        self._total = self._compute_total()
+
+    def __setattr__(self, name, value):
+        tracked = name in ("sewing_item", "sub_items") and "_total" in self.__dict__
+        old = self.__dict__.get(name)
+        object.__setattr__(self, name, value)
+        if not tracked:
+            return
+        if name == "sewing_item":
+            self._shift(value.subtotal - old.subtotal)
+        else:
+            self.invalidate()
+
+    def _compute_total(self) -> Money:
+        return Money(self.sewing_item.subtotal.cents + sum([item.subtotal.cents for item in self.sub_items]))
+
+    def _shift(self, delta):
+        if delta:
+            self._total += delta
+            if self._listener:
+                self._listener(delta)
+
+    @property
+    def total(self) -> Money:
+        """整個貨號群組的總金額"""
+        if self.CHECK_INVARIANTS:
+            self.check_invariants()
+        return self._total
+
+    def invalidate(self):
+        """重新計算合計，並把差額通知所屬報價"""
+        self._shift(self._compute_total() - self._total)
+
+    def check_invariants(self):
+        _check_total(f"貨號 {self.item_number}", self._total, self._compute_total())
+
+    def add_sub_item(self, sub_item: SubItem):
+        self.sub_items.append(sub_item)
+        self._shift(sub_item.subtotal)
+
+    def remove_sub_item(self, sub_id: str) -> Optional[SubItem]:
+        """移除子項目；找不到時回傳 None"""
+        for i, sub_item in enumerate(self.sub_items):
+            if sub_item.id == sub_id:
+                del self.sub_items[i]
+                self._shift(-sub_item.subtotal)
+                return sub_item
+        return None
+
+    def update_sub_item(self, sub_id: str, **changes) -> SubItem:
+        """修改子項目；改了數量或單價而未指定小計時自動重算小計"""
+        for i, sub_item in enumerate(self.sub_items):
+            if sub_item.id == sub_id:
+                break
+        else:
+            raise KeyError(sub_id)
+        if "subtotal" not in changes and ("quantity" in changes or "unit_price" in changes):
+            unit_price = Money.of(changes.get("unit_price", sub_item.unit_price))
+            changes["subtotal"] = unit_price * changes.get("quantity", sub_item.quantity)
+        updated = replace(sub_item, **changes)
+        self.sub_items[i] = updated
+        self._shift(updated.subtotal - sub_item.subtotal)
+        return updated
+
+
+class Quote:
+    """一份報價的全部貨號，依加入順序排列並以貨號索引
+
+    維護所有貨號合計的累計小計；折扣、稅額與總計由 rules 依小計算出並快取，
+    貨號內容變動時由 ItemGroup 以差額通知，更新為 O(1)。
+    """
+
+    CHECK_INVARIANTS: ClassVar[bool] = False
+
+    def __init__(self, groups=(), rules=None):
+        self.rules = rules
+        self._groups = {}       # item_number -> ItemGroup
+        self._subtotal = Money(0)
+        self._totals = None
+        for group in groups:
+            self.add_group(group)
+
+    def __iter__(self):
+        return iter(self._groups.values())
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __contains__(self, item_number):
+        return item_number in self._groups
+
+    def get(self, item_number) -> Optional[ItemGroup]:
+        return self._groups.get(item_number)
+
+    def _on_group_change(self, delta):
+        self._subtotal += delta
+        self._totals = None
+        if self.CHECK_INVARIANTS:
+            self.check_invariants()
+
+    def add_group(self, group: ItemGroup):
+        if group.item_number in self._groups:
+            raise ValueError(f"貨號重複: {group.item_number}")
+        if group._listener is not None:
+            raise ValueError(f"貨號 {group.item_number} 已屬於其他報價")
+        self._groups[group.item_number] = group
+        group._listener = self._on_group_change
+        self._on_group_change(group.total)
+
+    def remove_group(self, item_number) -> Optional[ItemGroup]:
+        group = self._groups.pop(item_number, None)
+        if group is not None:
+            group._listener = None
+            self._on_group_change(-group.total)
+        return group
+
+    def clear(self):
+        for group in self._groups.values():
+            group._listener = None
+        self._groups.clear()
+        self._subtotal = Money(0)
+        self._totals = None
+
+    @property
+    def subtotal(self) -> Money:
+        if self.CHECK_INVARIANTS:
+            self.check_invariants()
+        return self._subtotal
+
+    @property
+    def totals(self) -> QuoteTotals:
+        """小計、折扣、稅額與總計；小計沒變時直接回傳快取"""
+        if self._totals is None:
+            if self.rules is None:
+                self._totals = QuoteTotals(self._subtotal, Money(0), Money(0), self._subtotal)
+            else:
+                self._totals = self.rules.totals(self._subtotal)
+        return self._totals
+
+    def check_invariants(self):
+        """逐一重算各貨號與整份報價的合計，與累計值不符時丟出 AssertionError"""
+        for group in self._groups.values():
+            group.check_invariants()
+        _check_total("報價小計", self._subtotal, Money.sum(group._total for group in self._groups.values()))
+
+@dataclass
+class BatchPriceResult:
+    """批次計價結果，各欄位與輸入逐列對應；查無單價的列其單價與小計為 None
+
+    金額以整數分保存在 unit_price_cents／subtotal_cents，加總只做整數運算。
+    """
+    unit_price_cents: List[Optional[int]]
+    quantities: List[float]
+    subtotal_cents: List[Optional[int]]
+    errors: Dict[int, PriceNotFoundError] = field(default_factory=dict)  # 列號 -> 錯誤
+    catalog_version: Optional[int] = None
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    @property
+    def unit_prices(self) -> List[Optional[Money]]:
+        return [None if c is None else Money(c) for c in self.unit_price_cents]
+
+    @property
+    def subtotals(self) -> List[Optional[Money]]:
+        return [None if c is None else Money(c) for c in self.subtotal_cents]
+
     @property
-    def total(self) -> float:
-        """計算整個貨號群組的總金額"""
-        return self.sewing_item.subtotal + sum(item.subtotal for item in self.sub_items)
+    def total(self) -> Money:
+        """可計價各列的小計合計"""
+        return Money(sum([c for c in self.subtotal_cents if c is not None]))
 
 class PricingEngine:
-    """計價引擎"""
+    """計價引擎
 
-    def __init__(self, config: Dict, sewing_price_manager: SewingPriceManager):
+    提供 catalog (PriceCatalog) 時，新建立的車工項目會記下目前的單價表版本；
+    傳入 snapshot (CatalogSnapshot) 則以該版本的單價計價。
+    rules 為編譯好的計價規則 (CompiledPricing)，決定計價單位、最低數量、加價、折扣與稅率；
+    未提供時只套用 config 的稅率，車工仍以幅數計價。
+    cache (PricingCache) 記住相同單價版本與規格的計價結果，重複試算時不必重算。
+    """
+
+    def __init__(self, config: Dict, sewing_price_manager: SewingPriceManager, catalog=None, rules=None,
+                 cache=None):
         self.config = config
         self.sewing_price_manager = sewing_price_manager
+        self.catalog = catalog
+        self.rules = rules or PricingRules(tax_rate=config.get("tax_rate", 0)).compile()
+        self.cache = cache
+        self._cached_revision = None
 
-    def get_sewing_price(self, fabric: str, type: str) -> float:
+    def get_sewing_price(self, fabric: str, type: str, snapshot=None) -> Money:
         """獲取車工單價"""
-        price = self.sewing_price_manager.get_price(fabric, type)
+        source = snapshot if snapshot is not None else self.sewing_price_manager
+        price = source.get_price(fabric, type)
+        if price is None:
+            price = self.rules.rule_price(fabric, type)
         if price is None:
-            raise ValueError(f"找不到布料 '{fabric}' 搭配形式 '{type}' 的車工單價")
-        return price
+            raise PriceNotFoundError(fabric, type)
+        return Money.of(price)
+
+    # 列數達到此值且已安裝 numpy 時才改用 numpy，少量資料轉成陣列反而較慢
+    NUMPY_MIN_ROWS = 256
+
+    def price_batch(self, fabrics: Sequence[str], types: Sequence[str], widths: Sequence[float],
+                    heights: Sequence[float], pieces: Sequence[float],
+                    snapshot=None, use_numpy: Optional[bool] = None) -> BatchPriceResult:
+        """以欄位形式一次計算多列的單價與小計
+
+        相同的 (布料, 形式) 只查一次單價；查不到的列記在 errors，不影響其他列。
+        計價數量與加價由 self.rules 決定；金額全程以整數分計算，小計四捨五入到元。
+        use_numpy 為 None 時依列數與是否安裝 numpy 自動決定，兩種算法結果相同。
+        """
+        if not len(fabrics) == len(types) == len(widths) == len(heights) == len(pieces):
+            raise ValueError("fabrics、types、widths、heights、pieces 的長度必須相同")
+        if self.cache is None:
+            price_cents, quantities, subtotal_cents = self._compute_batch(
+                fabrics, types, widths, heights, pieces, snapshot, use_numpy)
+        else:
+            price_cents, quantities, subtotal_cents = self._compute_cached(
+                fabrics, types, widths, heights, pieces, snapshot, use_numpy)
+        errors = {row: PriceNotFoundError(fabrics[row], types[row])
+                  for row, cents in enumerate(price_cents) if cents is None}
+
+        if snapshot is not None:
+            version = snapshot.version
+        else:
+            version = self.catalog.current_version if self.catalog else None
+        return BatchPriceResult(price_cents, quantities, subtotal_cents, errors, version)
+
+    def _cache_token(self, snapshot):
+        """快取鍵中的單價來源版本；即時單價表有異動時順便清掉舊版本的結果"""
+        if snapshot is not None:
+            return ("catalog", snapshot.version)
+        revision = self.sewing_price_manager.revision
+        if revision != self._cached_revision:
+            if self._cached_revision is not None:
+                self.cache.invalidate(lambda key: key[0][0] == "live")
+            self._cached_revision = revision
+        return ("live", revision)
+
+    def _compute_cached(self, fabrics, types, widths, heights, pieces, snapshot, use_numpy):
+        token = self._cache_token(snapshot)
+        keys = [(token, f, t, w, h, n) for f, t, w, h, n in zip(fabrics, types, widths, heights, pieces)]
+        unique = list(dict.fromkeys(keys))   # 同一批中重複的規格只查、只算一次
+        found = dict(zip(unique, self.cache.get_many(unique)))
+        missed = [key for key, value in found.items() if value is None]
+        if missed:
+            computed = self._compute_batch(*[list(column) for column in zip(*[key[1:] for key in missed])],
+                                           snapshot, use_numpy)
+            values = list(zip(*computed))
+            found.update(zip(missed, values))
+            self.cache.put_many(zip(missed, values))
+        results = [found[key] for key in keys]
+        if not results:
+            return [], [], []
+        return tuple(list(column) for column in zip(*results))
 
-    def create_sewing_item(self, fabric: str, type: str, width: float, height: float, pieces: float) -> SewingItem:
+    def _compute_batch(self, fabrics, types, widths, heights, pieces, snapshot, use_numpy):
+        """不經快取計算，回傳 (單價分, 計價數量, 小計分) 三個欄位"""
+        source = snapshot if snapshot is not None else self.sewing_price_manager
+        rules = self.rules
+        lookup = {}
+        price_cents = []
+        missing = []
+        for row, key in enumerate(zip(fabrics, types)):
+            if key in lookup:
+                cents = lookup[key]
+            else:
+                price = source.get_price(*key)
+                if price is None:
+                    price = rules.rule_price(*key)
+                cents = lookup[key] = None if price is None else to_cents(price)
+            if cents is None:
+                missing.append(row)
+            price_cents.append(cents)
+        quantities = rules.quantities(fabrics, types, widths, heights, pieces)
+
+        if use_numpy is None:
+            use_numpy = np is not None and len(price_cents) >= self.NUMPY_MIN_ROWS
+        if use_numpy:
+            subtotal_cents = self._subtotals_numpy(fabrics, types, widths, heights, pieces,
+                                                   price_cents, quantities, missing)
+        else:
+            bases = [None if c is None else mul_cents(c, q) for c, q in zip(price_cents, quantities)]
+            extra = rules.surcharges(fabrics, types, widths, heights, pieces, bases)
+            if extra is not None:
+                bases = [None if b is None else b + e for b, e in zip(bases, extra)]
+            subtotal_cents = [None if b is None else (b + 50) // 100 * 100 if b >= 0 else round_cents(b)
+                              for b in bases]
+        return price_cents, quantities, subtotal_cents
+
+    def _subtotals_numpy(self, fabrics, types, widths, heights, pieces, price_cents, quantities, missing):
+        """price_batch 的 numpy 版本：整數數量的列以 int64 一次相乘，其餘列逐列以 mul_cents 計算"""
+        if missing:
+            cents = np.array([0 if c is None else c for c in price_cents], dtype=np.int64)
+        else:
+            cents = np.array(price_cents, dtype=np.int64)
+        q = np.array(quantities, dtype=float)
+        integral = np.floor(q) == q
+        bases = cents * np.where(integral, q, 0).astype(np.int64)
+        for row in np.flatnonzero(~integral).tolist():
+            if price_cents[row] is not None:
+                bases[row] = mul_cents(price_cents[row], quantities[row])
+        if self.rules.has_surcharges:
+            base_list = bases.tolist()
+            for row in missing:
+                base_list[row] = None
+            extra = self.rules.surcharges(fabrics, types, widths, heights, pieces, base_list)
+            bases = bases + np.array([0 if e is None else e for e in extra], dtype=np.int64)
+        # 四捨五入到元，負數往遠離 0 的方向，與 round_cents 相同
+        magnitude = (np.abs(bases) + 50) // 100 * 100
+        totals = np.where(bases < 0, -magnitude, magnitude).tolist()
+        for row in missing:
+            totals[row] = None
+        return totals
+
+    def create_sewing_items(self, fabrics: Sequence[str], types: Sequence[str], widths: Sequence[float],
+                            heights: Sequence[float], pieces: Sequence[float],
+                            snapshot=None) -> tuple:
+        """批次建立車工項目；回傳 (項目清單, errors)，查無單價的列在清單中為 None"""
+        result = self.price_batch(fabrics, types, widths, heights, pieces, snapshot)
+        unit = self.rules.unit
+        items = [
+            None if unit_price is None else SewingItem(
+                fabric=f, type=t, width=w, height=h, pieces=n, unit_price=Money(unit_price),
+                subtotal=Money(subtotal), catalog_version=result.catalog_version,
+                unit=unit(f, t), quantity=quantity
+            )
+            for f, t, w, h, n, unit_price, quantity, subtotal
+            in zip(fabrics, types, widths, heights, pieces,
+                   result.unit_price_cents, result.quantities, result.subtotal_cents)
+        ]
+        return items, result.errors
+
+    def create_sewing_item(self, fabric: str, type: str, width: float, height: float, pieces: float,
+                           snapshot=None) -> SewingItem:
         """建立車工項目並計算價格"""
-        unit_price = self.get_sewing_price(fabric, type)
-        subtotal = pieces * unit_price
-        return SewingItem(
-            fabric=fabric, type=type, width=width, height=height,
-            pieces=pieces, unit_price=unit_price, subtotal=round(subtotal, 0)
+        items, errors = self.create_sewing_items([fabric], [type], [width], [height], [pieces], snapshot)
+        if errors:
+            raise errors[0]
+        return items[0]
+
+    def reprice_groups(self, groups: List[ItemGroup], snapshot) -> List[ItemGroup]:
+        """以指定版本的單價重新計算各貨號的車工，回傳新的群組清單，原資料不變
+
+        任一列查無單價時丟出第一個 PriceNotFoundError。
+        """
+        sewing = [g.sewing_item for g in groups]
+        items, errors = self.create_sewing_items(
+            [s.fabric for s in sewing], [s.type for s in sewing], [s.width for s in sewing],
+            [s.height for s in sewing], [s.pieces for s in sewing], snapshot
         )
+        if errors:
+            raise errors[min(errors)]
+        return [replace(group, sewing_item=item, sub_items=list(group.sub_items))
+                for group, item in zip(groups, items)]
+
+    def new_quote(self, groups=()) -> Quote:
+        """以本引擎的計價規則建立報價，總計會隨貨號變動自動更新"""
+        return Quote(groups, self.rules)
+
+    def quote_totals(self, groups) -> QuoteTotals:
+        """整份報價的小計、折扣、稅額與總計"""
+        if isinstance(groups, Quote):
+            return groups.totals if groups.rules is self.rules else self.rules.totals(groups.subtotal)
+        return self.rules.totals(Money.sum(group.total for group in groups))
@@ -0,0 +1,70 @@
+# services/pricing_cache.py
+
+import threading
+from collections import OrderedDict
+
+
+class PricingCache:
+    """車工計價結果的 LRU 快取
+
+    鍵為 (單價來源版本, 布料, 形式, 寬, 高, 幅數)，值為 (單價分, 計價數量, 小計分)。
+    單價來源版本是單價表快照的版本號，或 SewingPriceManager.revision；
+    單價有異動時版本改變，舊的結果不會再被查到，PricingEngine 也會順便清掉它們。
+    超過 maxsize 時淘汰最久沒用到的結果。
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, keys):
+        """逐一查詢，查不到的位置為 None；查到的結果移到最近使用"""
+        entries = self._entries
+        results = []
+        with self._lock:
+            for key in keys:
+                value = entries.get(key)
+                if value is None:
+                    self.misses += 1
+                else:
+                    entries.move_to_end(key)
+                    self.hits += 1
+                results.append(value)
+        return results
+
+    def put_many(self, items):
+        entries = self._entries
+        with self._lock:
+            for key, value in items:
+                entries[key] = value
+                entries.move_to_end(key)
+            overflow = len(entries) - self.maxsize
+            for _ in range(max(overflow, 0)):
+                entries.popitem(last=False)
+            self.evictions += max(overflow, 0)
+
+    def invalidate(self, predicate=None):
+        """移除符合條件的結果；predicate 為 None 時全部清除"""
+        with self._lock:
+            if predicate is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+    def stats(self):
+        """命中統計，供除錯與效能觀察"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
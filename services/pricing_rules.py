@@ -0,0 +1,199 @@
+# services/pricing_rules.py
+
+import bisect
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from services.atomic_io import load_json
+from services.money import Money, to_cents, mul_cents
+
+# 各計價單位「每一幅」的數量；寬、高皆以臺尺計
+UNITS = {
+    "幅": lambda w, h: 1.0,
+    "件": lambda w, h: 1.0,
+    "片": lambda w, h: 1.0,
+    "尺": lambda w, h: w,        # 依寬度計長度
+    "才": lambda w, h: w * h,    # 1 才 = 1 臺尺 × 1 臺尺
+}
+DEFAULT_UNIT = "幅"
+
+
+@dataclass
+class QuoteTotals:
+    """整份報價的金額彙總"""
+    subtotal: Money
+    discount: Money
+    tax: Money
+    total: Money
+
+
+def _compile_quantity(unit, min_quantity):
+    """把單位與最低數量組成單一函式 (寬, 高, 幅數) -> 計價數量"""
+    try:
+        per_piece = UNITS[unit]
+    except KeyError:
+        raise ValueError(f"不支援的計價單位: {unit}")
+    if min_quantity:
+        return lambda w, h, n: max(per_piece(w, h), min_quantity) * n
+    return lambda w, h, n: per_piece(w, h) * n
+
+
+def _compile_predicate(rule):
+    """只為規則有指定的條件產生檢查，沒有條件的規則永遠成立"""
+    checks = []
+    if rule.get("fabric") is not None:
+        fabric = rule["fabric"]
+        checks.append(lambda f, t, w, h: f == fabric)
+    if rule.get("type") is not None:
+        type_ = rule["type"]
+        checks.append(lambda f, t, w, h: t == type_)
+    if rule.get("min_width") is not None:
+        min_width = float(rule["min_width"])
+        checks.append(lambda f, t, w, h: w >= min_width)
+    if rule.get("min_height") is not None:
+        min_height = float(rule["min_height"])
+        checks.append(lambda f, t, w, h: h >= min_height)
+    if not checks:
+        return lambda f, t, w, h: True
+    if len(checks) == 1:
+        return checks[0]
+    return lambda f, t, w, h: all(check(f, t, w, h) for check in checks)
+
+
+def _compile_surcharge(rule):
+    """加價規則 -> 函式 (布料, 形式, 寬, 高, 幅數, 基本金額分) -> 加價金額（分）"""
+    matches = _compile_predicate(rule)
+    amount = to_cents(rule.get("amount", 0))   # 每幅固定加價
+    rate = float(rule.get("rate", 0))          # 依基本金額比例加價
+
+    def surcharge(f, t, w, h, n, base):
+        if not matches(f, t, w, h):
+            return 0
+        return mul_cents(amount, n) + mul_cents(base, rate)
+    return surcharge
+
+
+class PricingRules:
+    """宣告式計價規則
+
+    line_rules 為 {"fabric", "type", "unit", "unit_price", "min_quantity"} 的清單，
+    後出現的同一 (布料, 形式) 覆蓋前面的設定；unit_price 可省略，由車工單價表提供。
+    surcharges 為 {"name", 條件..., "amount" 或 "rate"}，條件可用 fabric、type、min_width、min_height。
+    volume_discounts 為 {"min_subtotal", "rate"}，整份報價小計達門檻時取最高一級的折扣。
+    """
+
+    def __init__(self, line_rules=(), surcharges=(), volume_discounts=(), tax_rate=0.0):
+        self.line_rules = list(line_rules)
+        self.surcharges = list(surcharges)
+        self.volume_discounts = list(volume_discounts)
+        self.tax_rate = float(tax_rate or 0)
+
+    def compile(self) -> "CompiledPricing":
+        """驗證規則並編譯成查表與函式，計價時不再解讀規則內容"""
+        lines = {}
+        for rule in self.line_rules:
+            unit = rule.get("unit") or DEFAULT_UNIT
+            min_quantity = float(rule.get("min_quantity") or 0)
+            unit_price = rule.get("unit_price")
+            lines[(rule["fabric"], rule["type"])] = (
+                _compile_quantity(unit, min_quantity),
+                unit,
+                None if unit_price is None else float(unit_price),
+            )
+        surcharges = tuple(_compile_surcharge(rule) for rule in self.surcharges)
+        # 門檻換成 Money：設定中的 999.99 以分為準比較，不受 float 二進位誤差影響
+        tiers = sorted((Money.of(d["min_subtotal"]), float(d["rate"])) for d in self.volume_discounts)
+        return CompiledPricing(lines, surcharges, tiers, self.tax_rate)
+
+
+class CompiledPricing:
+    """編譯後的計價規則；每一列只需一次字典查詢與預先組好的函式呼叫"""
+
+    _DEFAULT_QUANTITY = staticmethod(_compile_quantity(DEFAULT_UNIT, 0))
+
+    def __init__(self, lines, surcharges, tiers, tax_rate):
+        self._lines = lines
+        self._surcharges = surcharges
+        self._tier_thresholds = [threshold for threshold, _ in tiers]
+        self._tier_rates = [rate for _, rate in tiers]
+        self.tax_rate = tax_rate
+
+    def unit(self, fabric, type) -> str:
+        rule = self._lines.get((fabric, type))
+        return rule[1] if rule else DEFAULT_UNIT
+
+    def rule_price(self, fabric, type) -> Optional[float]:
+        """規則本身設定的單價；車工單價表沒有這個組合時使用"""
+        rule = self._lines.get((fabric, type))
+        return rule[2] if rule else None
+
+    def keys(self):
+        return self._lines.keys()
+
+    @property
+    def has_surcharges(self) -> bool:
+        return bool(self._surcharges)
+
+    def quantities(self, fabrics, types, widths, heights, pieces) -> List[float]:
+        """逐列計算計價數量（已套用最低數量）"""
+        lines = self._lines
+        default = self._DEFAULT_QUANTITY
+        result = []
+        for f, t, w, h, n in zip(fabrics, types, widths, heights, pieces):
+            rule = lines.get((f, t))
+            result.append((rule[0] if rule else default)(w, h, n))
+        return result
+
+    def surcharges(self, fabrics, types, widths, heights, pieces, bases) -> Optional[List[int]]:
+        """逐列計算加價（整數分）；bases 為各列基本金額（分），沒有任何加價規則時回傳 None"""
+        if not self._surcharges:
+            return None
+        rules = self._surcharges
+        return [
+            sum(rule(f, t, w, h, n, base) for rule in rules) if base is not None else None
+            for f, t, w, h, n, base in zip(fabrics, types, widths, heights, pieces, bases)
+        ]
+
+    def discount_rate(self, subtotal) -> float:
+        i = bisect.bisect_right(self._tier_thresholds, Money.of(subtotal)) - 1
+        return self._tier_rates[i] if i >= 0 else 0.0
+
+    def totals(self, subtotal) -> QuoteTotals:
+        """由各貨號合計算出折扣、稅額與總計，折扣與稅額四捨五入到元"""
+        subtotal = Money.of(subtotal)
+        discount = (subtotal * self.discount_rate(subtotal)).round()
+        taxable = subtotal - discount
+        tax = (taxable * self.tax_rate).round()
+        return QuoteTotals(subtotal=subtotal, discount=discount, tax=tax, total=taxable + tax)
+
+
+def load_pricing_rules(config: Dict, data_dir="data") -> PricingRules:
+    """組合各來源的計價規則，後者覆蓋前者
+
+    1. data/curtain_types.json（窗簾類型、材質、單價、才／尺）
+    2. config["price_table_path"] 價格表的「最低數量」等欄位
+    3. config["pricing_rules"] 直接寫在設定檔的規則
+    加價與折扣取自 config["surcharges"]、config["volume_discounts"]，稅率取自 config["tax_rate"]。
+    """
+    line_rules = []
+    for r in load_json(os.path.join(data_dir, "curtain_types.json"), default=[]) or []:
+        line_rules.append({
+            "fabric": r.get("material"), "type": r.get("curtain_type"),
+            "unit": r.get("unit"), "unit_price": r.get("unit_price"),
+        })
+
+    price_table_path = config.get("price_table_path")
+    if price_table_path and os.path.exists(price_table_path):
+        from services.excel_io import ExcelManager  # 有價格表時才需要 openpyxl
+        try:
+            line_rules.extend(ExcelManager(config).load_price_table(price_table_path))
+        except Exception as e:
+            print(f"Error loading price table {price_table_path}: {e}")
+
+    line_rules.extend(config.get("pricing_rules", []))
+    return PricingRules(
+        line_rules,
+        surcharges=config.get("surcharges", []),
+        volume_discounts=config.get("volume_discounts", []),
+        tax_rate=config.get("tax_rate", 0),
+    )
@@ -0,0 +1,378 @@
+# services/quote_revisions.py
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from services.file_lock import FileLock, file_stamp
+from services.history_loader import upgrade_record
+from services.money import Money
+
+# 比較紀錄時逐欄列出差異的車工欄位
+_SEWING_FIELDS = ("fabric", "type", "width", "height", "pieces", "unit_price", "subtotal", "unit", "quantity")
+
+
+def _record(group) -> dict:
+    """ItemGroup -> 與歷史檔 JSON 相同的紀錄（金額為以元計的 float），不經 asdict 與 JSON 來回轉換"""
+    s = group.sewing_item
+    return {
+        "item_number": group.item_number,
+        "sewing_item": {
+            "fabric": s.fabric, "type": s.type, "width": s.width, "height": s.height, "pieces": s.pieces,
+            "unit_price": float(s.unit_price), "subtotal": float(s.subtotal),
+            "catalog_version": s.catalog_version, "unit": s.unit, "quantity": s.quantity,
+        },
+        "sub_items": [
+            {"description": sub.description, "id": sub.id, "quantity": sub.quantity,
+             "unit_price": float(sub.unit_price), "subtotal": float(sub.subtotal)}
+            for sub in group.sub_items
+        ],
+    }
+
+
+def _records(groups) -> Dict[str, dict]:
+    """ItemGroup 清單 -> {貨號: 紀錄}，字典順序即貨號順序"""
+    return {group.item_number: _record(group) for group in groups}
+
+
+def _record_total(record) -> Money:
+    return Money.of(record["sewing_item"]["subtotal"]) + Money.sum(
+        Money.of(sub["subtotal"]) for sub in record.get("sub_items", []))
+
+
+def _apply(state, delta):
+    """套用差異：移除 remove 的貨號、set 的貨號原地更新或加到最後，有 order 時改為該順序"""
+    removed = set(delta.get("remove", ()))
+    result = {n: r for n, r in state.items() if n not in removed}
+    result.update(delta.get("set", {}))
+    order = delta.get("order")
+    if order is not None:
+        result = {n: result[n] for n in order}
+    return result
+
+
+def _make_delta(base, target):
+    delta = {}
+    changed = {n: r for n, r in target.items() if base.get(n) != r}
+    removed = [n for n in base if n not in target]
+    if changed:
+        delta["set"] = changed
+    if removed:
+        delta["remove"] = removed
+    if list(_apply(base, delta)) != list(target):
+        delta["order"] = list(target)
+    return delta
+
+
+def _skip_base(revision, interval):
+    """skip-delta 的基準版本：視窗內序號去掉最低位的 1；視窗第一版是完整快照，回傳 None
+
+    還原任一版本只需從快照起套用「序號中 1 的個數」筆差異，最多 log2(interval) 筆。
+    """
+    offset = (revision - 1) % interval
+    if offset == 0:
+        return None
+    return revision - offset + (offset & (offset - 1))
+
+
+@dataclass
+class RevisionInfo:
+    """一個報價版本的摘要（不含明細）"""
+    revision: int
+    created_at: str
+    note: str
+    group_count: int
+    total: Money
+    checkpoint: bool
+
+
+@dataclass
+class GroupChange:
+    """同一貨號在兩個版本間的差異；sewing 為有變動的車工欄位 -> (舊值, 新值)"""
+    item_number: str
+    total_before: Money
+    total_after: Money
+    sewing: Dict[str, Tuple] = field(default_factory=dict)
+    sub_added: List[dict] = field(default_factory=list)
+    sub_removed: List[dict] = field(default_factory=list)
+    sub_changed: List[Tuple[dict, dict]] = field(default_factory=list)
+
+    @property
+    def total_delta(self) -> Money:
+        return self.total_after - self.total_before
+
+
+@dataclass
+class QuoteDiff:
+    """兩個版本的比較：新增、刪除與變動的貨號，以及金額變化"""
+    from_revision: int
+    to_revision: int
+    added: List[str]
+    removed: List[str]
+    changed: List[GroupChange]
+    total_before: Money
+    total_after: Money
+    reordered: bool = False
+
+    @property
+    def total_delta(self) -> Money:
+        return self.total_after - self.total_before
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed or self.reordered)
+
+
+def _group_change(number, before, after) -> GroupChange:
+    change = GroupChange(number, _record_total(before), _record_total(after))
+    old, new = before["sewing_item"], after["sewing_item"]
+    for name in _SEWING_FIELDS:
+        if old.get(name) != new.get(name):
+            change.sewing[name] = (old.get(name), new.get(name))
+    old_subs = {sub["id"]: sub for sub in before.get("sub_items", [])}
+    new_subs = {sub["id"]: sub for sub in after.get("sub_items", [])}
+    change.sub_removed = [sub for sub_id, sub in old_subs.items() if sub_id not in new_subs]
+    change.sub_added = [sub for sub_id, sub in new_subs.items() if sub_id not in old_subs]
+    change.sub_changed = [(old_subs[sub_id], sub) for sub_id, sub in new_subs.items()
+                          if sub_id in old_subs and old_subs[sub_id] != sub]
+    return change
+
+
+class _ProjectLog:
+    """單一案子版本檔的索引：各版本在檔案中的位置與摘要
+
+    無法解析的行仍佔一個版本號，位置與摘要為 None，原因記在 errors。
+    """
+
+    def __init__(self):
+        self.stamp = None
+        self.end = 0
+        self.offsets = []
+        self.infos = []
+        self.errors = []   # [(版本號, 原因)]
+
+
+class QuoteRevisions:
+    """每個案子的報價版本紀錄，存為 data/revisions/<project_id>.jsonl
+
+    每次存檔新增一個版本（內容與上一版相同時不新增），一行一個版本。
+    每 checkpoint_interval 版存一次完整快照，其餘版本以 skip-delta 只記錄與基準版本的差異
+    （新增或修改的貨號、刪除的貨號、順序有變時的新順序），基準版本見 _skip_base。
+    還原時沿著各版本記錄的基準版本往回讀到最近的快照，最多 log2(checkpoint_interval) 行差異；
+    各版本在檔案中的位置記在記憶體索引中，其他程式追加版本時只讀新增的部分。
+    與 history_loader 相同，損毀的行只略過該版本並記在 errors()，其他版本照常可用；
+    依賴損毀版本的差異無法還原，之後存檔時若基準版本無法還原則改存完整快照。
+    """
+
+    CHECKPOINT_INTERVAL = 32
+    # 保留最近還原過的版本內容，連續存檔與相鄰版本比較時不必重算
+    STATE_CACHE_SIZE = 16
+
+    def __init__(self, base_dir="data/revisions", checkpoint_interval=None):
+        self.base_dir = base_dir
+        self.checkpoint_interval = checkpoint_interval or self.CHECKPOINT_INTERVAL
+        os.makedirs(base_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(os.path.join(base_dir, "revisions.lock"))
+        self._logs = {}
+        self._states = OrderedDict()
+
+    def _path(self, project_id):
+        return os.path.join(self.base_dir, f"{project_id}.jsonl")
+
+    def _log(self, project_id) -> _ProjectLog:
+        """取得最新的索引；檔案只有追加時從上次讀到的位置接著讀"""
+        path = self._path(project_id)
+        stamp = file_stamp(path)
+        log = self._logs.get(project_id)
+        if log is not None and log.stamp == stamp:
+            return log
+        if log is None or stamp is None or log.stamp is None or stamp[0] != log.stamp[0] or stamp[2] < log.end:
+            log = self._logs[project_id] = _ProjectLog()
+            self._drop_states(project_id)
+        log.stamp = stamp
+        if stamp is None:
+            return log
+        with open(path, 'rb') as f:
+            f.seek(log.end)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 寫到一半的版本不算數
+                revision = len(log.offsets) + 1
+                try:
+                    entry = json.loads(line)
+                    info = RevisionInfo(
+                        revision=entry["revision"], created_at=entry["created_at"], note=entry.get("note", ""),
+                        group_count=entry["count"], total=Money.of(entry["total"]),
+                        checkpoint="groups" in entry)
+                except (ValueError, KeyError, TypeError) as e:
+                    log.errors.append((revision, f"無法讀取: {e}"))
+                    log.offsets.append(None)
+                    log.infos.append(None)
+                else:
+                    log.offsets.append(log.end)
+                    log.infos.append(info)
+                log.end += len(line)
+        return log
+
+    def _drop_states(self, project_id):
+        for key in [k for k in self._states if k[0] == project_id]:
+            del self._states[key]
+
+    def _read_entry(self, f, log, revision):
+        offset = log.offsets[revision - 1]
+        if offset is None:
+            raise KeyError(f"版本 {revision} 已損毀")
+        f.seek(offset)
+        return json.loads(f.readline())
+
+    def _state(self, project_id, log, revision) -> Dict[str, dict]:
+        """還原某版本的 {貨號: 紀錄}"""
+        cached = self._states.get((project_id, revision))
+        if cached is not None:
+            self._states.move_to_end((project_id, revision))
+            return cached
+        # 沿著各版本記錄的 base 往回讀，遇到完整快照或快取中的版本即停；
+        # 基準版本無法還原時改存的快照也因此能當作之後版本的起點
+        deltas = []
+        rev = revision
+        with open(self._path(project_id), 'rb') as f:
+            while True:
+                entry = self._read_entry(f, log, rev)
+                if "groups" in entry:
+                    state = {r["item_number"]: r for r in entry["groups"]}
+                    break
+                deltas.append(entry)
+                base = entry.get("base")
+                if not isinstance(base, int) or not 1 <= base < rev:
+                    raise ValueError(f"版本 {rev} 的基準版本 {base} 不正確")
+                rev = base
+                state = self._states.get((project_id, rev))
+                if state is not None:
+                    break
+        for entry in reversed(deltas):
+            state = _apply(state, entry)
+        self._remember(project_id, revision, state)
+        return state
+
+    def _remember(self, project_id, revision, state):
+        self._states[(project_id, revision)] = state
+        self._states.move_to_end((project_id, revision))
+        while len(self._states) > self.STATE_CACHE_SIZE:
+            self._states.popitem(last=False)
+
+    def _check_revision(self, log, revision):
+        if not 1 <= revision <= len(log.offsets):
+            raise KeyError(f"找不到版本: {revision}")
+        if log.offsets[revision - 1] is None:
+            raise KeyError(f"版本 {revision} 已損毀")
+
+    def _try_state(self, project_id, log, revision):
+        """還原某版本；版本本身或差異鏈上的版本損毀時回傳 None"""
+        try:
+            return self._state(project_id, log, revision)
+        except (KeyError, ValueError):
+            return None
+
+    # ── 公開介面 ──────────────────────────────────────────
+
+    def commit(self, project_id, groups, note="") -> Optional[int]:
+        """記錄一個新版本並回傳版本號；與最新版本相同時不記錄，回傳 None"""
+        target = _records(groups)
+        with self._lock, self._file_lock:
+            log = self._log(project_id)
+            latest = len(log.offsets)
+            if latest and self._try_state(project_id, log, latest) == target:
+                return None
+            revision = latest + 1
+            entry = {
+                "revision": revision,
+                "created_at": datetime.now().isoformat(timespec='seconds'),
+                "note": note,
+                "count": len(target),
+                "total": float(Money.sum(_record_total(r) for r in target.values())),
+            }
+            base = _skip_base(revision, self.checkpoint_interval)
+            base_state = None if base is None else self._try_state(project_id, log, base)
+            if base_state is None:
+                base = None
+                entry["groups"] = list(target.values())
+            else:
+                entry["base"] = base
+                entry.update(_make_delta(base_state, target))
+            line = (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n").encode("utf-8")
+            with open(self._path(project_id), 'ab') as f:
+                # 當機留下的不完整尾行截掉，新版本才不會接在殘行後面
+                if f.tell() > log.end:
+                    f.truncate(log.end)
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            log.offsets.append(log.end)
+            log.infos.append(RevisionInfo(revision, entry["created_at"], note, entry["count"],
+                                          Money.of(entry["total"]), base is None))
+            log.end += len(line)
+            log.stamp = file_stamp(self._path(project_id))
+            self._remember(project_id, revision, target)
+            return revision
+
+    def revisions(self, project_id) -> List[RevisionInfo]:
+        """案子的所有版本摘要，舊的在前；損毀的版本不列出"""
+        with self._lock:
+            return [info for info in self._log(project_id).infos if info is not None]
+
+    def errors(self, project_id) -> List[Tuple[int, str]]:
+        """版本檔中無法讀取的版本：[(版本號, 原因)]"""
+        with self._lock:
+            return list(self._log(project_id).errors)
+
+    def latest(self, project_id) -> int:
+        """最新版本號；沒有任何版本時為 0"""
+        with self._lock:
+            return len(self._log(project_id).offsets)
+
+    def checkout(self, project_id, revision=None):
+        """還原某版本（預設最新版）的貨號群組清單"""
+        with self._lock:
+            log = self._log(project_id)
+            revision = revision or len(log.offsets)
+            if revision == 0:
+                return []
+            self._check_revision(log, revision)
+            return [upgrade_record(r)[0] for r in self._state(project_id, log, revision).values()]
+
+    def diff(self, project_id, from_revision, to_revision) -> QuoteDiff:
+        """比較兩個版本：新增、刪除與變動的貨號，以及各貨號與整份報價的金額變化"""
+        with self._lock:
+            log = self._log(project_id)
+            self._check_revision(log, from_revision)
+            self._check_revision(log, to_revision)
+            before = self._state(project_id, log, from_revision)
+            after = self._state(project_id, log, to_revision)
+        changed = [_group_change(n, before[n], r) for n, r in after.items() if n in before and before[n] != r]
+        common_before = [n for n in before if n in after]
+        common_after = [n for n in after if n in before]
+        return QuoteDiff(
+            from_revision=from_revision,
+            to_revision=to_revision,
+            added=[n for n in after if n not in before],
+            removed=[n for n in before if n not in after],
+            changed=changed,
+            total_before=log.infos[from_revision - 1].total,
+            total_after=log.infos[to_revision - 1].total,
+            reordered=common_before != common_after,
+        )
+
+    def delete(self, project_id):
+        """刪除案子的所有版本"""
+        with self._lock, self._file_lock:
+            path = self._path(project_id)
+            self._logs.pop(project_id, None)
+            self._drop_states(project_id)
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Error deleting file {path}: {e}")
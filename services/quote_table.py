@@ -0,0 +1,344 @@
+# services/quote_table.py
+
+import math
+import re
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, List
+from services.pricing import ItemGroup, SewingItem, SubItem
+from services.money import Money
+
+# SubItem 預設 id 的格式：sub- 加 6 碼十六進位，可以直接存成整數
+_SUB_ID_RE = re.compile(r"sub-([0-9a-f]{6})\Z")
+
+# 每一列的旗標：第 i 個數量欄位原本是 int（寫回 JSON 時維持整數）；金額欄位一律存整數分
+_SEWING_NUMBERS = ("width", "height", "pieces", "quantity")
+_QUANTITY_NONE = 0x80   # SewingItem.quantity 為 None
+
+# 二進位格式：魔術字與版本號，之後依序為三個字串清單與 _BINARY_COLUMNS 各欄，一律 little-endian
+_BINARY_MAGIC = b"CQT"
+_BINARY_VERSION = 1
+_BINARY_COLUMNS = (
+    ("fabric_ids", "I"), ("type_ids", "I"), ("unit_ids", "I"),
+    ("widths", "d"), ("heights", "d"), ("pieces", "d"),
+    ("unit_prices", "q"), ("subtotals", "q"), ("quantities", "d"),
+    ("catalog_versions", "q"), ("_sewing_flags", "B"),
+    ("sub_offsets", "I"), ("sub_ids", "q"), ("sub_quantities", "d"),
+    ("sub_unit_prices", "q"), ("sub_subtotals", "q"), ("_sub_flags", "B"),
+)
+_COLUMN_HEADER = struct.Struct("<cBI")   # 型別碼、每個值的位元組數、值的個數
+_COUNT = struct.Struct("<I")
+
+
+def _pack_number(value, bit, flags):
+    if isinstance(value, int) and not isinstance(value, bool):
+        flags |= 1 << bit
+    return float(value), flags
+
+
+def _unpack_number(value, bit, flags):
+    return int(value) if flags & (1 << bit) else value
+
+
+class QuoteTable:
+    """以欄位陣列保存整份報價，供大量明細與批次重新計價使用
+
+    - 數量欄位存在 array('d')、金額以整數分存在 array('q')，每列只佔 8 bytes，不為每個項目建立物件
+    - 布料、形式、單位放進字串表只存一次，各列記錄字串表的索引
+    - 子項目依貨號連續存放，sub_offsets[g]:sub_offsets[g + 1] 為第 g 個貨號的子項目
+    - 子項目 id 為 sub-xxxxxx 格式時直接存成整數；其他格式放進字串表並以負數表示
+
+    與 ItemGroup 清單及歷史 JSON 互轉不會遺失資料，數量欄位的整數與浮點數也會原樣保留。
+    """
+
+    def __init__(self):
+        self._strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+        # 貨號（車工）欄位
+        self.item_numbers: List[str] = []
+        self.fabric_ids = array('I')
+        self.type_ids = array('I')
+        self.unit_ids = array('I')
+        self.widths = array('d')
+        self.heights = array('d')
+        self.pieces = array('d')
+        self.unit_prices = array('q')       # 分
+        self.subtotals = array('q')         # 分
+        self.quantities = array('d')
+        self.catalog_versions = array('q')   # -1 表示 None
+        self._sewing_flags = bytearray()
+        # 子項目欄位
+        self.sub_offsets = array('I', [0])
+        self.sub_ids = array('q')
+        self.sub_descriptions: List[str] = []
+        self.sub_quantities = array('d')
+        self.sub_unit_prices = array('q')   # 分
+        self.sub_subtotals = array('q')     # 分
+        self._sub_flags = bytearray()
+
+    def __len__(self):
+        return len(self.item_numbers)
+
+    @property
+    def sub_count(self) -> int:
+        return len(self.sub_ids)
+
+    def intern(self, text: str) -> int:
+        """字串在字串表中的索引，第一次出現時加入"""
+        index = self._string_ids.get(text)
+        if index is None:
+            index = self._string_ids[text] = len(self._strings)
+            self._strings.append(text)
+        return index
+
+    def string(self, index: int) -> str:
+        return self._strings[index]
+
+    # ── 轉換 ──────────────────────────────────────────────
+
+    def append_group(self, group: ItemGroup):
+        s = group.sewing_item
+        flags = 0
+        numbers = []
+        for bit, name in enumerate(_SEWING_NUMBERS):
+            value = getattr(s, name)
+            if name == "quantity" and value is None:
+                flags |= _QUANTITY_NONE
+                value = math.nan
+            value, flags = _pack_number(value, bit, flags)
+            numbers.append(value)
+        self.item_numbers.append(group.item_number)
+        self.fabric_ids.append(self.intern(s.fabric))
+        self.type_ids.append(self.intern(s.type))
+        self.unit_ids.append(self.intern(s.unit))
+        for column, value in zip((self.widths, self.heights, self.pieces, self.quantities), numbers):
+            column.append(value)
+        self.unit_prices.append(s.unit_price.cents)
+        self.subtotals.append(s.subtotal.cents)
+        self.catalog_versions.append(-1 if s.catalog_version is None else s.catalog_version)
+        self._sewing_flags.append(flags)
+
+        for sub in group.sub_items:
+            match = _SUB_ID_RE.match(sub.id)
+            self.sub_ids.append(int(match.group(1), 16) if match else -1 - self.intern(sub.id))
+            self.sub_descriptions.append(sub.description)
+            quantity, flags = _pack_number(sub.quantity, 0, 0)
+            self.sub_quantities.append(quantity)
+            self.sub_unit_prices.append(sub.unit_price.cents)
+            self.sub_subtotals.append(sub.subtotal.cents)
+            self._sub_flags.append(flags)
+        self.sub_offsets.append(len(self.sub_ids))
+
+    @classmethod
+    def from_groups(cls, groups: Iterable[ItemGroup]) -> "QuoteTable":
+        table = cls()
+        for group in groups:
+            table.append_group(group)
+        return table
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> "QuoteTable":
+        """由歷史 JSON 的紀錄（asdict 後的 ItemGroup）建立"""
+        table = cls()
+        for record in records:
+            sewing = SewingItem(**record['sewing_item'])
+            subs = [SubItem(**sub) for sub in record.get('sub_items', [])]
+            table.append_group(ItemGroup(item_number=record['item_number'], sewing_item=sewing, sub_items=subs))
+        return table
+
+    def _sewing_item(self, g) -> SewingItem:
+        flags = self._sewing_flags[g]
+        values = {
+            name: _unpack_number(column[g], bit, flags)
+            for bit, (name, column) in enumerate(zip(_SEWING_NUMBERS, (
+                self.widths, self.heights, self.pieces, self.quantities)))
+        }
+        if flags & _QUANTITY_NONE:
+            values["quantity"] = None
+        version = self.catalog_versions[g]
+        return SewingItem(
+            fabric=self._strings[self.fabric_ids[g]], type=self._strings[self.type_ids[g]],
+            unit_price=Money(self.unit_prices[g]), subtotal=Money(self.subtotals[g]),
+            catalog_version=None if version < 0 else version, unit=self._strings[self.unit_ids[g]],
+            **values
+        )
+
+    def _sub_id(self, i) -> str:
+        value = self.sub_ids[i]
+        return f"sub-{value:06x}" if value >= 0 else self._strings[-1 - value]
+
+    def _sub_items(self, g) -> List[SubItem]:
+        subs = []
+        for i in range(self.sub_offsets[g], self.sub_offsets[g + 1]):
+            flags = self._sub_flags[i]
+            subs.append(SubItem(
+                description=self.sub_descriptions[i], id=self._sub_id(i),
+                quantity=_unpack_number(self.sub_quantities[i], 0, flags),
+                unit_price=Money(self.sub_unit_prices[i]),
+                subtotal=Money(self.sub_subtotals[i]),
+            ))
+        return subs
+
+    def group(self, g) -> ItemGroup:
+        """第 g 個貨號轉回 ItemGroup"""
+        return ItemGroup(item_number=self.item_numbers[g], sewing_item=self._sewing_item(g),
+                         sub_items=self._sub_items(g))
+
+    def to_groups(self) -> List[ItemGroup]:
+        return [self.group(g) for g in range(len(self))]
+
+    def to_records(self) -> List[dict]:
+        """轉成與 HistoryManager 存檔相同格式的紀錄清單"""
+        records = []
+        for g in range(len(self)):
+            s = self._sewing_item(g)
+            records.append({
+                "item_number": self.item_numbers[g],
+                "sewing_item": {
+                    "fabric": s.fabric, "type": s.type, "width": s.width, "height": s.height,
+                    "pieces": s.pieces, "unit_price": s.unit_price, "subtotal": s.subtotal,
+                    "catalog_version": s.catalog_version, "unit": s.unit, "quantity": s.quantity,
+                },
+                "sub_items": [
+                    {"description": sub.description, "id": sub.id, "quantity": sub.quantity,
+                     "unit_price": sub.unit_price, "subtotal": sub.subtotal}
+                    for sub in self._sub_items(g)
+                ],
+            })
+        return records
+
+    # ── 二進位格式 ────────────────────────────────────────
+
+    @staticmethod
+    def _pack_strings(out, strings):
+        # 各字串的字元數放在一個 array，內容接成一整段 UTF-8，讀取時只需解碼一次
+        lengths = array('I', map(len, strings))
+        blob = "".join(strings).encode("utf-8")
+        out.append(_COUNT.pack(len(strings)))
+        QuoteTable._pack_column(out, lengths)
+        out.append(_COUNT.pack(len(blob)))
+        out.append(blob)
+
+    @staticmethod
+    def _pack_column(out, column):
+        if isinstance(column, bytearray):
+            out.append(_COLUMN_HEADER.pack(b"B", 1, len(column)))
+            out.append(bytes(column))
+            return
+        if sys.byteorder == "big":
+            column = array(column.typecode, column)
+            column.byteswap()
+        out.append(_COLUMN_HEADER.pack(column.typecode.encode("ascii"), column.itemsize, len(column)))
+        out.append(column.tobytes())
+
+    def to_bytes(self) -> bytes:
+        """序列化為緊湊的二進位格式：字串表加上各欄位陣列的原始位元組"""
+        out = [_BINARY_MAGIC, bytes([_BINARY_VERSION])]
+        for strings in (self._strings, self.item_numbers, self.sub_descriptions):
+            self._pack_strings(out, strings)
+        for name, _ in _BINARY_COLUMNS:
+            self._pack_column(out, getattr(self, name))
+        return b"".join(out)
+
+    @classmethod
+    def from_bytes(cls, data) -> "QuoteTable":
+        """由 to_bytes() 的結果還原；格式不符時丟出 ValueError"""
+        view = memoryview(data)
+        if len(view) < 4 or bytes(view[:3]) != _BINARY_MAGIC:
+            raise ValueError("不是報價明細的二進位檔")
+        if view[3] != _BINARY_VERSION:
+            raise ValueError(f"不支援的二進位格式版本: {view[3]}")
+        pos = 4
+
+        def column(typecode):
+            nonlocal pos
+            code, itemsize, count = _COLUMN_HEADER.unpack_from(view, pos)
+            pos += _COLUMN_HEADER.size
+            end = pos + itemsize * count
+            if end > len(view):
+                raise ValueError("二進位檔不完整")
+            raw = view[pos:end]
+            pos = end
+            if typecode == "B":
+                return bytearray(raw)
+            values = array(typecode)
+            if code.decode("ascii") != typecode or itemsize != values.itemsize:
+                raise ValueError(f"欄位格式不符: {code!r}/{itemsize}")
+            values.frombytes(raw)
+            if sys.byteorder == "big":
+                values.byteswap()
+            return values
+
+        def strings():
+            nonlocal pos
+            (count,) = _COUNT.unpack_from(view, pos)
+            pos += _COUNT.size
+            lengths = column("I")
+            (size,) = _COUNT.unpack_from(view, pos)
+            pos += _COUNT.size
+            text = str(view[pos:pos + size], "utf-8")
+            pos += size
+            result, start = [], 0
+            for length in lengths:
+                result.append(text[start:start + length])
+                start += length
+            if len(result) != count or start != len(text):
+                raise ValueError("字串表不完整")
+            return result
+
+        table = cls()
+        try:
+            table._strings = strings()
+            table.item_numbers = strings()
+            table.sub_descriptions = strings()
+            for name, typecode in _BINARY_COLUMNS:
+                setattr(table, name, column(typecode))
+        except struct.error:
+            raise ValueError("二進位檔不完整")
+        table._string_ids = {text: i for i, text in enumerate(table._strings)}
+        n, subs = len(table.item_numbers), len(table.sub_descriptions)
+        if (any(len(getattr(table, name)) != n for name, _ in _BINARY_COLUMNS[:11])
+                or len(table.sub_offsets) != n + 1 or table.sub_offsets[-1] != subs
+                or any(len(getattr(table, name)) != subs for name, _ in _BINARY_COLUMNS[12:])):
+            raise ValueError("二進位檔的欄位長度不一致")
+        limit = len(table._strings)
+        if (any(ids and max(ids) >= limit for ids in (table.fabric_ids, table.type_ids, table.unit_ids))
+                or (table.sub_ids and -1 - min(table.sub_ids) >= limit)):
+            raise ValueError("二進位檔的字串索引超出字串表")
+        return table
+
+    # ── 彙總與重新計價 ────────────────────────────────────
+
+    def group_totals(self) -> List[Money]:
+        """各貨號合計（車工小計加子項目小計），只做整數加法"""
+        subs = self.sub_subtotals
+        offsets = self.sub_offsets
+        return [Money(self.subtotals[g] + sum(subs[offsets[g]:offsets[g + 1]])) for g in range(len(self))]
+
+    def total(self) -> Money:
+        return Money(sum(self.subtotals) + sum(self.sub_subtotals))
+
+    def reprice(self, engine, snapshot=None) -> Dict[int, Exception]:
+        """以 PricingEngine 批次重新計算所有車工單價與小計，直接寫回欄位
+
+        查無單價的貨號保留原值，回傳 {貨號列號: PriceNotFoundError}。
+        """
+        strings = self._strings
+        fabrics = [strings[i] for i in self.fabric_ids]
+        types = [strings[i] for i in self.type_ids]
+        result = engine.price_batch(fabrics, types, self.widths, self.heights, self.pieces, snapshot)
+        unit = engine.rules.unit
+        version = -1 if result.catalog_version is None else result.catalog_version
+        for g, (price, quantity, subtotal) in enumerate(
+                zip(result.unit_price_cents, result.quantities, result.subtotal_cents)):
+            if price is None:
+                continue
+            flags = self._sewing_flags[g] & ~(_QUANTITY_NONE | 0b1000)   # 數量改為計算結果
+            self.unit_prices[g] = price
+            self.subtotals[g] = subtotal
+            self.quantities[g] = float(quantity)
+            self.unit_ids[g] = self.intern(unit(fabrics[g], types[g]))
+            self.catalog_versions[g] = version
+            self._sewing_flags[g] = flags
+        return result.errors
@@ -0,0 +1,111 @@
+# services/save_worker.py
+
+import atexit
+import threading
+import time
+
+
+class SaveWorker:
+    """背景存檔服務
+
+    同一個 key（通常是檔案路徑）在 delay 秒內的多次 schedule 只會寫一次，
+    以最後一次提供的存檔函式為準；持續有新異動時最多延後 max_delay 秒。
+    存檔函式在背景執行緒執行，主執行緒（Tk）不必等待檔案 I/O。
+    """
+
+    def __init__(self, delay=0.5, max_delay=3.0, on_error=None):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.on_error = on_error or self._print_error
+        self._pending = {}      # key -> [到期時間, 最晚期限, 存檔函式]
+        self._cond = threading.Condition()
+        # 取出並執行工作時持有，flush/cancel 可藉此等待進行中的存檔完成
+        self._run_lock = threading.RLock()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="SaveWorker", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    @staticmethod
+    def _print_error(key, error):
+        print(f"Error saving {key}: {error}")
+
+    def schedule(self, key, func, delay=None):
+        """排定存檔；尚未寫出的同 key 工作會被取代並重新計時"""
+        now = time.monotonic()
+        delay = self.delay if delay is None else delay
+        with self._cond:
+            if self._stopped:
+                self._execute(key, func)
+                return
+            entry = self._pending.get(key)
+            deadline = entry[1] if entry else now + self.max_delay
+            self._pending[key] = [min(now + delay, deadline), deadline, func]
+            self._cond.notify()
+
+    def cancel(self, key):
+        """取消尚未寫出的存檔（例如檔案即將被刪除）"""
+        with self._cond:
+            self._pending.pop(key, None)
+        # 等待可能正在執行的同一份存檔結束
+        with self._run_lock:
+            pass
+
+    def is_pending(self, key):
+        with self._cond:
+            return key in self._pending
+
+    def flush(self, key=None):
+        """立即在呼叫端執行待寫出的存檔；key 為 None 時全部寫出"""
+        with self._cond:
+            if key is None:
+                jobs = list(self._pending.items())
+                self._pending.clear()
+            else:
+                entry = self._pending.pop(key, None)
+                jobs = [(key, entry)] if entry else []
+        if not jobs:
+            # 背景執行緒可能正在寫，等它完成
+            with self._run_lock:
+                pass
+            return
+        for job_key, (_, _, func) in jobs:
+            self._execute(job_key, func)
+
+    def stop(self):
+        """寫出所有待存檔案並停止背景執行緒"""
+        with self._cond:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+    def _execute(self, key, func):
+        with self._run_lock:
+            try:
+                func()
+            except Exception as e:
+                self.on_error(key, e)
+
+    def _wait_due(self):
+        """等到有工作到期；停止時回傳 False"""
+        with self._cond:
+            while not self._stopped:
+                now = time.monotonic()
+                if any(entry[0] <= now for entry in self._pending.values()):
+                    return True
+                timeout = min((entry[0] for entry in self._pending.values()), default=None)
+                self._cond.wait(None if timeout is None else timeout - now)
+            return False
+
+    def _run(self):
+        while self._wait_due():
+            with self._run_lock:
+                with self._cond:
+                    now = time.monotonic()
+                    due = [k for k, entry in self._pending.items() if entry[0] <= now]
+                    jobs = [(k, self._pending.pop(k)[2]) for k in due]
+                for key, func in jobs:
+                    self._execute(key, func)
@@ -0,0 +1,176 @@
+# services/scenarios.py
+
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Tuple, Union
+from services.money import Money
+from services.pricing import ItemGroup, PricingEngine, PriceNotFoundError
+from services.pricing_rules import QuoteTotals
+
+
+class PriceOverlay:
+    """在既有單價來源上覆蓋部分 (布料, 形式) 的單價，介面與 CatalogSnapshot 相同
+
+    version 包含覆蓋內容，計價快取中不同覆蓋組合的結果不會互相混用。
+    """
+
+    def __init__(self, base, overrides, base_version):
+        self.base = base
+        self.overrides = dict(overrides)
+        self.version = ("overlay", base_version, tuple(sorted(self.overrides.items())))
+
+    def get_price(self, fabric, type):
+        price = self.overrides.get((fabric, type))
+        return price if price is not None else self.base.get_price(fabric, type)
+
+
+@dataclass
+class Scenario:
+    """一個試算方案
+
+    fabric、type 為字串時所有貨號都換成該布料／形式，為 dict 時依 {原值: 新值} 替換；
+    prices 以 {(布料, 形式): 單價} 覆蓋單價表；item_numbers 限定只替換這些貨號。
+    """
+    name: str
+    fabric: Union[str, Dict[str, str], None] = None
+    type: Union[str, Dict[str, str], None] = None
+    prices: Dict[Tuple[str, str], float] = field(default_factory=dict)
+    item_numbers: Optional[frozenset] = None
+
+    def _substitute(self, value, rule):
+        if rule is None:
+            return value
+        if isinstance(rule, str):
+            return rule
+        return rule.get(value, value)
+
+    def line_key(self, group: ItemGroup) -> Tuple[str, str]:
+        """此方案中該貨號使用的 (布料, 形式)"""
+        s = group.sewing_item
+        if self.item_numbers is not None and group.item_number not in self.item_numbers:
+            return s.fabric, s.type
+        return self._substitute(s.fabric, self.fabric), self._substitute(s.type, self.type)
+
+
+@dataclass
+class ScenarioResult:
+    """方案的試算結果；delta 為與原方案（第一個結果）總計的差額"""
+    name: str
+    totals: QuoteTotals
+    group_totals: Dict[str, Money]
+    errors: Dict[str, PriceNotFoundError]
+    delta: Money = field(default_factory=Money)
+
+
+class ScenarioEngine:
+    """一次試算多個替換方案並比較總計
+
+    原方案直接採用報價中保存的各貨號小計，即客戶看到的金額，不以今天的單價重算；
+    各方案只重新計價有替換布料／形式或被覆蓋單價的貨號，其餘貨號沿用保存的小計，
+    差額因此只反映方案本身的變動。所有方案中規格相同、單價來源相同的車工只計算一次，
+    計價再經過 PricingEngine 的快取，重複比較相同方案幾乎不必重算。
+    子項目不受替換影響，直接沿用原本的小計。
+    """
+
+    BASELINE = "原方案"
+
+    def __init__(self, engine: PricingEngine):
+        self.engine = engine
+
+    def _base_source(self, snapshot):
+        if snapshot is not None:
+            return snapshot, snapshot.version
+        manager = self.engine.sewing_price_manager
+        return manager, ("live", manager.revision)
+
+    @staticmethod
+    def _changed(plan, group):
+        """方案是否改動這個貨號的車工（替換布料／形式或覆蓋其單價）"""
+        key = plan.line_key(group)
+        return key in plan.prices or key != (group.sewing_item.fabric, group.sewing_item.type)
+
+    def evaluate(self, groups: List[ItemGroup], scenarios: List[Scenario], snapshot=None) -> List[ScenarioResult]:
+        """回傳原方案與各方案的試算結果，順序與 scenarios 相同（原方案在最前面）"""
+        groups = list(groups)
+        base, base_version = self._base_source(snapshot)
+        plans = list(scenarios)
+
+        # 每個方案、每個貨號對應的 (單價來源, 規格)；相同者合併成一次計算
+        sources = {None: snapshot}   # 來源代號 -> 傳給 price_batch 的 snapshot
+        requests = {None: {}}        # 來源代號 -> {規格: 結果}
+        plan_lines = []
+        for plan in plans:
+            overlay_id = None
+            if plan.prices:
+                overlay = PriceOverlay(base, plan.prices, base_version)
+                overlay_id = overlay.version
+                sources.setdefault(overlay_id, overlay)
+                requests.setdefault(overlay_id, {})
+            lines = []
+            for group in groups:
+                if not self._changed(plan, group):
+                    lines.append(None)   # 沿用保存的小計
+                    continue
+                s = group.sewing_item
+                fabric, type_ = plan.line_key(group)
+                source_id = overlay_id if (fabric, type_) in plan.prices else None
+                spec = (fabric, type_, s.width, s.height, s.pieces)
+                requests[source_id].setdefault(spec, None)
+                lines.append((source_id, spec))
+            plan_lines.append(lines)
+
+        for source_id, specs in requests.items():
+            if not specs:
+                continue
+            columns = [list(column) for column in zip(*specs)]
+            result = self.engine.price_batch(*columns, snapshot=sources[source_id])
+            for spec, cents in zip(specs, result.subtotal_cents):
+                specs[spec] = cents
+
+        stored = {group.item_number: group.total for group in groups}
+        results = [ScenarioResult(self.BASELINE, self.engine.rules.totals(Money.sum(stored.values())), stored, {})]
+        extras = [group.total.cents - group.sewing_item.subtotal.cents for group in groups]
+        for plan, lines in zip(plans, plan_lines):
+            group_totals = {}
+            errors = {}
+            subtotal = 0
+            for group, extra, line in zip(groups, extras, lines):
+                if line is None:
+                    cents = group.sewing_item.subtotal.cents
+                else:
+                    source_id, spec = line
+                    cents = requests[source_id][spec]
+                if cents is None:
+                    errors[group.item_number] = PriceNotFoundError(spec[0], spec[1])
+                    continue
+                group_totals[group.item_number] = Money(cents + extra)
+                subtotal += cents + extra
+            results.append(ScenarioResult(plan.name, self.engine.rules.totals(Money(subtotal)),
+                                          group_totals, errors))
+        baseline = results[0].totals.total
+        for result in results:
+            result.delta = result.totals.total - baseline
+        return results
+
+    def apply(self, groups: List[ItemGroup], scenario: Scenario, snapshot=None) -> List[ItemGroup]:
+        """把方案套用到貨號上，回傳新的群組清單；原資料不變
+
+        與 evaluate 相同，只重新計價方案改動的貨號，其餘貨號保留原本的車工與小計。
+        任一貨號查無單價時丟出第一個 PriceNotFoundError。
+        """
+        groups = list(groups)
+        changed = [i for i, group in enumerate(groups) if self._changed(scenario, group)]
+        base, base_version = self._base_source(snapshot)
+        source = PriceOverlay(base, scenario.prices, base_version) if scenario.prices else snapshot
+        keys = [scenario.line_key(groups[i]) for i in changed]
+        sewing = [groups[i].sewing_item for i in changed]
+        items, errors = self.engine.create_sewing_items(
+            [k[0] for k in keys], [k[1] for k in keys], [s.width for s in sewing],
+            [s.height for s in sewing], [s.pieces for s in sewing], source)
+        if errors:
+            raise errors[min(errors)]
+        if scenario.prices:
+            # 覆蓋過的單價不屬於任何單價表版本
+            items = [replace(item, catalog_version=None) for item in items]
+        new_items = dict(zip(changed, items))
+        return [replace(group, sewing_item=new_items.get(i, group.sewing_item), sub_items=list(group.sub_items))
+                for i, group in enumerate(groups)]
@@ -0,0 +1,146 @@
+# services/search_index.py
+
+import bisect
+import re
+import unicodedata
+from collections import defaultdict
+
+_PHONE_QUERY = re.compile(r'^[\d\-\s()+#]+$')
+_NON_DIGIT = re.compile(r'\D')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize(text):
+    """全形轉半形、轉小寫並去除空白，中文逐字比對不受影響"""
+    return _SPACES.sub('', unicodedata.normalize('NFKC', text or '')).lower()
+
+
+def _grams(text, n, unigrams=False):
+    if len(text) < n:
+        grams = {text}
+    else:
+        grams = {text[i:i + n] for i in range(len(text) - n + 1)}
+    if unigrams:
+        grams.update(text)
+    return grams
+
+
+class CustomerSearchIndex:
+    """客戶名稱、電話、地址的 n-gram 倒排索引
+
+    名稱與地址以相鄰兩字 (bigram)、電話以三碼建立倒排表，名稱另外建立單字索引，
+    中文不需斷詞即可做子字串搜尋。名稱前綴另以排序清單支援二分搜尋。
+    查詢時依「名稱前綴 → 名稱 → 電話 → 地址」順序輸出，湊滿 limit 筆即停止。
+    """
+
+    FIELDS = ("name", "phone", "address")
+    # 各欄位的 n-gram 長度；電話只有 10 種字元，用較長的 gram 才有鑑別度
+    GRAM_SIZES = (2, 3, 2)
+
+    def __init__(self, customers=()):
+        self._next_doc = 0
+        self._doc_of = {}      # 客戶 ID -> 文件編號
+        self._cust_of = {}     # 文件編號 -> 客戶 ID
+        self._texts = {}       # 文件編號 -> (名稱, 電話, 地址) 正規化後字串
+        self._postings = tuple(defaultdict(set) for _ in self.FIELDS)
+        self._names = []       # 排序的 (名稱, 文件編號)，供前綴搜尋
+        for cust in customers:
+            self._insert(cust)
+        self._names.sort()
+
+    def __len__(self):
+        return len(self._doc_of)
+
+    def _insert(self, cust):
+        doc = self._next_doc
+        self._next_doc += 1
+        texts = (normalize(cust.get("name")),
+                 _NON_DIGIT.sub('', cust.get("phone") or ''),
+                 normalize(cust.get("address")))
+        self._doc_of[cust["id"]] = doc
+        self._cust_of[doc] = cust["id"]
+        self._texts[doc] = texts
+        for pos, text in enumerate(texts):
+            if not text:
+                continue
+            postings = self._postings[pos]
+            for gram in _grams(text, self.GRAM_SIZES[pos], unigrams=(pos == 0)):
+                postings[gram].add(doc)
+        self._names.append((texts[0], doc))
+
+    def add(self, cust):
+        """加入或更新一位客戶"""
+        if cust["id"] in self._doc_of:
+            self.remove(cust["id"])
+        self._insert(cust)
+        # 新文件編號最大，只需把最後一筆移到正確位置
+        entry = self._names.pop()
+        bisect.insort(self._names, entry)
+
+    def remove(self, cust_id):
+        """移除一位客戶"""
+        doc = self._doc_of.pop(cust_id, None)
+        if doc is None:
+            return
+        del self._cust_of[doc]
+        texts = self._texts.pop(doc)
+        for pos, text in enumerate(texts):
+            if not text:
+                continue
+            postings = self._postings[pos]
+            for gram in _grams(text, self.GRAM_SIZES[pos], unigrams=(pos == 0)):
+                docs = postings.get(gram)
+                if docs is not None:
+                    docs.discard(doc)
+                    if not docs:
+                        del postings[gram]
+        i = bisect.bisect_left(self._names, (texts[0], doc))
+        if i < len(self._names) and self._names[i] == (texts[0], doc):
+            del self._names[i]
+
+    def _candidates(self, pos, text):
+        postings = self._postings[pos]
+        grams = _grams(text, self.GRAM_SIZES[pos]) if len(text) > 1 else {text}
+        sets = []
+        for gram in grams:
+            docs = postings.get(gram)
+            if not docs:
+                return
+            sets.append(docs)
+        sets.sort(key=len)
+        first, rest = sets[0], sets[1:]
+        for doc in first:
+            if all(doc in s for s in rest):
+                yield doc
+
+    def search(self, query, limit=20):
+        """搜尋客戶，回傳客戶 ID 清單（依相關程度排序）"""
+        q = normalize(query)
+        if not q or limit <= 0:
+            return []
+        found = []
+        seen = set()
+
+        def emit(doc):
+            if doc not in seen:
+                seen.add(doc)
+                found.append(self._cust_of[doc])
+            return len(found) >= limit
+
+        # 1. 名稱前綴
+        i = bisect.bisect_left(self._names, (q,))
+        while i < len(self._names) and self._names[i][0].startswith(q):
+            if emit(self._names[i][1]):
+                return found
+            i += 1
+
+        # 2. 名稱、電話、地址子字串
+        phone_q = _NON_DIGIT.sub('', query) if _PHONE_QUERY.match(query) else ''
+        for pos, text in enumerate((q, phone_q, q)):
+            # 太短的電話、地址查詢幾乎命中所有人，不值得掃描
+            if len(text) < (1 if pos == 0 else self.GRAM_SIZES[pos]):
+                continue
+            for doc in self._candidates(pos, text):
+                if text in self._texts[doc][pos] and emit(doc):
+                    return found
+        return found
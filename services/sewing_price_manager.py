@@ -1,24 +1,164 @@
-import json, os, uuid
+import bisect, os, threading, uuid
+from services.atomic_io import atomic_write_json, load_json
+from services.file_lock import FileLock, file_stamp
 
 class SewingPriceManager:
-    """管理 data/sewing_prices.json 中的車工單價清單"""
+    """管理 data/sewing_prices.json 中的車工單價清單
 
-    def __init__(self, data_path="data/sewing_prices.json"):
+    多個程式共用時，寫入在 <data_path>.lock 檔案鎖內進行；若檔案已被其他程式改過，
+    先重新載入，再把自己尚未存檔的異動套用上去，不會覆蓋別人的修改。
+
+    (布料, 形式) 為唯一鍵，查價走雜湊表；布料與各布料的形式清單預先排序，
+    於新增、修改、刪除時增量維護。
+    revision 在每次異動或重新載入時遞增，計價快取以此判斷結果是否過期。
+    """
+
+    def __init__(self, data_path="data/sewing_prices.json", saver=None):
         self.data_path = data_path
+        # 提供 SaveWorker 時，存檔交由背景合併寫出
+        self.saver = saver
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(data_path + ".lock")
+        self._stamp = None
+        self._unsaved = []
+        self.revision = 0
         os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
-        if not os.path.exists(self.data_path):
-            with open(self.data_path, 'w', encoding='utf-8') as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
-        self.records = self._load()
+        with self._file_lock:
+            if not os.path.exists(self.data_path):
+                atomic_write_json(self.data_path, [])
+            self.records = self._load()
 
     def _load(self):
-        with open(self.data_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return data if isinstance(data, list) else []
+        self._stamp = file_stamp(self.data_path)
+        data = load_json(self.data_path, backups=1)
+        if data is None:
+            raise ValueError(f"無法讀取車工單價檔案: {self.data_path}")
+        data = data if isinstance(data, list) else []
+        self._rebuild_index(data)
+        return data
+
+    # --- 索引維護 ---
+
+    def _rebuild_index(self, records):
+        self.revision += 1
+        self._by_id = {}
+        self._prices = {}      # (布料, 形式) -> 紀錄
+        self._key_count = {}   # 舊資料可能有重複鍵，記錄每個鍵的筆數
+        self._fabrics = []     # 排序的布料名稱
+        self._types = {}       # 布料 -> 排序的形式清單
+        for r in records:
+            self._index(r)
+
+    def _index(self, r):
+        key = (r["fabric"], r["type"])
+        self._by_id[r["id"]] = r
+        self._key_count[key] = self._key_count.get(key, 0) + 1
+        if key in self._prices:
+            return  # 重複鍵沿用第一筆，與原本線性搜尋的結果一致
+        self._prices[key] = r
+        types = self._types.get(r["fabric"])
+        if types is None:
+            types = self._types[r["fabric"]] = []
+            bisect.insort(self._fabrics, r["fabric"])
+        bisect.insort(types, r["type"])
+
+    def _unindex(self, r):
+        key = (r["fabric"], r["type"])
+        self._by_id.pop(r["id"], None)
+        self._key_count[key] -= 1
+        if self._prices.get(key) is not r:
+            return
+        if self._key_count[key]:
+            # 移除的是重複鍵中的第一筆，改由下一筆遞補
+            self._prices[key] = next(x for x in self.records
+                                     if x is not r and (x["fabric"], x["type"]) == key)
+            return
+        del self._key_count[key]
+        del self._prices[key]
+        types = self._types[r["fabric"]]
+        del types[bisect.bisect_left(types, r["type"])]
+        if not types:
+            del self._types[r["fabric"]]
+            del self._fabrics[bisect.bisect_left(self._fabrics, r["fabric"])]
+
+    def _check_unique(self, fabric, type, rec_id=None):
+        existing = self._prices.get((fabric, type))
+        if existing is not None and existing["id"] != rec_id:
+            raise ValueError(f"布料 '{fabric}' 搭配形式 '{type}' 的單價已存在")
 
     def _save(self):
-        with open(self.data_path, 'w', encoding='utf-8') as f:
-            json.dump(self.records, f, ensure_ascii=False, indent=2)
+        if self.saver:
+            self.saver.schedule(self.data_path, self._write)
+        else:
+            self._write()
+
+    def _write(self):
+        with self._lock, self._file_lock:
+            self._sync_external()
+            atomic_write_json(self.data_path, self.records, backups=1)
+            self._stamp = file_stamp(self.data_path)
+            self._unsaved.clear()
+
+    def _sync_external(self):
+        """其他程式改過檔案時重新載入並重新套用未存檔的異動；呼叫端需持有檔案鎖"""
+        if file_stamp(self.data_path) == self._stamp:
+            return False
+        self.records = self._load()
+        for op in self._unsaved:
+            try:
+                self._apply(op)
+            except (KeyError, ValueError):
+                pass  # 紀錄已被其他程式刪除，或其他程式已建立相同的布料與形式
+        return True
+
+    def refresh(self):
+        """其他程式改過檔案時重新載入；沒有變更時只花一次 stat。回傳是否有變更"""
+        if file_stamp(self.data_path) == self._stamp:
+            return False
+        with self._lock, self._file_lock:
+            return self._sync_external()
+
+    def _mutate(self, op):
+        with self._lock, self._file_lock:
+            self._sync_external()
+            result = self._apply(op)
+            self._unsaved.append(op)
+            self._save()
+            return result
+
+    def _apply(self, op):
+        kind = op[0]
+        self.revision += 1
+        if kind == "add":
+            rec = op[1]
+            self._check_unique(rec["fabric"], rec["type"])
+            self.records.append(rec)
+            self._index(rec)
+            return rec
+        if kind == "update":
+            rec_id, kwargs = op[1], op[2]
+            r = self._by_id.get(rec_id)
+            if r is None:
+                raise KeyError(f"找不到紀錄 ID: {rec_id}")
+            fields = {
+                "fabric": kwargs.get("fabric", r["fabric"]),
+                "type": kwargs.get("type", r["type"]),
+                "unit_price": float(kwargs.get("unit_price", r["unit_price"]))
+            }
+            if (fields["fabric"], fields["type"]) != (r["fabric"], r["type"]):
+                # 只擋改成已被使用的鍵；舊資料的重複鍵仍可單獨改單價
+                self._check_unique(fields["fabric"], fields["type"], rec_id)
+            self._unindex(r)
+            r.update(fields)
+            self._index(r)
+            return r
+        if kind == "delete":
+            rec_id = op[1]
+            r = self._by_id.get(rec_id)
+            if r is None:
+                raise KeyError(f"找不到紀錄 ID: {rec_id}")
+            self._unindex(r)
+            self.records.remove(r)
 
     def get_all(self):
         return self.records
@@ -30,43 +170,27 @@ class SewingPriceManager:
             "type": type,
             "unit_price": float(unit_price)
         }
-        self.records.append(rec)
-        self._save()
-        return rec
+        return self._mutate(("add", rec))
 
     def update(self, rec_id, **kwargs):
-        for r in self.records:
-            if r["id"] == rec_id:
-                r.update({
-                    "fabric": kwargs.get("fabric", r["fabric"]),
-                    "type": kwargs.get("type", r["type"]),
-                    "unit_price": float(kwargs.get("unit_price", r["unit_price"]))
-                })
-                self._save()
-                return r
-        raise KeyError(f"找不到紀錄 ID: {rec_id}")
+        return self._mutate(("update", rec_id, kwargs))
 
     def delete(self, rec_id):
-        orig = len(self.records)
-        self.records = [r for r in self.records if r["id"] != rec_id]
-        if len(self.records) == orig:
-            raise KeyError(f"找不到紀錄 ID: {rec_id}")
-        self._save()
+        self._mutate(("delete", rec_id))
 
     def get_by_id(self, rec_id):
         """根據 ID 獲取紀錄"""
-        for r in self.records:
-            if r["id"] == rec_id:
-                return r
-        return None
+        return self._by_id.get(rec_id)
 
     def get_fabrics(self):
-        """獲取所有不重複的布料名稱"""
-        return sorted(list(set(r['fabric'] for r in self.records)))
+        """獲取所有不重複的布料名稱（已排序）"""
+        return list(self._fabrics)
+
+    def get_types(self, fabric):
+        """獲取某布料可用的形式（已排序）"""
+        return list(self._types.get(fabric, []))
 
     def get_price(self, fabric, type):
-        """根據布料和形式獲取單價"""
-        for r in self.records:
-            if r['fabric'] == fabric and r['type'] == type:
-                return r['unit_price']
-        return 0
\ No newline at end of file
+        """根據布料和形式獲取單價；沒有設定時回傳 None（單價 0 是合法的設定）"""
+        r = self._prices.get((fabric, type))
+        return r['unit_price'] if r else None
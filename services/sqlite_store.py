@@ -0,0 +1,540 @@
+# services/sqlite_store.py
+
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from services.customer_manager import CustomerManager
+from services.sewing_price_manager import SewingPriceManager
+from services.history_manager import HistoryManager
+from services.history_binary import BinaryHistoryManager
+from services.history_index import HistoryIndex
+from services.history_store import HistoryStore, migrate_history_files
+from services.quote_revisions import QuoteRevisions
+from services.search_index import CustomerSearchIndex
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    phone TEXT NOT NULL DEFAULT '',
+    address TEXT NOT NULL DEFAULT '',
+    template_path TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_customers_name ON customers(name);
+
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    customer_id TEXT NOT NULL REFERENCES customers(id) ON DELETE CASCADE,
+    name TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_projects_customer ON projects(customer_id, name);
+
+CREATE TABLE IF NOT EXISTS sewing_prices (
+    id TEXT PRIMARY KEY,
+    fabric TEXT NOT NULL,
+    type TEXT NOT NULL,
+    unit_price REAL NOT NULL
+);
+"""
+
+
+def _unique_sewing_price_key(conn):
+    """(布料, 形式) 改為唯一索引；先刪除舊資料的重複鍵，保留最早的一筆（即 get_price 原本取用的單價）"""
+    cur = conn.execute("DELETE FROM sewing_prices WHERE rowid NOT IN "
+                       "(SELECT MIN(rowid) FROM sewing_prices GROUP BY fabric, type)")
+    conn.execute("DROP INDEX IF EXISTS idx_sewing_prices_key")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_sewing_prices_unique ON sewing_prices(fabric, type)")
+    if cur.rowcount:
+        return f"已刪除重複的車工單價 {cur.rowcount} 筆（同布料與形式只保留最早的一筆）"
+    return None
+
+
+# 依序套用的資料庫升級；PRAGMA user_version 記錄已套用的個數，每個升級只執行一次
+MIGRATIONS = (_unique_sewing_price_key,)
+
+
+class SQLiteStorage:
+    """SQLite 儲存後端：單一資料庫檔、WAL 模式，所有寫入都包在交易中
+
+    schema 為開啟時執行的建表語法；只存報價歷史的資料庫傳入空字串，由 HistoryStore 自行建表。
+    提供 schema 時接著套用 migrations 中尚未套用的升級，升級的說明記在 upgrade_notes 並印出。
+    """
+
+    def __init__(self, db_path="data/curtain.db", schema=SCHEMA, migrations=MIGRATIONS):
+        self.db_path = db_path
+        dir_name = os.path.dirname(db_path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        # 連線可能被背景存檔執行緒共用，以鎖保護
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.upgrade_notes = []
+        if schema:
+            self.conn.executescript(schema)
+            self._upgrade(migrations)
+
+    def _upgrade(self, migrations):
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] >= len(migrations):
+            return
+        with self._lock:
+            # 先取得寫入鎖再重新讀版本，同時開啟資料庫的其他程式不會重複升級
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+                for migrate in migrations[version:]:
+                    note = migrate(self.conn)
+                    if note:
+                        self.upgrade_notes.append(note)
+                self.conn.execute(f"PRAGMA user_version = {max(version, len(migrations))}")
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+        for note in self.upgrade_notes:
+            print(f"{self.db_path}: {note}")
+
+    @contextmanager
+    def transaction(self):
+        """交易區塊：正常結束時提交，發生例外時回滾"""
+        with self._lock:
+            with self.conn:
+                yield self.conn
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchone()
+
+    def data_version(self):
+        """其他連線（其他程式）提交變更後會改變的計數，本連線自己的寫入不影響"""
+        with self._lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class SQLiteCustomerManager:
+    """以 SQLite 儲存的客戶管理器，介面與 CustomerManager 相同
+
+    啟動時不載入任何客戶；名稱清單以 iter_name_pages 分頁讀取，
+    完整客戶資料與案子清單在 get_by_id 等查詢時才從資料庫取出。
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        # 搜尋索引在第一次 search() 時才由輕量欄位建立
+        self._search = None
+        self._data_version = storage.data_version()
+
+    def _customer(self, row):
+        cust = dict(row)
+        cust["projects"] = self.get_projects(cust["id"])
+        return cust
+
+    def load(self):
+        return self.get_all()
+
+    def save(self):
+        """每次異動都已在交易中提交，不需額外保存"""
+
+    def close(self):
+        pass
+
+    def refresh(self):
+        """資料每次都從資料庫讀取；其他程式寫入後只需捨棄記憶體中的搜尋索引"""
+        version = self.storage.data_version()
+        if version == self._data_version:
+            return False
+        self._data_version = version
+        self._search = None
+        return True
+
+    def add(self, name, phone, address, template_path):
+        """新增客戶"""
+        cust = {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "phone": phone,
+            "address": address,
+            "template_path": template_path,
+        }
+        with self.storage.transaction() as conn:
+            conn.execute(
+                "INSERT INTO customers (id, name, phone, address, template_path) "
+                "VALUES (:id, :name, :phone, :address, :template_path)", cust)
+        cust["projects"] = []
+        if self._search is not None:
+            self._search.add(cust)
+        return cust
+
+    def restore_customers(self, customers, overwrite=False):
+        """由備份加入客戶與案子，沿用原本的 ID，規則與 CustomerManager.restore_customers 相同"""
+        stats = {"customers": 0, "projects": 0, "updated": 0}
+        with self.storage.transaction() as conn:
+            for cust in customers:
+                row = {k: cust.get(k, "") for k in ("name", "phone", "address", "template_path")}
+                row["id"] = cust["id"]
+                if conn.execute(
+                        "INSERT OR IGNORE INTO customers (id, name, phone, address, template_path) "
+                        "VALUES (:id, :name, :phone, :address, :template_path)", row).rowcount:
+                    stats["customers"] += 1
+                elif overwrite:
+                    stats["updated"] += conn.execute(
+                        "UPDATE customers SET name = :name, phone = :phone, address = :address, "
+                        "template_path = :template_path WHERE id = :id AND NOT (name IS :name AND phone IS :phone "
+                        "AND address IS :address AND template_path IS :template_path)",
+                        row).rowcount
+                for project in cust.get("projects", []):
+                    if conn.execute("INSERT OR IGNORE INTO projects (id, customer_id, name) VALUES (?, ?, ?)",
+                                    (project["id"], cust["id"], project["name"])).rowcount:
+                        stats["projects"] += 1
+                    elif overwrite:
+                        stats["updated"] += conn.execute(
+                            "UPDATE projects SET name = ? WHERE id = ? AND customer_id = ? AND name != ?",
+                            (project["name"], project["id"], cust["id"], project["name"])).rowcount
+        self._search = None
+        return stats
+
+    def update(self, cust_id, **kwargs):
+        """更新客戶資訊"""
+        fields = {k: v for k, v in kwargs.items() if k in ("name", "phone", "address", "template_path")}
+        if fields:
+            assignments = ", ".join(f"{k} = :{k}" for k in fields)
+            with self.storage.transaction() as conn:
+                conn.execute(f"UPDATE customers SET {assignments} WHERE id = :id", dict(fields, id=cust_id))
+        cust = self.get_by_id(cust_id)
+        if cust and self._search is not None:
+            self._search.add(cust)
+        return cust
+
+    def delete(self, cust_id):
+        """刪除客戶（案子一併刪除）"""
+        with self.storage.transaction() as conn:
+            conn.execute("DELETE FROM customers WHERE id = ?", (cust_id,))
+        if self._search is not None:
+            self._search.remove(cust_id)
+
+    def search(self, query, limit=20):
+        """依名稱、電話或地址的部分字串搜尋客戶"""
+        self.refresh()
+        if self._search is None:
+            rows = self.storage.query("SELECT id, name, phone, address FROM customers ORDER BY rowid")
+            self._search = CustomerSearchIndex(dict(row) for row in rows)
+        return [cust for cust in map(self.get_by_id, self._search.search(query, limit)) if cust]
+
+    def get_all(self):
+        """取得所有客戶"""
+        rows = self.storage.query("SELECT * FROM customers ORDER BY rowid")
+        projects = {}
+        for p in self.storage.query("SELECT id, name, customer_id FROM projects ORDER BY rowid"):
+            projects.setdefault(p["customer_id"], []).append({"id": p["id"], "name": p["name"]})
+        customers = []
+        for row in rows:
+            cust = dict(row)
+            cust["projects"] = projects.get(cust["id"], [])
+            customers.append(cust)
+        return customers
+
+    def count(self):
+        """客戶總數"""
+        return self.storage.query_one("SELECT COUNT(*) FROM customers")[0]
+
+    def _iter_rows(self, columns, page_size):
+        # 以 rowid 為游標分頁，避免 OFFSET 越往後越慢
+        last = 0
+        while True:
+            rows = self.storage.query(
+                f"SELECT rowid, {columns} FROM customers WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last, page_size))
+            if not rows:
+                return
+            last = rows[-1]["rowid"]
+            yield rows
+
+    def iter_name_pages(self, page_size=1000):
+        """分頁取得 (id, 名稱)，供下拉選單逐頁載入"""
+        for rows in self._iter_rows("id, name", page_size):
+            yield [(row["id"], row["name"]) for row in rows]
+
+    def iter_pages(self, page_size=1000):
+        """分頁取得客戶資料（含案子清單）"""
+        for rows in self._iter_rows("id, name, phone, address, template_path", page_size):
+            ids = [row["id"] for row in rows]
+            projects = {}
+            placeholders = ", ".join("?" * len(ids))
+            for p in self.storage.query(
+                    f"SELECT id, name, customer_id FROM projects WHERE customer_id IN ({placeholders}) ORDER BY rowid",
+                    ids):
+                projects.setdefault(p["customer_id"], []).append({"id": p["id"], "name": p["name"]})
+            page = []
+            for row in rows:
+                cust = {k: row[k] for k in ("id", "name", "phone", "address", "template_path")}
+                cust["projects"] = projects.get(cust["id"], [])
+                page.append(cust)
+            yield page
+
+    def get_by_id(self, cust_id):
+        """根據 ID 取得客戶"""
+        row = self.storage.query_one("SELECT * FROM customers WHERE id = ?", (cust_id,))
+        return self._customer(row) if row else None
+
+    def get_by_name(self, name):
+        """根據名稱取得客戶；同名時回傳第一位"""
+        row = self.storage.query_one("SELECT * FROM customers WHERE name = ? ORDER BY rowid LIMIT 1", (name,))
+        return self._customer(row) if row else None
+
+    def get_all_by_name(self, name):
+        """根據名稱取得所有同名客戶"""
+        rows = self.storage.query("SELECT * FROM customers WHERE name = ? ORDER BY rowid", (name,))
+        return [self._customer(row) for row in rows]
+
+    def add_project(self, cust_id, project_name):
+        """為客戶新增案子"""
+        if not self.storage.query_one("SELECT 1 FROM customers WHERE id = ?", (cust_id,)):
+            return None
+        project = {"id": str(uuid.uuid4()), "name": project_name}
+        with self.storage.transaction() as conn:
+            conn.execute("INSERT INTO projects (id, customer_id, name) VALUES (?, ?, ?)",
+                         (project["id"], cust_id, project_name))
+        return project
+
+    def update_project(self, cust_id, project_id, new_name):
+        """更新客戶案子名稱"""
+        with self.storage.transaction() as conn:
+            cur = conn.execute("UPDATE projects SET name = ? WHERE id = ? AND customer_id = ?",
+                               (new_name, project_id, cust_id))
+        if cur.rowcount == 0:
+            return None
+        return {"id": project_id, "name": new_name}
+
+    def delete_project(self, cust_id, project_id):
+        """刪除客戶的案子"""
+        if not self.storage.query_one("SELECT 1 FROM customers WHERE id = ?", (cust_id,)):
+            return False
+        with self.storage.transaction() as conn:
+            conn.execute("DELETE FROM projects WHERE id = ? AND customer_id = ?", (project_id, cust_id))
+        return True
+
+    def get_projects(self, cust_id):
+        """取得客戶的所有案子"""
+        rows = self.storage.query("SELECT id, name FROM projects WHERE customer_id = ? ORDER BY rowid", (cust_id,))
+        return [dict(row) for row in rows]
+
+    def get_project(self, project_id):
+        """根據案子 ID 取得 (客戶, 案子)；找不到時回傳 (None, None)"""
+        row = self.storage.query_one("SELECT id, name, customer_id FROM projects WHERE id = ?", (project_id,))
+        if not row:
+            return None, None
+        return self.get_by_id(row["customer_id"]), {"id": row["id"], "name": row["name"]}
+
+    def get_project_by_name(self, cust_id, project_name):
+        """根據客戶 ID 與案名取得案子"""
+        row = self.storage.query_one(
+            "SELECT id, name FROM projects WHERE customer_id = ? AND name = ? ORDER BY rowid LIMIT 1",
+            (cust_id, project_name))
+        return dict(row) if row else None
+
+
+class SQLiteSewingPriceManager:
+    """以 SQLite 儲存的車工單價管理器，介面與 SewingPriceManager 相同"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._data_version = storage.data_version()
+        # 查不到單價的 (布料, 形式)；輸入過程中反覆查詢同一組合時不必再查資料庫
+        self._missing = set()
+        self._revision = 0
+
+    @property
+    def revision(self):
+        """本程式的異動次數加上資料庫的 data_version，其他程式寫入時也會改變"""
+        return (self._revision, self.storage.data_version())
+
+    def refresh(self):
+        """回傳其他程式是否寫入過資料庫；資料本身每次都從資料庫讀取"""
+        version = self.storage.data_version()
+        changed, self._data_version = version != self._data_version, version
+        if changed:
+            self._missing.clear()
+        return changed
+
+    def get_all(self):
+        return [dict(row) for row in self.storage.query("SELECT * FROM sewing_prices ORDER BY rowid")]
+
+    def _check_unique(self, conn, fabric, type, rec_id=None):
+        row = conn.execute("SELECT id FROM sewing_prices WHERE fabric = ? AND type = ? AND id != ? LIMIT 1",
+                           (fabric, type, rec_id or "")).fetchone()
+        if row:
+            raise ValueError(f"布料 '{fabric}' 搭配形式 '{type}' 的單價已存在")
+
+    def add(self, fabric, type, unit_price):
+        rec = {
+            "id": str(uuid.uuid4()),
+            "fabric": fabric,
+            "type": type,
+            "unit_price": float(unit_price)
+        }
+        with self.storage.transaction() as conn:
+            self._check_unique(conn, fabric, type)
+            self._missing.discard((fabric, type))
+            self._revision += 1
+            conn.execute("INSERT INTO sewing_prices (id, fabric, type, unit_price) "
+                         "VALUES (:id, :fabric, :type, :unit_price)", rec)
+        return rec
+
+    def update(self, rec_id, **kwargs):
+        r = self.get_by_id(rec_id)
+        if not r:
+            raise KeyError(f"找不到紀錄 ID: {rec_id}")
+        old_key = (r["fabric"], r["type"])
+        r.update({
+            "fabric": kwargs.get("fabric", r["fabric"]),
+            "type": kwargs.get("type", r["type"]),
+            "unit_price": float(kwargs.get("unit_price", r["unit_price"]))
+        })
+        with self.storage.transaction() as conn:
+            if (r["fabric"], r["type"]) != old_key:
+                self._check_unique(conn, r["fabric"], r["type"], rec_id)
+            self._missing.discard((r["fabric"], r["type"]))
+            self._revision += 1
+            conn.execute("UPDATE sewing_prices SET fabric = :fabric, type = :type, unit_price = :unit_price "
+                         "WHERE id = :id", r)
+        return r
+
+    def delete(self, rec_id):
+        with self.storage.transaction() as conn:
+            cur = conn.execute("DELETE FROM sewing_prices WHERE id = ?", (rec_id,))
+            self._revision += 1
+        if cur.rowcount == 0:
+            raise KeyError(f"找不到紀錄 ID: {rec_id}")
+
+    def get_by_id(self, rec_id):
+        """根據 ID 獲取紀錄"""
+        row = self.storage.query_one("SELECT * FROM sewing_prices WHERE id = ?", (rec_id,))
+        return dict(row) if row else None
+
+    def get_fabrics(self):
+        """獲取所有不重複的布料名稱"""
+        return [row["fabric"] for row in self.storage.query("SELECT DISTINCT fabric FROM sewing_prices ORDER BY fabric")]
+
+    def get_types(self, fabric):
+        """獲取某布料可用的形式（已排序）"""
+        return [row["type"] for row in self.storage.query(
+            "SELECT DISTINCT type FROM sewing_prices WHERE fabric = ? ORDER BY type", (fabric,))]
+
+    def get_price(self, fabric, type):
+        """根據布料和形式獲取單價；沒有設定時回傳 None（單價 0 是合法的設定）"""
+        key = (fabric, type)
+        if key in self._missing:
+            if not self.refresh():
+                return None
+        row = self.storage.query_one(
+            "SELECT unit_price FROM sewing_prices WHERE fabric = ? AND type = ? ORDER BY rowid LIMIT 1",
+            key)
+        if row is None:
+            self._missing.add(key)
+            return None
+        return row["unit_price"]
+
+
+def _sync_index(index):
+    try:
+        _, errors = index.sync(processes=1)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error syncing history index: {e}")
+        return
+    for path, reason in errors:
+        print(f"Error indexing {path}: {reason}")
+
+
+def create_managers(config, data_dir="data", saver=None):
+    """依設定 storage（"json" 或 "sqlite"）建立客戶、車工單價與歷史管理器
+
+    saver 為 SaveWorker 時，JSON 管理器的整檔存檔改在背景合併寫出；
+    SQLite 每次異動只寫單筆資料，不需要。
+    報價歷史在 SQLite 模式下存於同一個資料庫；JSON 模式預設每個案子一個檔案，
+    history_storage 設為 "store" 時改為集中存在 data/history.db；
+    每個案子一個檔案時，history_format 設為 "binary" 改用二進位格式（見 convert_history.py），
+    並在 data/history_index.db 維護各案子的彙總索引供報表使用（history_index 設為 false 時停用），
+    建立後在背景執行緒與歷史檔同步（同步完成前報表可能不完整）；索引損毀時以 rebuild_index.py 重建。
+    兩者都在 data/revisions/ 保留每次存檔的報價版本，quote_revisions 設為 false 時停用。
+    customer_journal 設為 true 時客戶異動改為追加到 customers.json.journal，累積後才合併回 customers.json；
+    預設關閉，因為舊版程式只讀 customers.json，看不到尚未合併的異動。
+    啟用後要退回舊版或關閉此設定前，先正常結束程式，讓日誌合併回 customers.json
+    （關閉設定後第一次啟動也會重播殘留的日誌，之後存檔時合併）。
+    """
+    revisions = QuoteRevisions(os.path.join(data_dir, "revisions")) if config.get("quote_revisions", True) else None
+    if config.get("storage") == "sqlite":
+        storage = SQLiteStorage(os.path.join(data_dir, "curtain.db"))
+        return (SQLiteCustomerManager(storage),
+                SQLiteSewingPriceManager(storage),
+                HistoryStore(storage, revisions))
+
+    if config.get("history_storage") == "store":
+        history = HistoryStore(SQLiteStorage(os.path.join(data_dir, "history.db"), schema=""), revisions)
+    else:
+        index = None
+        if config.get("history_index", True):
+            index = HistoryIndex(SQLiteStorage(os.path.join(data_dir, "history_index.db"), schema=""), data_dir)
+            # 只重新彙總戳記有變的檔案；升級後第一次啟動時把既有的歷史檔全部納入索引。
+            # 在背景執行緒以單一程序同步：不延遲主視窗出現，打包成 exe 時也不會啟動子程序
+            threading.Thread(target=_sync_index, args=(index,), name="HistoryIndexSync", daemon=True).start()
+        manager = BinaryHistoryManager if config.get("history_format") == "binary" else HistoryManager
+        history = manager(data_dir, revisions, index)
+    return (CustomerManager(os.path.join(data_dir, "customers.json"),
+                            journal=config.get("customer_journal", False), saver=saver),
+            SewingPriceManager(os.path.join(data_dir, "sewing_prices.json"), saver=saver),
+            history)
+
+
+def migrate_json_to_sqlite(data_dir="data", db_path=None):
+    """把 data/ 下的 JSON 檔一次匯入 SQLite；回傳 (統計, 無法匯入的檔案清單)
+
+    報價歷史包含沒有對應到任何客戶案子的檔案與舊版以案子為鍵的檔案，見 migrate_history_files。
+    """
+    storage = SQLiteStorage(db_path or os.path.join(data_dir, "curtain.db"))
+    customers = CustomerManager(os.path.join(data_dir, "customers.json")).get_all()
+    sewing_prices = SewingPriceManager(os.path.join(data_dir, "sewing_prices.json")).get_all()
+
+    stats = {"customers": 0, "projects": 0, "sewing_prices": 0, "sewing_price_duplicates": 0, "histories": 0}
+    with storage.transaction() as conn:
+        # 以 UPSERT 更新已存在的資料：INSERT OR REPLACE 會先刪除客戶，連帶刪掉他的案子
+        for cust in customers:
+            conn.execute(
+                "INSERT INTO customers (id, name, phone, address, template_path) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name, phone = excluded.phone, "
+                "address = excluded.address, template_path = excluded.template_path",
+                (cust["id"], cust.get("name", ""), cust.get("phone", ""),
+                 cust.get("address", ""), cust.get("template_path", "")))
+            stats["customers"] += 1
+            for project in cust.get("projects", []):
+                conn.execute("INSERT INTO projects (id, customer_id, name) VALUES (?, ?, ?) "
+                             "ON CONFLICT(id) DO UPDATE SET customer_id = excluded.customer_id, name = excluded.name",
+                             (project["id"], cust["id"], project["name"]))
+                stats["projects"] += 1
+        # 舊 JSON 可能有重複的 (布料, 形式)：保留第一筆，與 JSON 版查價的結果一致
+        for rec in sewing_prices:
+            cur = conn.execute(
+                "INSERT INTO sewing_prices (id, fabric, type, unit_price) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET fabric = excluded.fabric, type = excluded.type, "
+                "unit_price = excluded.unit_price "
+                "ON CONFLICT DO NOTHING",
+                (rec["id"], rec["fabric"], rec["type"], float(rec["unit_price"])))
+            stats["sewing_prices" if cur.rowcount else "sewing_price_duplicates"] += 1
+
+    history_stats, skipped = migrate_history_files(data_dir, HistoryStore(storage), customers)
+    stats["histories"] = history_stats["projects"]
+
+    storage.close()
+    return stats, skipped
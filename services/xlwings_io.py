@@ -1,4 +1,5 @@
 import xlwings as xw
+from services.money import Money
 
 class XlwingsManager:
     def __init__(self, config):
@@ -17,7 +18,10 @@ class XlwingsManager:
         ws.range('D3').value = quote_data['customer']['phone']
         ws.range('D4').value = quote_data['customer']['address']
         # 明細自動展開
-        data = [[i['item'], i['quantity'], i['unit'], i['unit_price'], i['subtotal']]
+        # xlwings 只接受 float，Money 先換算為元
+        data = [[i['item'], i['quantity'], i['unit'],
+                 float(i['unit_price']) if isinstance(i['unit_price'], Money) else i['unit_price'],
+                 float(i['subtotal']) if isinstance(i['subtotal'], Money) else i['subtotal']]
                 for i in quote_data['items']]
         ws.range('A7').options(expand='table').value = data
         ws.autofit()
@@ -0,0 +1,126 @@
+# tests/test_bulk_archive.py
+
+import json
+import zipfile
+
+import pytest
+
+from services.bulk_archive import (ArchiveError, MANIFEST, export_archive, import_archive, read_manifest,
+                                   restore_data_files)
+from services.customer_manager import CustomerManager
+from services.history_manager import HistoryManager
+from services.history_store import HistoryStore
+from services.money import Money
+from services.pricing import ItemGroup, SewingItem, SubItem
+from services.sewing_price_manager import SewingPriceManager
+from services.sqlite_store import SQLiteStorage
+
+
+def group(item_number, price, subs=()):
+    return ItemGroup(item_number, SewingItem("布A", "單開", 150, 200, 2, price, price * 2),
+                     [SubItem(d, id=f"sub-{d}", quantity=1, unit_price=10, subtotal=10) for d in subs])
+
+
+def managers(data_dir, history=None):
+    data_dir.mkdir(exist_ok=True)
+    return (CustomerManager(str(data_dir / "customers.json")),
+            SewingPriceManager(str(data_dir / "sewing_prices.json")),
+            history or HistoryManager(str(data_dir)))
+
+
+@pytest.fixture
+def source(tmp_path):
+    data_dir = tmp_path / "src"
+    customers, prices, history = managers(data_dir)
+    cust = customers.add("王小明", "0912", "台北市", "")
+    projects = [customers.add_project(cust["id"], name)["id"] for name in ("客廳", "主臥", "空的")]
+    prices.add("布A", "單開", 100)
+    history.save_project_items(projects[0], [group("A", 100, subs=["軌道"]), group("B", 50)])
+    history.save_project_items(projects[1], [group("C", 300)])
+    (data_dir / "history_c1.json").write_text(json.dumps({"舊案": []}), encoding="utf-8")
+    (data_dir / "history_deleted.json").write_text("[]", encoding="utf-8")
+    (data_dir / "config.json").write_text('{"storage": "json"}', encoding="utf-8")
+    return data_dir, (customers, prices, history), projects
+
+
+def test_export_import_round_trip(tmp_path, source):
+    data_dir, (customers, prices, history), projects = source
+    archive = str(tmp_path / "backup.zip")
+    calls = []
+    manifest = export_archive(archive, customers, prices, history, data_dir=str(data_dir),
+                              progress=lambda done, total: calls.append((done, total)))
+    assert calls[-1] == (3, 3)
+    assert manifest["histories"][projects[0]]["total"] == float(Money.of(310))
+    assert projects[2] not in manifest["histories"]
+    assert manifest["extra_histories"] == ["history_c1.json", "history_deleted.json"]
+    assert read_manifest(archive)["projects"] == 3
+
+    target = tmp_path / "dst"
+    restored = managers(target)
+    stats, problems = import_archive(archive, *restored)
+    assert problems == []
+    assert (stats["customers"], stats["projects"], stats["sewing_prices"], stats["histories"]) == (1, 3, 1, 2)
+    for pid in projects:
+        assert restored[2].load_project_items(pid) == history.load_project_items(pid)
+    assert restored[1].get_price("布A", "單開") == 100
+
+    assert sorted(restore_data_files(archive, str(target))) == ["config.json", "history_c1.json",
+                                                                 "history_deleted.json"]
+    assert restore_data_files(archive, str(target)) == []   # 已存在的檔案不覆蓋
+    assert (target / "history_c1.json").read_text(encoding="utf-8") == json.dumps({"舊案": []})
+
+
+def test_existing_histories_kept_unless_overwrite(tmp_path, source):
+    data_dir, mgrs, projects = source
+    archive = str(tmp_path / "backup.zip")
+    export_archive(archive, *mgrs)
+
+    target = managers(tmp_path / "dst")
+    import_archive(archive, *target)
+    target[2].save_project_items(projects[0], [group("A", 999)])
+    stats, _ = import_archive(archive, *target)
+    assert (stats["histories"], stats["histories_kept"]) == (0, 2)
+    assert target[2].load_project_items(projects[0])[0].sewing_item.unit_price == 999
+    stats, _ = import_archive(archive, *target, overwrite=True)
+    assert stats["histories"] == 2
+    assert len(target[2].load_project_items(projects[0])) == 2
+
+
+def test_store_backed_history_round_trip(tmp_path, source):
+    _, (customers, prices, history), projects = source
+    store = HistoryStore(SQLiteStorage(str(tmp_path / "history.db"), schema=""))
+    for pid in projects[:2]:
+        store.save_project_items(pid, history.load_project_items(pid))
+    archive = str(tmp_path / "backup.zip")
+    export_archive(archive, customers, prices, store)
+
+    target = managers(tmp_path / "dst", HistoryStore(SQLiteStorage(str(tmp_path / "dst.db"), schema="")))
+    stats, problems = import_archive(archive, *target)
+    assert problems == [] and stats["histories"] == 2
+    assert target[2].load_project_items(projects[0]) == history.load_project_items(projects[0])
+
+
+def test_broken_archives_raise_archive_error(tmp_path, source):
+    data_dir, mgrs, projects = source
+    bad = tmp_path / "bad.zip"
+    bad.write_bytes(b"not a zip")
+    with pytest.raises(ArchiveError):
+        read_manifest(str(bad))
+
+    with zipfile.ZipFile(bad, "w") as zf:
+        zf.writestr(MANIFEST, json.dumps({"format": 99}))
+    with pytest.raises(ArchiveError):
+        import_archive(str(bad), *mgrs)
+
+    # 單一案子的內容損毀只回報該案子
+    archive = str(tmp_path / "backup.zip")
+    manifest = export_archive(archive, *mgrs)
+    entry = manifest["histories"][projects[1]]["entry"]
+    broken = str(tmp_path / "broken.zip")
+    with zipfile.ZipFile(archive) as src, zipfile.ZipFile(broken, "w") as dst:
+        for info in src.infolist():
+            dst.writestr(info, b"garbage" if info.filename == entry else src.read(info))
+    target = managers(tmp_path / "dst")
+    stats, problems = import_archive(broken, *target)
+    assert stats["histories"] == 1
+    assert [pid for pid, _ in problems] == [projects[1]]
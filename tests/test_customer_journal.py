@@ -0,0 +1,71 @@
+# tests/test_customer_journal.py
+
+import json
+
+from services.customer_manager import CustomerManager
+
+
+def open_manager(tmp_path, **kwargs):
+    return CustomerManager(str(tmp_path / "customers.json"), journal=True, **kwargs)
+
+
+def snapshot(tmp_path):
+    return json.loads((tmp_path / "customers.json").read_text(encoding="utf-8"))
+
+
+def test_changes_are_journaled_then_compacted(tmp_path):
+    manager = open_manager(tmp_path)
+    a = manager.add("王小明", "", "", "")
+    b = manager.add("李四", "", "", "")
+    project = manager.add_project(a["id"], "客廳")
+    manager.update_project(a["id"], project["id"], "主臥")
+    manager.update(b["id"], phone="0912")
+    manager.delete(b["id"])
+    assert snapshot(tmp_path) == []   # 只追加日誌，快照尚未改寫
+    assert len((tmp_path / "customers.json.journal").read_text(encoding="utf-8").splitlines()) == 6
+
+    reloaded = open_manager(tmp_path)
+    assert [c["name"] for c in reloaded.get_all()] == ["王小明"]
+    assert reloaded.get_projects(a["id"]) == [{"id": project["id"], "name": "主臥"}]
+
+    manager.compact()
+    assert not (tmp_path / "customers.json.journal").exists()
+    assert [c["name"] for c in snapshot(tmp_path)] == ["王小明"]
+    assert [c["name"] for c in open_manager(tmp_path).get_all()] == ["王小明"]
+
+
+def test_threshold_compacts_in_background(tmp_path):
+    manager = open_manager(tmp_path, compact_threshold=5)
+    for i in range(12):
+        manager.add(f"客戶{i}", "", "", "")
+    manager.close()
+    assert len(snapshot(tmp_path)) == 12
+    assert not (tmp_path / "customers.json.journal").exists()
+    assert not (tmp_path / "customers.json.journal.compacting").exists()
+
+
+def test_interrupted_compaction_and_torn_line_are_recovered(tmp_path):
+    manager = open_manager(tmp_path)
+    a = manager.add("王小明", "", "", "")
+    # 模擬壓縮途中當機：日誌已改名為 .compacting，之後又追加了新異動與寫到一半的一行
+    (tmp_path / "customers.json.journal").rename(tmp_path / "customers.json.journal.compacting")
+    manager = open_manager(tmp_path)
+    manager.add("李四", "", "", "")
+    with open(tmp_path / "customers.json.journal", "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "customer": {"id": "x", "na')
+
+    reloaded = open_manager(tmp_path)
+    assert [c["name"] for c in reloaded.get_all()] == ["王小明", "李四"]
+    reloaded.update(a["id"], name="王大明")   # 殘行已截掉，新紀錄不會接在後面
+    reloaded.compact()
+    assert [c["name"] for c in snapshot(tmp_path)] == ["王大明", "李四"]
+
+
+def test_other_instance_sees_appended_changes(tmp_path):
+    first, second = open_manager(tmp_path), open_manager(tmp_path)
+    cust = first.add("王小明", "", "", "")
+    assert second.refresh()
+    assert second.get_by_id(cust["id"])["name"] == "王小明"
+    second.add_project(cust["id"], "客廳")
+    assert first.refresh() and not first.refresh()
+    assert [p["name"] for p in first.get_projects(cust["id"])] == ["客廳"]
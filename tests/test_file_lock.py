@@ -0,0 +1,64 @@
+# tests/test_file_lock.py
+
+import threading
+import time
+
+import pytest
+
+from services.customer_manager import CustomerManager
+from services.file_lock import FileLock, file_stamp
+from services.sewing_price_manager import SewingPriceManager
+
+
+def test_lock_is_reentrant_and_exclusive(tmp_path):
+    path = str(tmp_path / "data.lock")
+    lock, other = FileLock(path), FileLock(path, timeout=0)
+    with lock:
+        with lock:
+            pass
+        # 另一個鎖物件（等同另一個程式）拿不到
+        with pytest.raises(TimeoutError):
+            other.acquire()
+    other.acquire()
+    other.release()
+
+
+def test_other_thread_waits_for_release(tmp_path):
+    lock = FileLock(str(tmp_path / "data.lock"))
+    order = []
+    lock.acquire()
+    thread = threading.Thread(target=lambda: (lock.acquire(), order.append("thread"), lock.release()))
+    thread.start()
+    time.sleep(0.05)
+    order.append("main")
+    lock.release()
+    thread.join(1)
+    assert order == ["main", "thread"]
+
+
+def test_file_stamp(tmp_path):
+    path = tmp_path / "a.json"
+    assert file_stamp(str(path)) is None
+    path.write_text("[]")
+    stamp = file_stamp(str(path))
+    path.write_text("[1]")
+    assert file_stamp(str(path)) != stamp
+
+
+def test_two_instances_do_not_overwrite_each_other(tmp_path):
+    first = CustomerManager(str(tmp_path / "customers.json"))
+    second = CustomerManager(str(tmp_path / "customers.json"))
+    a = first.add("王小明", "", "", "")
+    second.add("李四", "", "", "")
+    first.update(a["id"], phone="0912")
+    names = [c["name"] for c in CustomerManager(str(tmp_path / "customers.json")).get_all()]
+    assert names == ["王小明", "李四"]
+    assert second.refresh() and second.get_by_id(a["id"])["phone"] == "0912"
+
+    prices1 = SewingPriceManager(str(tmp_path / "sewing_prices.json"))
+    prices2 = SewingPriceManager(str(tmp_path / "sewing_prices.json"))
+    prices1.add("布A", "單開", 100)
+    prices2.add("布B", "單開", 200)
+    with pytest.raises(ValueError):
+        prices2.add("布A", "單開", 150)   # 存檔前已讀到另一個程式新增的單價
+    assert prices1.refresh() and prices1.get_price("布B", "單開") == 200
@@ -0,0 +1,68 @@
+# tests/test_history_binary.py
+
+import json
+
+import pytest
+
+from services.history_binary import (BINARY_EXTENSION, BinaryHistoryManager, convert_history_dir, dumps,
+                                     loads, write_binary)
+from services.history_manager import HistoryManager
+from services.pricing import ItemGroup, SewingItem, SubItem
+
+
+def groups():
+    return [
+        ItemGroup("A1", SewingItem("布A", "單開", 150.5, 200, 2.5, 350, 875, 3, "尺", 2.5),
+                  [SubItem("軌道「含安裝」", id="sub-1", quantity=1.5, unit_price=10.01, subtotal=15.02),
+                   SubItem("備註", id="sub-2")]),
+        ItemGroup("A2", SewingItem("布A", "雙開", 0, 0, 0, 0, 0)),
+        ItemGroup("退", SewingItem("布B", "單開", 100, 100, 1, -120.5, -120.5)),
+    ]
+
+
+def test_round_trip():
+    data = dumps(groups())
+    assert loads(data) == groups()
+    assert loads(bytearray(data)) == groups()
+    assert loads(dumps([])) == []
+
+
+def test_truncated_or_foreign_data_raises_value_error():
+    data = dumps(groups())
+    for cut in range(len(data)):
+        with pytest.raises(ValueError):
+            loads(data[:cut])
+    with pytest.raises(ValueError):
+        loads(b"[]" + data)
+
+
+def test_convert_history_dir_round_trip(tmp_path):
+    HistoryManager(str(tmp_path)).save_project_items("p1", groups())
+    keyed = tmp_path / "history_c1.json"
+    keyed.write_text(json.dumps({"p2": []}), encoding="utf-8")
+
+    assert convert_history_dir(str(tmp_path), to="binary") == (1, [])
+    assert not (tmp_path / "history_p1.json").exists() and keyed.exists()   # 舊版多案子檔案保持原樣
+    assert BinaryHistoryManager(str(tmp_path)).load_project_items("p1") == groups()
+
+    assert convert_history_dir(str(tmp_path), to="json") == (1, [])
+    assert not (tmp_path / f"history_p1{BINARY_EXTENSION}").exists()
+    assert HistoryManager(str(tmp_path)).load_project_items("p1") == groups()
+    with pytest.raises(ValueError):
+        convert_history_dir(str(tmp_path), to="xml")
+
+
+def test_manager_upgrades_json_on_save_and_reports_corrupt_file(tmp_path):
+    HistoryManager(str(tmp_path)).save_project_items("p1", groups())
+    manager = BinaryHistoryManager(str(tmp_path))
+    assert manager.history_path("p1").endswith(".json")
+    manager.save_project_items("p1", manager.load_project_items("p1")[:1])
+    assert manager.history_path("p1").endswith(BINARY_EXTENSION)
+    assert not (tmp_path / "history_p1.json").exists()
+
+    path = tmp_path / f"history_p2{BINARY_EXTENSION}"
+    write_binary(str(path), groups())
+    path.write_bytes(path.read_bytes()[:-7])
+    assert manager.load_project_items("p2") == []
+    assert "二進位" in str(manager.load_errors["p2"][0])
+    assert manager.load_project_items("p1") == groups()[:1]
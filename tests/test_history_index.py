@@ -0,0 +1,75 @@
+# tests/test_history_index.py
+
+import json
+import os
+
+import pytest
+
+from services.history_binary import BINARY_EXTENSION, BinaryHistoryManager
+from services.history_index import HistoryIndex
+from services.history_manager import HistoryManager
+from services.money import Money
+from services.pricing import ItemGroup, SewingItem, SubItem
+from services.sqlite_store import SQLiteStorage
+
+
+def group(item_number, price, fabric="布A", subs=()):
+    return ItemGroup(item_number, SewingItem(fabric, "單開", 150, 200, 2, price, price * 2),
+                     [SubItem(d, id=f"sub-{d}", quantity=1, unit_price=10, subtotal=10) for d in subs])
+
+
+@pytest.fixture
+def index(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "history_index.db"), schema="")
+    yield HistoryIndex(storage, str(tmp_path))
+    storage.close()
+
+
+def test_save_and_delete_update_index(tmp_path, index):
+    manager = HistoryManager(str(tmp_path), index=index)
+    manager.save_project_items("p1", [group("A", 100, subs=["軌道"]), group("B", 50, fabric="布B")])
+    summary = index.project_summary("p1")
+    assert (summary["group_count"], summary["sub_count"], summary["total"]) == (2, 1, Money.of(310))
+    # 存檔時已更新，同步不必再讀這個檔案
+    assert index.sync(processes=1) == (0, [])
+
+    customers = [{"id": "c1", "name": "王小明", "projects": [{"id": "p1", "name": "客廳"}]}]
+    [row] = index.totals_by_customer(customers)
+    assert (row["name"], row["projects"], row["total"]) == ("王小明", 1, Money.of(310))
+    assert [u["fabric"] for u in index.fabric_usage()] == ["布A", "布B"]
+
+    manager.delete_project_file("p1")
+    assert index.project_summary("p1") is None and index.fabric_usage() == []
+
+
+def test_sync_picks_up_external_changes(tmp_path, index):
+    HistoryManager(str(tmp_path)).save_project_items("p1", [group("A", 100)])
+    BinaryHistoryManager(str(tmp_path)).save_project_items("p2", [group("B", 100)])
+    (tmp_path / "history_c1.json").write_text(json.dumps({"客廳": []}), encoding="utf-8")
+    (tmp_path / f"history_bad{BINARY_EXTENSION}").write_bytes(b"not a table")
+
+    count, errors = index.sync(processes=1)
+    assert count == 4
+    assert [os.path.basename(path) for path, _ in errors] == [f"history_bad{BINARY_EXTENSION}"]
+    assert sorted(p["project_id"] for p in index.projects()) == ["p1", "p2"]
+
+    # 舊版多案子檔案記下戳記，之後不再重讀；損毀的檔案每次重試
+    assert index.sync(processes=1)[0] == 1
+
+    HistoryManager(str(tmp_path)).save_project_items("p1", [group("A", 100), group("C", 1)])
+    os.remove(tmp_path / f"history_p2{BINARY_EXTENSION}")
+    index.sync(processes=1)
+    assert index.project_summary("p1")["group_count"] == 2
+    assert index.project_summary("p2") is None
+
+
+def test_parallel_rebuild_matches_sequential(tmp_path, index, monkeypatch):
+    manager = HistoryManager(str(tmp_path))
+    for i in range(6):
+        manager.save_project_items(f"p{i}", [group(f"A{j}", 10 * (i + 1)) for j in range(i + 1)])
+    index.sync(processes=1)
+    sequential = sorted(index.projects(), key=lambda p: p["project_id"])
+    monkeypatch.setattr(HistoryIndex, "PARALLEL_MIN_FILES", 2)
+    assert index.rebuild(processes=2) == (6, [])
+    assert sorted(index.projects(), key=lambda p: p["project_id"]) == sequential
+    assert index.monthly_totals()[0][1:] == (6, Money.sum(p["total"] for p in sequential))
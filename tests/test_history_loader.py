@@ -0,0 +1,64 @@
+# tests/test_history_loader.py
+
+import io
+import json
+
+from services.history_loader import iter_history
+
+RECORD = {
+    "item_number": "A1",
+    "sewing_item": {"fabric": "布A", "type": "單開", "width": 150, "height": 200, "pieces": 2,
+                    "unit_price": 350, "subtotal": 700},
+    # 字串中的括號不能被當成值的結尾
+    "sub_items": [{"description": "軌道 [含]}", "id": "sub-1", "quantity": 1, "unit_price": 10, "subtotal": 10}],
+}
+
+
+class CountingReader(io.StringIO):
+    def __init__(self, text):
+        super().__init__(text)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+def history_text(count, broken=()):
+    good = json.dumps(RECORD, ensure_ascii=False)
+    bad = good.replace('"pieces": 2', '"pieces": x')
+    return "[" + ",".join(bad if i in broken else good for i in range(count)) + "]"
+
+
+def test_broken_record_is_skipped_without_reading_ahead():
+    f = CountingReader(history_text(2000, broken={1, 1500}))
+    records = iter_history(f, chunk_size=64)
+    first = [next(records) for _ in range(3)]
+    assert first[0].group is not None
+    assert first[1].error is not None and "JSON" in str(first[1].error)
+    assert first[2].group.item_number == "A1"
+    # 只讀到第 3 筆附近，不是整個檔案
+    assert f.reads < 20
+
+    rest = list(records)
+    assert len(first) + len(rest) == 2000
+    assert [r.index for r in first + rest if r.error] == [1, 1500]
+
+
+def test_truncated_file_reports_last_record():
+    text = history_text(10)
+    for cut in (len(text) - 5, len(text) // 2):
+        records = list(iter_history(io.StringIO(text[:cut]), chunk_size=16))
+        assert records[-1].error is not None and "不完整" in str(records[-1].error)
+        assert all(r.group is not None for r in records[:-1])
+
+
+def test_non_object_values_and_legacy_keys():
+    records = list(iter_history(io.StringIO('[1, x, {"item_number": "B"}]'), chunk_size=2))
+    assert [r.index for r in records] == [0, 1, 2]
+    assert all(r.error is not None for r in records)
+
+    legacy = json.dumps({"p1": [RECORD], "p2": [RECORD, RECORD]}, ensure_ascii=False)
+    records = list(iter_history(io.StringIO(legacy), chunk_size=8))
+    assert [(r.key, r.index) for r in records] == [("p1", 0), ("p2", 0), ("p2", 1)]
+    assert all(r.group is not None for r in records)
@@ -0,0 +1,88 @@
+# tests/test_history_store.py
+
+import json
+from dataclasses import asdict
+
+import pytest
+
+from services.history_manager import CustomEncoder, HistoryConflictError, HistoryManager
+from services.history_store import HistoryStore, migrate_history_files
+from services.money import Money
+from services.pricing import ItemGroup, SewingItem, SubItem
+from services.sqlite_store import SQLiteStorage
+
+
+def group(item_number, price, fabric="布A", subs=()):
+    return ItemGroup(item_number, SewingItem(fabric, "單開", 150, 200, 2, price, price * 2),
+                     [SubItem(d, id=f"sub-{d}", quantity=1, unit_price=10, subtotal=10) for d in subs])
+
+
+def open_store(tmp_path):
+    return HistoryStore(SQLiteStorage(str(tmp_path / "history.db"), schema=""))
+
+
+def test_round_trip_and_summaries(tmp_path):
+    store = open_store(tmp_path)
+    store.save_project_items("p1", [group("A", 100, subs=["軌道"]), group("B", 50, fabric="布B")])
+    store.save_project_items("p2", [group("C", 100)])
+
+    loaded = open_store(tmp_path).load_project_items("p1")
+    assert [(g.item_number, g.total) for g in loaded] == [("A", Money.of(210)), ("B", Money.of(100))]
+    assert loaded[0].sub_items[0].description == "軌道"
+
+    assert store.project_summary("p1")["total"] == Money.of(310)
+    assert store.project_summary("p1")["sub_count"] == 1
+    assert store.grand_total() == Money.of(510) and store.grand_total(["p2"]) == Money.of(200)
+    assert sorted(store.projects_using("布A")) == ["p1", "p2"]
+    assert store.find_item_number("B") == [("p1", 1)]
+    assert store.totals_by_fabric()[0]["projects"] == 2
+
+    store.delete_project_file("p1")
+    assert not store.has_project("p1") and store.load_project_items("p1") == []
+    assert store.find_item_number("B") == []
+
+
+def test_conflicting_save_is_rejected(tmp_path):
+    first, second = open_store(tmp_path), open_store(tmp_path)
+    first.save_project_items("p1", [group("A", 100)])
+    first.load_project_items("p1")
+    second.load_project_items("p1")
+    second.save_project_items("p1", [group("A", 120)])
+
+    assert first.is_stale("p1")
+    with pytest.raises(HistoryConflictError):
+        first.save_project_items("p1", [group("A", 110)])
+    # 衝突時交易回滾，對方的內容不受影響
+    assert first.load_project_items("p1")[0].sewing_item.unit_price == 120
+    second.save_project_items("p2", [group("B", 1)])
+    assert not first.is_stale("p1")   # 其他案子的異動不算
+    first.save_project_items("p1", [group("A", 130)], force=True)
+    assert first.load_project_items("p1")[0].sewing_item.unit_price == 130
+
+
+def test_migrate_history_files(tmp_path):
+    HistoryManager(str(tmp_path)).save_project_items("p1", [group("A", 100)])
+    legacy = {"客廳": [asdict(group("B", 200))], "p1": [asdict(group("X", 1))], "舊案": [asdict(group("C", 300))]}
+    (tmp_path / "history_c1.json").write_text(json.dumps(legacy, cls=CustomEncoder, ensure_ascii=False),
+                                              encoding="utf-8")
+    (tmp_path / "history_broken.json").write_text('[{"item_number": "D"}]', encoding="utf-8")
+    customers = [{"id": "c1", "projects": [{"id": "p1", "name": "主臥"}, {"id": "p2", "name": "客廳"}]}]
+
+    store = open_store(tmp_path)
+    stats, skipped = migrate_history_files(str(tmp_path), store, customers)
+    assert (stats["legacy"], stats["orphans"], stats["kept"]) == (2, 1, 0)
+    assert [g.item_number for g in store.load_project_items("p1")] == ["A"]   # 以獨立檔案為準
+    assert [g.item_number for g in store.load_project_items("p2")] == ["B"]
+    assert [g.item_number for g in store.load_project_items("c1/舊案")] == ["C"]
+    assert store.has_project("broken") and store.load_project_items("broken") == []
+    assert {path for path, _ in skipped} == {str(tmp_path / "history_broken.json"),
+                                             str(tmp_path / "history_c1.json") + "[p1]"}
+
+    # 重跑時保留資料庫中已有（可能較新）的紀錄，overwrite 才以檔案取代
+    store.save_project_items("p2", [group("B", 250)])
+    stats, _ = migrate_history_files(str(tmp_path), store, customers)
+    assert stats["kept"] == 4 and stats["projects"] == 0
+    assert store.load_project_items("p2")[0].sewing_item.unit_price == 250
+    stats, _ = migrate_history_files(str(tmp_path), store, customers, overwrite=True)
+    assert stats["projects"] == 4
+    assert store.load_project_items("p2")[0].sewing_item.unit_price == 200
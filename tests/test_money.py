@@ -0,0 +1,39 @@
+# tests/test_money.py
+
+from decimal import Decimal
+
+from services.money import Money
+from services.pricing_rules import PricingRules
+
+
+def test_float_compares_exactly_and_hashes_consistently():
+    # 0.1 的二進位值不是剛好 0.10 元
+    assert Money(10) != 0.1
+    assert Money(10) < 0.1
+    assert Money(50) == 0.5 and hash(Money(50)) == hash(0.5)
+    assert Money.of(0.1) == Money(10)
+    assert Money.of(0.1 + 0.2) == Money.of(0.3)
+    # 相等時雜湊相同，可混用作為 dict／set 的鍵
+    assert {Money(150): "a"}[1.5] == "a"
+    assert 0.005 != 0.01 and Money(1) != 0.005 and Money(1) != 0.01
+
+
+def test_int_and_decimal_compare_exactly():
+    assert Money(100) == 1 and hash(Money(100)) == hash(1)
+    assert Money(10) == Decimal("0.1") and hash(Money(10)) == hash(Decimal("0.1"))
+    assert Money(10) != Decimal("0.104")
+    assert Money(10) < Decimal("0.101")
+    assert sorted([Money(5), 0.04, 1]) == [0.04, Money(5), 1]
+
+
+def test_non_finite_floats():
+    assert Money(10) < float("inf")
+    assert Money(10) > float("-inf")
+    assert Money(10) != float("nan")
+
+
+def test_discount_threshold_is_compared_in_cents():
+    rules = PricingRules(volume_discounts=[{"min_subtotal": 999.99, "rate": 0.1}]).compile()
+    assert rules.discount_rate(Money.of(999.99)) == 0.1
+    assert rules.discount_rate(999.99) == 0.1
+    assert rules.discount_rate(Money.of(999.98)) == 0.0
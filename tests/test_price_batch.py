@@ -0,0 +1,90 @@
+# tests/test_price_batch.py
+
+import random
+
+import pytest
+
+from services.pricing import PriceNotFoundError, PricingEngine
+from services.pricing_cache import PricingCache
+from services.sewing_price_manager import SewingPriceManager
+
+
+class CountingPrices(SewingPriceManager):
+    """記錄 get_price 被呼叫的次數"""
+
+    def __init__(self, data_path):
+        super().__init__(data_path)
+        self.lookups = 0
+
+    def get_price(self, fabric, type):
+        self.lookups += 1
+        return super().get_price(fabric, type)
+
+
+@pytest.fixture
+def prices(tmp_path):
+    p = CountingPrices(str(tmp_path / "sewing_prices.json"))
+    p.add("布A", "單開", 350)
+    p.add("布A", "雙開", 0)
+    p.add("布B", "單開", 12.34)
+    return p
+
+
+def columns(rows):
+    return [list(column) for column in zip(*rows)]
+
+
+def random_rows(count, seed=1):
+    rng = random.Random(seed)
+    return [(rng.choice(["布A", "布B", "布C"]), rng.choice(["單開", "雙開"]),
+             rng.choice([0, 90, 150.5, 333]), rng.choice([0, 200, 180.25]), rng.choice([0, 1, 2, 2.5, 3]))
+            for _ in range(count)]
+
+
+def test_batch_matches_single_rows_and_reports_missing(prices):
+    engine = PricingEngine({}, prices)
+    rows = random_rows(300)
+    result = engine.price_batch(*columns(rows))
+    for row, (f, t, w, h, n) in enumerate(rows):
+        if row in result.errors:
+            assert result.subtotal_cents[row] is None
+            assert isinstance(result.errors[row], PriceNotFoundError)
+            with pytest.raises(PriceNotFoundError):
+                engine.create_sewing_item(f, t, w, h, n)
+        else:
+            assert engine.create_sewing_item(f, t, w, h, n).subtotal.cents == result.subtotal_cents[row]
+    assert set(result.errors) == {row for row, r in enumerate(rows) if r[0] == "布C" or r[:2] == ("布B", "雙開")}
+
+
+def test_numpy_and_python_paths_agree(prices):
+    pytest.importorskip("numpy")
+    engine = PricingEngine({}, prices)
+    rows = columns(random_rows(500, seed=2))
+    fast, slow = engine.price_batch(*rows, use_numpy=True), engine.price_batch(*rows, use_numpy=False)
+    assert fast.subtotal_cents == slow.subtotal_cents
+    assert fast.unit_price_cents == slow.unit_price_cents
+    assert set(fast.errors) == set(slow.errors)
+
+
+def test_each_key_is_looked_up_once(prices):
+    engine = PricingEngine({}, prices)
+    prices.lookups = 0
+    engine.price_batch(*columns(random_rows(1000)))
+    assert prices.lookups == 6
+
+
+def test_cache_is_invalidated_by_price_changes(prices):
+    engine = PricingEngine({}, prices, cache=PricingCache())
+    rows = columns([("布A", "單開", 150, 200, 2)] * 3)
+    first = engine.price_batch(*rows)
+    prices.lookups = 0
+    assert engine.price_batch(*rows) == first
+    assert prices.lookups == 0
+    prices.update(prices.get_all()[0]["id"], unit_price=400)
+    assert engine.price_batch(*rows).unit_price_cents == [40000] * 3
+
+
+def test_columns_must_have_same_length(prices):
+    with pytest.raises(ValueError):
+        PricingEngine({}, prices).price_batch(["布A"], ["單開"], [150], [200], [])
+    assert PricingEngine({}, prices).price_batch([], [], [], [], []).errors == {}
@@ -0,0 +1,62 @@
+# tests/test_price_catalog.py
+
+from datetime import date
+
+from services.price_catalog import PriceCatalog
+from services.pricing import PricingEngine
+from services.sewing_price_manager import SewingPriceManager
+
+
+def rec(fabric, type, price):
+    return {"fabric": fabric, "type": type, "unit_price": price}
+
+
+def test_versions_snapshots_and_effective_dates(tmp_path):
+    catalog = PriceCatalog(str(tmp_path / "price_catalog.jsonl"))
+    assert catalog.current_version is None and catalog.snapshot().get_price("布A", "單開") is None
+    assert catalog.publish([rec("布A", "單開", 100), rec("布B", "單開", 0)], "2026-01-01") == 1
+    assert catalog.publish([rec("布A", "單開", 100), rec("布B", "單開", 0)]) == 1   # 沒有變更不建立版本
+    assert catalog.publish([rec("布A", "單開", 120)], "2026-03-01", note="漲價") == 2
+
+    v1, v2 = catalog.snapshot(1), catalog.snapshot()
+    assert (v1.get_price("布A", "單開"), v2.get_price("布A", "單開")) == (100, 120)
+    assert v1.get_price("布B", "單開") == 0 and v2.get_price("布B", "單開") is None
+    assert dict(v2.items()) == {("布A", "單開"): 120}
+    assert catalog.snapshot_at("2026-02-15").version == 1
+    assert catalog.snapshot_at(date(2026, 3, 1)).version == 2
+    assert catalog.snapshot_at("2025-12-31").get_price("布A", "單開") is None
+
+    # 只有完整的行才算一個版本
+    with open(tmp_path / "price_catalog.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"version": 3, "se')
+    reloaded = PriceCatalog(str(tmp_path / "price_catalog.jsonl"))
+    assert [v["version"] for v in reloaded.versions] == [1, 2]
+    assert reloaded.versions[1]["note"] == "漲價"
+    assert reloaded.publish([rec("布A", "單開", 130)]) == 3
+    assert PriceCatalog(str(tmp_path / "price_catalog.jsonl")).snapshot().get_price("布A", "單開") == 130
+
+
+def test_other_instance_publish_is_picked_up(tmp_path):
+    first = PriceCatalog(str(tmp_path / "price_catalog.jsonl"))
+    second = PriceCatalog(str(tmp_path / "price_catalog.jsonl"))
+    first.publish([rec("布A", "單開", 100)])
+    assert second.refresh() and not second.refresh()
+    # 以最新版計算差異，不會重複發布或蓋掉對方的版本
+    assert second.publish([rec("布A", "單開", 100), rec("布C", "單開", 5)]) == 2
+    assert first.publish([rec("布A", "單開", 100), rec("布C", "單開", 5)]) == 2
+
+
+def test_reprice_old_quote_with_snapshot(tmp_path):
+    prices = SewingPriceManager(str(tmp_path / "sewing_prices.json"))
+    prices.add("布A", "單開", 100)
+    catalog = PriceCatalog(str(tmp_path / "price_catalog.jsonl"))
+    catalog.publish(prices.get_all())
+    engine = PricingEngine({}, prices, catalog=catalog)
+    item = engine.create_sewing_item("布A", "單開", 150, 200, 2)
+    assert item.catalog_version == 1
+
+    prices.update(prices.get_all()[0]["id"], unit_price=150)
+    catalog.publish(prices.get_all())
+    old = engine.create_sewing_item("布A", "單開", 150, 200, 2, snapshot=catalog.snapshot(item.catalog_version))
+    assert old.subtotal == item.subtotal and old.catalog_version == 1
+    assert engine.create_sewing_item("布A", "單開", 150, 200, 2).catalog_version == 2
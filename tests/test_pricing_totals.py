@@ -0,0 +1,154 @@
+# tests/test_pricing_totals.py
+
+import random
+
+import pytest
+
+from services.money import Money
+from services.pricing import ItemGroup, Quote, SewingItem, SubItem
+from services.pricing_rules import PricingRules
+
+RULES = PricingRules(volume_discounts=[{"min_subtotal": 5000, "rate": 0.05}], tax_rate=0.05).compile()
+
+
+@pytest.fixture(autouse=True)
+def check_invariants(monkeypatch):
+    """每次讀取或異動合計時都與重新計算的結果比對"""
+    monkeypatch.setattr(ItemGroup, "CHECK_INVARIANTS", True)
+    monkeypatch.setattr(Quote, "CHECK_INVARIANTS", True)
+
+
+def sewing(subtotal, pieces=2):
+    return SewingItem("布A", "單開", 150, 200, pieces, subtotal / pieces, subtotal)
+
+
+def sub(description, quantity, unit_price):
+    return SubItem(description, quantity=quantity, unit_price=unit_price, subtotal=Money.of(unit_price) * quantity)
+
+
+def recompute(quote):
+    """不經累計值，從各項目的小計重新加總"""
+    return Money.sum(Money.sum([g.sewing_item.subtotal] + [s.subtotal for s in g.sub_items]) for g in quote)
+
+
+def assert_totals(quote):
+    expected = recompute(quote)
+    assert quote.subtotal == expected
+    assert quote.totals == RULES.totals(expected)
+
+
+def test_sub_item_changes_update_group_and_quote():
+    group = ItemGroup("A1", sewing(1200), [sub("軌道", 1, 350)])
+    quote = Quote([group], RULES)
+    assert group.total == Money(155000)
+
+    hook = sub("掛勾", 12, 2.5)
+    group.add_sub_item(hook)
+    assert_totals(quote)
+
+    group.update_sub_item(hook.id, quantity=20)
+    assert group.total == Money.of(1200 + 350 + 50)
+    group.update_sub_item(hook.id, unit_price=3.35)
+    assert group.total == Money.of(1200 + 350 + 67)
+    group.update_sub_item(hook.id, subtotal=10)
+    assert_totals(quote)
+
+    assert group.remove_sub_item(hook.id).subtotal == Money.of(10)
+    assert group.remove_sub_item("sub-missing") is None
+    assert_totals(quote)
+
+
+def test_update_sub_item_recomputes_subtotal():
+    group = ItemGroup("A1", sewing(0), [])
+    item = sub("布帶", 3, 10)
+    group.add_sub_item(item)
+    updated = group.update_sub_item(item.id, quantity=4, unit_price=12.5)
+    assert updated.subtotal == Money.of(50)
+    assert group.total == Money.of(50)
+    with pytest.raises(KeyError):
+        group.update_sub_item("sub-missing", quantity=1)
+
+
+def test_setattr_sewing_item_and_sub_items():
+    group = ItemGroup("A1", sewing(1000), [sub("軌道", 2, 300)])
+    quote = Quote([group], RULES)
+
+    group.sewing_item = sewing(4800, pieces=4)
+    assert group.total == Money.of(5400)
+    assert_totals(quote)
+    assert quote.totals.discount == Money.of(270)
+
+    group.sub_items = [sub("掛勾", 10, 3), sub("布帶", 1, 99.5)]
+    assert group.total == Money.of(4800 + 30 + 99.5)
+    assert_totals(quote)
+
+
+def test_quote_add_remove_and_clear():
+    groups = [ItemGroup(f"A{i}", sewing(100 * i), [sub("軌道", i, 10)]) for i in range(1, 6)]
+    quote = Quote(groups[:3], RULES)
+    quote.add_group(groups[3])
+    assert_totals(quote)
+
+    with pytest.raises(ValueError):
+        quote.add_group(ItemGroup("A1", sewing(1)))
+    with pytest.raises(ValueError):
+        Quote([groups[0]])   # 已屬於其他報價
+
+    removed = quote.remove_group("A2")
+    assert removed is groups[1] and "A2" not in quote
+    assert_totals(quote)
+    # 移出報價後的異動不再影響原報價
+    removed.add_sub_item(sub("掛勾", 1, 1000))
+    assert_totals(quote)
+
+    quote.clear()
+    assert len(quote) == 0 and quote.subtotal == Money(0)
+    assert quote.totals == RULES.totals(0)
+
+
+def test_random_mutations_match_full_recompute():
+    rng = random.Random(14)
+    quote = Quote(rules=RULES)
+    for i in range(30):
+        quote.add_group(ItemGroup(f"B{i}", sewing(rng.randint(0, 3000))))
+
+    for _ in range(500):
+        group = quote.get(f"B{rng.randrange(30)}")
+        action = rng.randrange(5)
+        if action == 0 or not group.sub_items:
+            group.add_sub_item(sub("項目", rng.randint(1, 20), rng.randint(0, 9999) / 100))
+        elif action == 1:
+            group.remove_sub_item(rng.choice(group.sub_items).id)
+        elif action == 2:
+            group.update_sub_item(rng.choice(group.sub_items).id, quantity=rng.randint(0, 50))
+        elif action == 3:
+            group.update_sub_item(rng.choice(group.sub_items).id, unit_price=rng.randint(0, 9999) / 100)
+        else:
+            group.sewing_item = sewing(rng.randint(0, 3000), pieces=rng.randint(1, 6))
+        assert_totals(quote)
+
+
+def test_direct_mutation_is_caught_until_invalidate():
+    item = sub("軌道", 1, 350)
+    group = ItemGroup("A1", sewing(1200), [item])
+    quote = Quote([group], RULES)
+
+    item.subtotal = Money.of(500)   # 繞過 update_sub_item，累計值未更新
+    with pytest.raises(AssertionError):
+        group.total
+    with pytest.raises(AssertionError):
+        quote.subtotal
+
+    group.invalidate()
+    assert group.total == Money.of(1700)
+    assert_totals(quote)
+
+
+def test_check_mode_off_keeps_cached_total(monkeypatch):
+    monkeypatch.setattr(ItemGroup, "CHECK_INVARIANTS", False)
+    item = sub("軌道", 1, 350)
+    group = ItemGroup("A1", sewing(1200), [item])
+    item.subtotal = Money.of(500)
+    assert group.total == Money.of(1550)
+    with pytest.raises(AssertionError):
+        group.check_invariants()
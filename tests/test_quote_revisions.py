@@ -0,0 +1,112 @@
+# tests/test_quote_revisions.py
+
+import random
+
+import pytest
+
+from services.pricing import ItemGroup, SewingItem, SubItem
+from services.quote_revisions import QuoteRevisions
+
+
+def group(item_number, price, subs=()):
+    return ItemGroup(item_number, SewingItem("布A", "單開", 150, 200, 2, price, price * 2),
+                     [SubItem(d, id=f"sub-{d}", quantity=1, unit_price=10, subtotal=10) for d in subs])
+
+
+def prices(groups):
+    return [(g.item_number, g.sewing_item.unit_price) for g in groups]
+
+
+def corrupt_line(path, revision):
+    lines = path.read_bytes().split(b"\n")
+    lines[revision - 1] = b'{"broken'
+    path.write_bytes(b"\n".join(lines))
+
+
+def test_random_history_round_trips_after_reload(tmp_path):
+    rng = random.Random(3)
+    revs = QuoteRevisions(str(tmp_path), checkpoint_interval=4)
+    expected = {}
+    groups = []
+    for _ in range(40):
+        action = rng.random()
+        if action < 0.4 or not groups:
+            groups.append(group(f"N{rng.randrange(1000)}", rng.randrange(1, 500)))
+        elif action < 0.6:
+            groups.pop(rng.randrange(len(groups)))
+        elif action < 0.8:
+            i = rng.randrange(len(groups))
+            groups[i] = group(groups[i].item_number, rng.randrange(1, 500), subs=["軌道"])
+        else:
+            rng.shuffle(groups)
+        groups = list({g.item_number: g for g in groups}.values())
+        revision = revs.commit("p", groups)
+        if revision is not None:
+            expected[revision] = prices(groups)
+
+    reloaded = QuoteRevisions(str(tmp_path), checkpoint_interval=4)
+    assert reloaded.latest("p") == len(expected)
+    for revision, want in expected.items():
+        assert prices(reloaded.checkout("p", revision)) == want
+    assert sum(i.checkpoint for i in reloaded.revisions("p")) == (len(expected) + 3) // 4
+
+
+def test_commit_skips_identical_and_diff_reports_changes(tmp_path):
+    revs = QuoteRevisions(str(tmp_path))
+    assert revs.checkout("p") == []
+    assert revs.commit("p", [group("A", 100), group("B", 50)], note="初版") == 1
+    assert revs.commit("p", [group("A", 100), group("B", 50)]) is None
+    assert revs.commit("p", [group("B", 50), group("A", 120, subs=["軌道"]), group("C", 1)]) == 2
+
+    diff = revs.diff("p", 1, 2)
+    assert diff.added == ["C"] and diff.removed == [] and diff.reordered
+    [change] = diff.changed
+    assert change.item_number == "A" and change.sewing["unit_price"] == (100, 120)
+    assert [sub["description"] for sub in change.sub_added] == ["軌道"]
+    assert diff.total_delta == 2 * 20 + 10 + 2 * 1
+    assert not revs.diff("p", 2, 2)
+    assert revs.revisions("p")[0].note == "初版"
+    with pytest.raises(KeyError):
+        revs.checkout("p", 3)
+
+    revs.delete("p")
+    assert revs.latest("p") == 0
+
+
+def test_other_instance_appends_and_partial_line(tmp_path):
+    first, second = QuoteRevisions(str(tmp_path)), QuoteRevisions(str(tmp_path))
+    first.commit("p", [group("A", 100)])
+    assert second.latest("p") == 1
+    second.commit("p", [group("A", 101)])
+    assert prices(first.checkout("p")) == [("A", 101)]
+
+    # 當機留下寫到一半的版本：讀取時不算數，下次存檔時截掉
+    with open(tmp_path / "p.jsonl", "ab") as f:
+        f.write(b'{"revision": 3, "gro')
+    assert QuoteRevisions(str(tmp_path)).latest("p") == 2
+    assert first.commit("p", [group("A", 102)]) == 3
+    assert prices(QuoteRevisions(str(tmp_path)).checkout("p")) == [("A", 102)]
+
+
+def test_corrupt_base_falls_back_to_snapshot_after_reload(tmp_path):
+    revs = QuoteRevisions(str(tmp_path), checkpoint_interval=8)
+    assert revs.commit("p", [group("A", 100)]) == 1
+    assert revs.commit("p", [group("A", 101)]) == 2
+    corrupt_line(tmp_path / "p.jsonl", 1)
+
+    revs = QuoteRevisions(str(tmp_path), checkpoint_interval=8)
+    assert revs.errors("p")[0][0] == 1
+    # 版本 3 的基準（版本 2 → 版本 1）無法還原，改存完整快照
+    assert revs.commit("p", [group("A", 103)]) == 3
+    assert revs.commit("p", [group("A", 104), group("B", 5)]) == 4
+
+    reloaded = QuoteRevisions(str(tmp_path), checkpoint_interval=8)
+    assert [i.revision for i in reloaded.revisions("p")] == [2, 3, 4]
+    assert prices(reloaded.checkout("p", 3)) == [("A", 103)]
+    assert prices(reloaded.checkout("p", 4)) == [("A", 104), ("B", 5)]
+    assert prices(reloaded.checkout("p")) == [("A", 104), ("B", 5)]
+    with pytest.raises(KeyError):
+        reloaded.checkout("p", 1)
+    with pytest.raises(KeyError):
+        reloaded.checkout("p", 2)   # 差異的基準是損毀的版本 1
+    assert reloaded.diff("p", 3, 4).added == ["B"]
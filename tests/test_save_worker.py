@@ -0,0 +1,130 @@
+# tests/test_save_worker.py
+
+import threading
+import time
+
+import pytest
+
+from services.save_worker import SaveWorker
+
+DELAY = 0.05
+MAX_DELAY = 0.2
+
+
+@pytest.fixture
+def worker():
+    w = SaveWorker(delay=DELAY, max_delay=MAX_DELAY)
+    yield w
+    w.stop()
+
+
+class Recorder:
+    """記錄每次存檔的 (key, 值, 執行緒)"""
+
+    def __init__(self):
+        self.calls = []
+        self.done = threading.Event()
+
+    def save(self, key, value):
+        def func():
+            self.calls.append((key, value, threading.current_thread()))
+            self.done.set()
+        return func
+
+
+def test_debounce_writes_last_func_once(worker):
+    rec = Recorder()
+    for i in range(5):
+        worker.schedule("a", rec.save("a", i))
+    assert worker.is_pending("a")
+    assert rec.done.wait(1)
+    time.sleep(DELAY * 2)
+    assert [(k, v) for k, v, _ in rec.calls] == [("a", 4)]
+    assert rec.calls[0][2] is not threading.current_thread()
+    assert not worker.is_pending("a")
+
+
+def test_keys_are_independent(worker):
+    rec = Recorder()
+    worker.schedule("a", rec.save("a", 1))
+    worker.schedule("b", rec.save("b", 2))
+    time.sleep(DELAY * 4)
+    assert sorted((k, v) for k, v, _ in rec.calls) == [("a", 1), ("b", 2)]
+
+
+def test_max_delay_bounds_postponement(worker):
+    rec = Recorder()
+    start = time.monotonic()
+    # 每次都在 delay 到期前重新排定，只有 max_delay 能讓它寫出
+    while not rec.done.is_set() and time.monotonic() - start < MAX_DELAY * 5:
+        worker.schedule("a", rec.save("a", time.monotonic()))
+        time.sleep(DELAY / 5)
+    assert rec.done.is_set()
+    assert time.monotonic() - start < MAX_DELAY * 3
+
+
+def test_flush_runs_in_caller_thread(worker):
+    rec = Recorder()
+    worker.schedule("a", rec.save("a", 1), delay=10)
+    worker.schedule("b", rec.save("b", 2), delay=10)
+    worker.flush("a")
+    assert [(k, v) for k, v, _ in rec.calls] == [("a", 1)]
+    assert rec.calls[0][2] is threading.current_thread()
+    assert not worker.is_pending("a") and worker.is_pending("b")
+    worker.flush()
+    assert [k for k, _, _ in rec.calls] == ["a", "b"]
+    worker.flush()   # 沒有待寫的工作
+    assert len(rec.calls) == 2
+
+
+def test_flush_waits_for_running_save(worker):
+    started, release = threading.Event(), threading.Event()
+    finished = []
+
+    def slow():
+        started.set()
+        release.wait(1)
+        finished.append(True)
+
+    worker.schedule("a", slow, delay=0)
+    assert started.wait(1)
+    threading.Timer(DELAY, release.set).start()
+    worker.flush("a")
+    assert finished == [True]
+
+
+def test_cancel_drops_pending_save(worker):
+    rec = Recorder()
+    worker.schedule("a", rec.save("a", 1))
+    worker.cancel("a")
+    assert not worker.is_pending("a")
+    time.sleep(DELAY * 3)
+    assert rec.calls == []
+
+
+def test_stop_flushes_and_later_saves_run_inline():
+    worker = SaveWorker(delay=10, max_delay=10)
+    rec = Recorder()
+    worker.schedule("a", rec.save("a", 1))
+    worker.stop()
+    assert [(k, v) for k, v, _ in rec.calls] == [("a", 1)]
+    assert not worker._thread.is_alive()
+
+    worker.schedule("b", rec.save("b", 2))
+    assert rec.calls[-1][:2] == ("b", 2)
+    assert rec.calls[-1][2] is threading.current_thread()
+    worker.stop()   # 重複呼叫不會出錯
+    assert len(rec.calls) == 2
+
+
+def test_errors_go_to_on_error():
+    errors = []
+    worker = SaveWorker(delay=DELAY, max_delay=MAX_DELAY, on_error=lambda key, e: errors.append((key, e)))
+
+    def broken():
+        raise OSError("disk full")
+
+    worker.schedule("a", broken)
+    worker.flush()
+    worker.stop()
+    assert len(errors) == 1 and errors[0][0] == "a" and isinstance(errors[0][1], OSError)
@@ -0,0 +1,54 @@
+# tests/test_scenarios.py
+
+from services.money import Money
+from services.pricing import ItemGroup, PricingEngine, SubItem
+from services.scenarios import Scenario, ScenarioEngine
+from services.sewing_price_manager import SewingPriceManager
+
+
+def make_engine(tmp_path):
+    prices = SewingPriceManager(str(tmp_path / "sewing_prices.json"))
+    prices.add("布A", "單開", 100)
+    prices.add("布B", "單開", 150)
+    return prices, PricingEngine({"tax_rate": 0.05}, prices)
+
+
+def make_groups(engine):
+    return [
+        ItemGroup("A1", engine.create_sewing_item("布A", "單開", 150, 200, 2),
+                  [SubItem("軌道", quantity=1, unit_price=30, subtotal=30)]),
+        ItemGroup("A2", engine.create_sewing_item("布B", "單開", 120, 180, 1)),
+    ]
+
+
+def test_baseline_uses_stored_totals_after_price_change(tmp_path):
+    prices, engine = make_engine(tmp_path)
+    groups = make_groups(engine)
+    stored = Money.sum(g.total for g in groups)
+    # 報價建立後單價表漲價，原方案仍是客戶看到的金額
+    prices.update(prices.get_all()[0]["id"], unit_price=200)
+    prices.update(prices.get_all()[1]["id"], unit_price=300)
+
+    scenarios = ScenarioEngine(engine)
+    base, swap = scenarios.evaluate(groups, [Scenario("換布", fabric={"布A": "布B"})])
+    assert base.totals == engine.rules.totals(stored)
+    assert base.group_totals == {g.item_number: g.total for g in groups}
+    assert base.delta == Money()
+
+    # 只有被替換的 A1 以今天的單價計算，A2 沿用保存的小計
+    repriced = engine.create_sewing_item("布B", "單開", 150, 200, 2).subtotal + Money.of(30)
+    assert swap.group_totals == {"A1": repriced, "A2": groups[1].total}
+    assert swap.delta == swap.totals.total - base.totals.total
+
+    applied = scenarios.apply(groups, Scenario("換布", fabric={"布A": "布B"}))
+    assert applied[1].sewing_item is groups[1].sewing_item
+    assert [g.total for g in applied] == [repriced, groups[1].total]
+
+
+def test_missing_price_is_reported_per_item(tmp_path):
+    _, engine = make_engine(tmp_path)
+    groups = make_groups(engine)
+    base, missing = ScenarioEngine(engine).evaluate(groups, [Scenario("換形式", type="蛇形", item_numbers=frozenset({"A2"}))])
+    assert base.errors == {}
+    assert list(missing.errors) == ["A2"]
+    assert missing.group_totals == {"A1": groups[0].total}
@@ -0,0 +1,50 @@
+# tests/test_search_index.py
+
+from services.customer_manager import CustomerManager
+from services.search_index import CustomerSearchIndex
+
+
+def cust(cust_id, name, phone="", address=""):
+    return {"id": cust_id, "name": name, "phone": phone, "address": address}
+
+
+def test_prefix_then_substring_order():
+    index = CustomerSearchIndex([
+        cust("1", "大明窗簾", address="台北市王府路"),
+        cust("2", "王小明", "0912-345-678"),
+        cust("3", "王大同"),
+        cust("4", "陳小華", address="新北市"),
+    ])
+    assert index.search("王") == ["3", "2"]   # 單字查詢不比對地址
+    assert index.search("王府") == ["1"]
+    assert sorted(index.search("明")) == ["1", "2"]
+    assert sorted(index.search("小")) == ["2", "4"]
+    assert index.search("ＷＡＮＧ") == []
+    assert index.search("345678") == ["2"]
+    assert index.search("0912 345") == ["2"]
+    assert index.search("新北") == ["4"]
+    assert index.search("王", limit=1) == ["3"]
+    assert index.search("  ") == []
+
+
+def test_add_update_and_remove():
+    index = CustomerSearchIndex([cust("1", "王小明")])
+    index.add(cust("2", "Wang Da"))
+    assert index.search("wangda") == ["2"]   # 不分大小寫、忽略空白
+    index.add(cust("1", "李小明"))
+    assert index.search("王") == []
+    assert index.search("李") == ["1"]
+    index.remove("1")
+    index.remove("1")   # 重複移除不會出錯
+    assert index.search("小明") == [] and len(index) == 1
+
+
+def test_customer_manager_search_follows_changes(tmp_path):
+    manager = CustomerManager(str(tmp_path / "customers.json"))
+    a = manager.add("王小明", "0912345678", "台北市", "")
+    manager.add("王大同", "", "", "")
+    assert [c["name"] for c in manager.search("王")] == ["王大同", "王小明"]
+    manager.update(a["id"], name="林小明")
+    assert [c["name"] for c in manager.search("小明")] == ["林小明"]
+    manager.delete(a["id"])
+    assert manager.search("345678") == []
@@ -0,0 +1,83 @@
+# tests/test_sewing_price_manager.py
+
+import json
+import sqlite3
+
+import pytest
+
+from services.sewing_price_manager import SewingPriceManager
+from services.sqlite_store import SQLiteSewingPriceManager, SQLiteStorage
+
+
+def write_prices(path, records):
+    path.write_text(json.dumps(records, ensure_ascii=False), encoding="utf-8")
+
+
+def test_lookup_index_follows_changes(tmp_path):
+    prices = SewingPriceManager(str(tmp_path / "sewing_prices.json"))
+    a = prices.add("布B", "雙開", 300)
+    prices.add("布A", "單開", 0)
+    prices.add("布B", "單開", 250)
+    assert prices.get_price("布A", "單開") == 0
+    assert prices.get_price("布A", "雙開") is None
+    assert prices.get_fabrics() == ["布A", "布B"]
+    assert prices.get_types("布B") == ["單開", "雙開"]
+
+    with pytest.raises(ValueError):
+        prices.add("布B", "雙開", 1)
+    with pytest.raises(ValueError):
+        prices.update(a["id"], type="單開")
+    revision = prices.revision
+    prices.update(a["id"], fabric="布C")
+    assert prices.revision > revision
+    assert prices.get_price("布B", "雙開") is None and prices.get_price("布C", "雙開") == 300
+    assert prices.get_types("布B") == ["單開"] and prices.get_fabrics() == ["布A", "布B", "布C"]
+    prices.delete(a["id"])
+    assert prices.get_fabrics() == ["布A", "布B"]
+
+    reloaded = SewingPriceManager(str(tmp_path / "sewing_prices.json"))
+    assert reloaded.get_price("布B", "單開") == 250 and reloaded.get_by_id(a["id"]) is None
+
+
+def test_legacy_duplicate_keys_use_first_record(tmp_path):
+    path = tmp_path / "sewing_prices.json"
+    write_prices(path, [
+        {"id": "1", "fabric": "布A", "type": "單開", "unit_price": 100},
+        {"id": "2", "fabric": "布A", "type": "單開", "unit_price": 200},
+    ])
+    prices = SewingPriceManager(str(path))
+    assert prices.get_price("布A", "單開") == 100
+    prices.update("2", unit_price=210)   # 重複鍵仍可單獨改單價
+    prices.delete("1")
+    assert prices.get_price("布A", "單開") == 210
+    prices.delete("2")
+    assert prices.get_price("布A", "單開") is None and prices.get_fabrics() == []
+
+
+def test_sqlite_duplicates_removed_once(tmp_path):
+    db = str(tmp_path / "curtain.db")
+    # 升級前的資料庫：沒有唯一索引、user_version 為 0
+    conn = sqlite3.connect(db)
+    conn.executescript("""
+        CREATE TABLE sewing_prices (id TEXT PRIMARY KEY, fabric TEXT NOT NULL, type TEXT NOT NULL,
+                                    unit_price REAL NOT NULL);
+        CREATE INDEX idx_sewing_prices_key ON sewing_prices(fabric, type);
+        INSERT INTO sewing_prices VALUES ('1', '布A', '單開', 100), ('2', '布A', '單開', 200),
+                                         ('3', '布A', '雙開', 300);
+    """)
+    conn.commit()
+    conn.close()
+
+    storage = SQLiteStorage(db)
+    assert len(storage.upgrade_notes) == 1 and "1 筆" in storage.upgrade_notes[0]
+    assert storage.query_one("PRAGMA user_version")[0] == 1
+    prices = SQLiteSewingPriceManager(storage)
+    assert [r["id"] for r in prices.get_all()] == ["1", "3"]
+    with pytest.raises(sqlite3.IntegrityError):
+        with storage.transaction() as conn:
+            conn.execute("INSERT INTO sewing_prices VALUES ('4', '布A', '單開', 1)")
+    storage.close()
+
+    storage = SQLiteStorage(db)
+    assert storage.upgrade_notes == []
+    storage.close()
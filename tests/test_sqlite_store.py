@@ -0,0 +1,95 @@
+# tests/test_sqlite_store.py
+
+import json
+
+import pytest
+
+from services.sqlite_store import (SQLiteCustomerManager, SQLiteSewingPriceManager, SQLiteStorage,
+                                   migrate_json_to_sqlite)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    s = SQLiteStorage(str(tmp_path / "curtain.db"))
+    yield s
+    s.close()
+
+
+def test_customers_and_projects_round_trip(tmp_path, storage):
+    customers = SQLiteCustomerManager(storage)
+    cust = customers.add("王小明", "0912", "台北市", "")
+    project = customers.add_project(cust["id"], "客廳")
+    assert customers.add_project("no-such-id", "客廳") is None
+    customers.update(cust["id"], phone="0988")
+    assert customers.update_project(cust["id"], project["id"], "主臥")["name"] == "主臥"
+
+    # 另一個連線（另一個程式）讀到相同的資料
+    other = SQLiteStorage(str(tmp_path / "curtain.db"))
+    reloaded = SQLiteCustomerManager(other).get_by_id(cust["id"])
+    assert reloaded["phone"] == "0988"
+    assert reloaded["projects"] == [{"id": project["id"], "name": "主臥"}]
+    assert [c["id"] for c in SQLiteCustomerManager(other).search("小明")] == [cust["id"]]
+
+    before = customers.storage.data_version()
+    SQLiteCustomerManager(other).add("李四", "", "", "")
+    other.close()
+    assert customers.storage.data_version() != before
+    assert customers.refresh() and not customers.refresh()
+    assert [name for page in customers.iter_name_pages(page_size=1) for _, name in page] == ["王小明", "李四"]
+
+    # 刪除客戶時案子一併刪除
+    customers.delete(cust["id"])
+    assert customers.get_project(project["id"]) == (None, None)
+    assert customers.count() == 1
+
+
+def test_failed_transaction_rolls_back(storage):
+    customers = SQLiteCustomerManager(storage)
+    with pytest.raises(RuntimeError):
+        with storage.transaction() as conn:
+            conn.execute("INSERT INTO customers (id, name) VALUES ('c1', '張三')")
+            raise RuntimeError
+    assert customers.count() == 0
+
+
+def test_sewing_prices(storage):
+    prices = SQLiteSewingPriceManager(storage)
+    rec = prices.add("布A", "單開", 350)
+    prices.add("布A", "雙開", 0)
+    assert prices.get_price("布A", "單開") == 350
+    assert prices.get_price("布A", "雙開") == 0   # 單價 0 不是查無單價
+    assert prices.get_price("布B", "單開") is None
+    assert prices.get_types("布A") == ["單開", "雙開"]
+    with pytest.raises(ValueError):
+        prices.add("布A", "單開", 1)
+    prices.update(rec["id"], unit_price=360)
+    assert prices.get_price("布A", "單開") == 360
+    prices.delete(rec["id"])
+    with pytest.raises(KeyError):
+        prices.delete(rec["id"])
+
+
+def test_migrate_json_to_sqlite_is_idempotent(tmp_path):
+    (tmp_path / "customers.json").write_text(json.dumps([
+        {"id": "c1", "name": "王小明", "phone": "", "address": "", "template_path": "",
+         "projects": [{"id": "p1", "name": "客廳"}]},
+    ], ensure_ascii=False), encoding="utf-8")
+    (tmp_path / "sewing_prices.json").write_text(json.dumps([
+        {"id": "s1", "fabric": "布A", "type": "單開", "unit_price": 350},
+        {"id": "s2", "fabric": "布A", "type": "單開", "unit_price": 999},
+    ], ensure_ascii=False), encoding="utf-8")
+
+    stats, skipped = migrate_json_to_sqlite(str(tmp_path))
+    assert skipped == []
+    assert (stats["customers"], stats["projects"], stats["sewing_prices"]) == (1, 1, 1)
+    assert stats["sewing_price_duplicates"] == 1
+
+    # 重跑不會重複匯入，也不會刪掉已存在客戶的案子
+    migrate_json_to_sqlite(str(tmp_path))
+    storage = SQLiteStorage(str(tmp_path / "curtain.db"))
+    customers = SQLiteCustomerManager(storage)
+    assert customers.count() == 1
+    assert customers.get_projects("c1") == [{"id": "p1", "name": "客廳"}]
+    # 重複的 (布料, 形式) 保留第一筆，與 JSON 版查價結果一致
+    assert SQLiteSewingPriceManager(storage).get_price("布A", "單開") == 350
+    storage.close()